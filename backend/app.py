@@ -1,13 +1,28 @@
 # app.py
 import os
+import asyncio
 from pathlib import Path
-from fastapi import FastAPI
+import time
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 from starlette.staticfiles import StaticFiles
-from routers import chat
-from models import Base
-from deps import engine
+from routers import chat, jobs
+from deps import engine, AsyncSessionLocal
+from migrations import upgrade
+from services.http_client import open_http_client, close_http_client
+from services.executor import shutdown_tool_executor, pending_tools
+from services.llm import llm_cache, tool_cache, inflight
+from services.csv_tools import df_cache
+from services.plots import plot_cache_stats
+from services.images import vision_payloads
+from services.openai_scheduler import openai_scheduler, session_turns
+from services.jobs import job_runner
+from services import lazy
+from services.metrics import (
+    SERVER_TIMING, start_trace, end_trace, server_timing_header, render_metrics, register_gauges, http_request_seconds,
+)
 
 BASE_DIR = Path(__file__).resolve().parent
 load_dotenv(BASE_DIR / ".env")
@@ -24,13 +39,64 @@ app.add_middleware(
 )
 
 app.include_router(chat.router)
+app.include_router(jobs.router)
+
+register_gauges("llm_cache", llm_cache.stats)
+register_gauges("tool_cache", tool_cache.stats)
+register_gauges("csv_df_cache", df_cache.stats)
+register_gauges("plot_cache", plot_cache_stats)
+register_gauges("vision_payload_cache", vision_payloads.stats)
+register_gauges("tool_executor", lambda: {"pending": pending_tools()})
+register_gauges("singleflight", inflight.stats)
+register_gauges("openai_scheduler", openai_scheduler.stats)
+register_gauges("chat_session_turns", session_turns.stats)
+register_gauges("jobs", job_runner.stats)
+register_gauges("lazy_imports", lazy.stats)
+
+
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    # Server-Timing: bật cho mọi request bằng SERVER_TIMING=1, hoặc từng request bằng header X-Server-Timing: 1
+    token, timings = start_trace(SERVER_TIMING or request.headers.get("x-server-timing") == "1")
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        end_trace(token)
+    # với StreamingResponse đây là thời gian tới khi bắt đầu stream
+    elapsed = time.perf_counter() - started
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    http_request_seconds.observe(elapsed, method=request.method, route=route, status=response.status_code)
+    if timings is not None:
+        response.headers["Server-Timing"] = server_timing_header(timings, elapsed * 1000)
+    return response
 
 app.mount("/static", StaticFiles(directory=BASE_DIR / "uploads"), name="static")
 
 @app.on_event("startup")
-def on_startup():
-    Base.metadata.create_all(bind=engine)
+async def on_startup():
+    upgrade(engine)
+    app.state.http_client = await open_http_client()
+    # job nền còn dở từ lần chạy trước (queued, hoặc running đã hết lease) được chạy tiếp
+    await job_runner.start(AsyncSessionLocal, deliver=chat.deliver_job_result)
+    if lazy.PREWARM:
+        # pandas / matplotlib / PIL import trong thread nền: worker nhận request ngay, tool đầu tiên không phải chờ import
+        app.state.prewarm_task = asyncio.create_task(asyncio.to_thread(lazy.prewarm))
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await job_runner.stop()
+    await close_http_client()
+    shutdown_tool_executor()
 
 @app.get("/health")
 def health():
     return {"ok": True}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {"llm": llm_cache.stats(), "tools": tool_cache.stats()}
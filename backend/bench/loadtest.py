@@ -0,0 +1,255 @@
+# bench/loadtest.py
+"""
+Benchmark end-to-end: mỗi "user ảo" chạy một session gồm các phase
+    chat_csv (upload CSV) -> chat_followup -> chat_image (upload ảnh) -> sessions -> messages
+với `--concurrency` session song song, rồi in throughput + p50/p95/p99 theo phase.
+Header Server-Timing (nếu backend trả về) được gộp thành các phase con, ví dụ `chat_csv/llm`.
+
+    python -m bench.loadtest --base-url http://127.0.0.1:8000 --sessions 64 --concurrency 16
+    python -m bench.loadtest ... --json out.json --compare baseline.json --max-regression 0.2
+"""
+import argparse
+import asyncio
+import csv
+import json
+import math
+import random
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+
+def make_csv(path: Path, rows: int) -> Path:
+    rng = random.Random(42)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["id", "value", "price", "category"])
+        for i in range(rows):
+            w.writerow([i, round(rng.gauss(50, 15), 3), round(rng.uniform(1, 500), 2), rng.choice("ABCDE")])
+    return path
+
+
+def make_image(path: Path, size=(1600, 1200)) -> Path:
+    from PIL import Image
+    import numpy as np
+
+    Image.fromarray(np.random.default_rng(0).integers(0, 255, (size[1], size[0], 3), dtype="uint8")).save(path, quality=90)
+    return path
+
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    """
+    'db;dur=1.2, llm;dur=350' -> {"db": 1.2, "llm": 350.0} (ms)
+    """
+    out: Dict[str, float] = {}
+    for item in (header or "").split(","):
+        parts = [p.strip() for p in item.split(";")]
+        if not parts[0]:
+            continue
+        for p in parts[1:]:
+            if p.startswith("dur="):
+                try:
+                    out[parts[0]] = out.get(parts[0], 0.0) + float(p[4:])
+                except ValueError:
+                    pass
+    return out
+
+
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)  # ms
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def add(self, phase: str, ms: float, ok: bool, timing: Optional[Dict[str, float]] = None) -> None:
+        if not ok:
+            self.errors[phase] += 1
+            return
+        self.samples[phase].append(ms)
+        for name, dur in (timing or {}).items():
+            self.samples[f"{phase}/{name}"].append(dur)
+
+    def summary(self, wall_s: float) -> Dict[str, dict]:
+        out = {}
+        for phase in sorted(set(self.samples) | set(self.errors)):
+            xs = sorted(self.samples.get(phase, []))
+            out[phase] = {
+                "count": len(xs),
+                "errors": self.errors.get(phase, 0),
+                "rps": round(len(xs) / wall_s, 2) if wall_s else 0.0,
+                "mean": round(sum(xs) / len(xs), 2) if xs else None,
+                "p50": percentile(xs, 50),
+                "p95": percentile(xs, 95),
+                "p99": percentile(xs, 99),
+            }
+        return out
+
+
+def percentile(sorted_xs: List[float], q: float) -> Optional[float]:
+    if not sorted_xs:
+        return None
+    k = min(len(sorted_xs) - 1, max(0, math.ceil(q / 100 * len(sorted_xs)) - 1))  # nearest-rank
+    return round(sorted_xs[k], 2)
+
+
+async def _timed(rec: Recorder, phase: str, send) -> Optional[httpx.Response]:
+    t0 = time.perf_counter()
+    try:
+        r = await send()
+    except httpx.HTTPError:
+        rec.add(phase, 0, ok=False)
+        return None
+    ms = (time.perf_counter() - t0) * 1000
+    rec.add(phase, ms, ok=r.status_code < 400, timing=parse_server_timing(r.headers.get("server-timing")))
+    return r
+
+
+async def _timed_stream(rec: Recorder, client: httpx.AsyncClient, phase: str, data: dict, files: Optional[dict]) -> None:
+    # /chat/stream: đo thêm time-to-first-byte và time-to-first-delta
+    t0 = time.perf_counter()
+    try:
+        async with client.stream("POST", "/chat/stream", data=data, files=files) as r:
+            first_byte = first_delta = None
+            ok = r.status_code < 400
+            async for line in r.aiter_lines():
+                now = time.perf_counter()
+                first_byte = first_byte or now
+                if line.startswith("event: delta") and first_delta is None:
+                    first_delta = now
+                if line.startswith("event: error"):
+                    ok = False
+    except httpx.HTTPError:
+        rec.add(phase, 0, ok=False)
+        return
+    end = time.perf_counter()
+    rec.add(phase, (end - t0) * 1000, ok=ok)
+    if ok and first_byte:
+        rec.add(f"{phase}:ttfb", (first_byte - t0) * 1000, ok=True)
+    if ok and first_delta:
+        rec.add(f"{phase}:first_delta", (first_delta - t0) * 1000, ok=True)
+
+
+async def run_session(client: httpx.AsyncClient, rec: Recorder, args, csv_path: Path, image_path: Optional[Path]) -> None:
+    sid = f"bench-{uuid.uuid4().hex[:10]}"
+
+    async def chat(phase: str, message: str, upload: Optional[tuple] = None):
+        data = {"session_id": sid, "message": message}
+        if args.no_cache:
+            data["no_cache"] = "true"
+        files = None
+        if upload:
+            path, mime = upload
+            files = {"file": (path.name, path.read_bytes(), mime)}
+        if args.stream:
+            await _timed_stream(rec, client, phase, data, files)
+        else:
+            await _timed(rec, phase, lambda: client.post("/chat", data=data, files=files))
+
+    await chat("chat_csv", "Analyze this CSV and plot the value column.", (csv_path, "text/csv"))
+    for _ in range(args.followups):
+        await chat("chat_followup", "Summarize the dataset again and show the histogram of value.")
+    if image_path:
+        await chat("chat_image", "What is in this picture?", (image_path, "image/jpeg"))
+    await _timed(rec, "sessions", lambda: client.get("/sessions", params={"limit": 50}))
+    await _timed(rec, "messages", lambda: client.get(f"/sessions/{sid}/messages"))
+
+
+async def run(args) -> dict:
+    tmp = Path(tempfile.mkdtemp(prefix="chat-bench-"))
+    csv_path = args.csv or make_csv(tmp / "bench.csv", args.csv_rows)
+    image_path = None if args.no_image else (args.image or make_image(tmp / "bench.jpg"))
+
+    rec = Recorder()
+    sem = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+
+    # X-Server-Timing: backend trả header Server-Timing -> báo cáo thêm các phase con (llm, tool, db...)
+    headers = {"X-Server-Timing": "1"}
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits, headers=headers) as client:
+        async def one():
+            async with sem:
+                await run_session(client, rec, args, csv_path, image_path)
+
+        if args.warmup:
+            await asyncio.gather(*(run_session(client, Recorder(), args, csv_path, image_path) for _ in range(args.warmup)))
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(args.sessions)))
+        wall = time.perf_counter() - t0
+
+    total = sum(len(v) for k, v in rec.samples.items() if "/" not in k and ":" not in k)
+    return {
+        "config": {
+            "base_url": args.base_url, "sessions": args.sessions, "concurrency": args.concurrency,
+            "followups": args.followups, "stream": args.stream, "csv_rows": args.csv_rows,
+            "image": image_path is not None,
+        },
+        "wall_seconds": round(wall, 3),
+        "requests_per_second": round(total / wall, 2) if wall else 0.0,
+        "phases": rec.summary(wall),
+    }
+
+
+def print_report(result: dict) -> None:
+    print(f"\n{result['config']}")
+    print(f"wall {result['wall_seconds']}s, {result['requests_per_second']} req/s\n")
+    cols = ("count", "errors", "rps", "mean", "p50", "p95", "p99")
+    print(f"{'phase (ms)':<32}" + "".join(f"{c:>10}" for c in cols))
+    for phase, s in result["phases"].items():
+        print(f"{phase:<32}" + "".join(f"{'-' if s[c] is None else s[c]:>10}" for c in cols))
+
+
+def compare(result: dict, baseline: dict, max_regression: float) -> List[str]:
+    """
+    So p95 từng phase với baseline; trả về các phase chậm hơn quá `max_regression` (0.2 = 20%).
+    """
+    failures = []
+    for phase, s in result["phases"].items():
+        base = baseline.get("phases", {}).get(phase)
+        if not base or not base.get("p95") or s["p95"] is None:
+            continue
+        ratio = s["p95"] / base["p95"] - 1
+        if ratio > max_regression:
+            failures.append(f"{phase}: p95 {base['p95']} -> {s['p95']} ms (+{ratio:.0%})")
+        if s["errors"] > base.get("errors", 0):
+            failures.append(f"{phase}: errors {base.get('errors', 0)} -> {s['errors']}")
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test for the chat backend")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--sessions", type=int, default=32, help="number of simulated chat sessions")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--followups", type=int, default=1, help="text-only turns after the CSV upload")
+    parser.add_argument("--warmup", type=int, default=0, help="sessions run before measuring")
+    parser.add_argument("--stream", action="store_true", help="use /chat/stream instead of /chat")
+    parser.add_argument("--no-cache", action="store_true", help="send no_cache=true (bypass LLM response cache)")
+    parser.add_argument("--csv", type=Path)
+    parser.add_argument("--csv-rows", type=int, default=5000)
+    parser.add_argument("--image", type=Path)
+    parser.add_argument("--no-image", action="store_true")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--json", type=Path, help="write results as JSON")
+    parser.add_argument("--compare", type=Path, help="baseline JSON from a previous run")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.json:
+        args.json.write_text(json.dumps(result, indent=2), encoding="utf-8")
+    if args.compare:
+        failures = compare(result, json.loads(args.compare.read_text(encoding="utf-8")), args.max_regression)
+        if failures:
+            print("\nRegressions:\n  " + "\n  ".join(failures))
+            sys.exit(1)
+        print("\nNo regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
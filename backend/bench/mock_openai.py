@@ -0,0 +1,184 @@
+# bench/mock_openai.py
+"""
+Server giả lập OpenAI /v1/chat/completions để benchmark backend mà không gọi API thật.
+
+    python -m bench.mock_openai --port 9000 --latency-ms 400 --chunk-delay-ms 20
+    OPENAI_URL=http://127.0.0.1:9000/v1/chat/completions OPENAI_API_KEY=test uvicorn app:app
+
+Kịch bản tool-call (--script file.json) là danh sách các bước; bước thứ k được trả về khi request
+đã có k round tool-call của assistant sau user message cuối:
+    [{"tool_calls": [{"name": "get_context_assets", "arguments": {"prefer": "csv"}}]},
+     {"tool_calls": [{"name": "analyze_csv", "arguments": {"question": "overview"}}]},
+     {"content": "Here is the summary."}]
+Request không có `tools` (rolling summary, vision) luôn nhận câu trả lời text.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from pathlib import Path
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+DEFAULT_SCRIPT = [
+    {"tool_calls": [{"name": "get_context_assets", "arguments": {"prefer": "csv"}}]},
+    {"tool_calls": [
+        {"name": "analyze_csv", "arguments": {"question": "Give me an overview"}},
+        {"name": "plot_histogram", "arguments": {"column": "value"}},
+    ]},
+    {"content": "The dataset has a roughly normal `value` column; see the overview table and histogram above."},
+]
+TEXT_REPLY = "This is a canned answer from the local mock server, long enough to be streamed in a few chunks."
+
+CONFIG = {
+    "script": DEFAULT_SCRIPT,
+    "latency_ms": 300.0,   # trước token đầu tiên
+    "jitter_ms": 50.0,
+    "chunk_delay_ms": 15.0,
+    "error_rate": 0.0,     # tỉ lệ trả 429 (thử retry/backoff)
+}
+STATS = {"requests": 0, "streamed": 0, "errors_injected": 0}
+
+app = FastAPI(title="Mock OpenAI")
+
+
+def _tool_rounds(messages: list) -> int:
+    rounds = 0
+    for m in messages:
+        if m.get("role") == "user":
+            rounds = 0
+        elif m.get("role") == "assistant" and m.get("tool_calls"):
+            rounds += 1
+    return rounds
+
+
+def _next_step(body: dict) -> dict:
+    if not body.get("tools"):
+        return {"content": TEXT_REPLY}
+    script = CONFIG["script"]
+    k = _tool_rounds(body.get("messages") or [])
+    if k < len(script):
+        return script[k]
+    last = script[-1] if script else {}
+    return last if "content" in last else {"content": TEXT_REPLY}
+
+
+def _tool_calls(step: dict) -> list:
+    return [
+        {"id": f"call_{uuid.uuid4().hex[:12]}", "type": "function",
+         "function": {"name": tc["name"], "arguments": json.dumps(tc.get("arguments") or {})}}
+        for tc in step["tool_calls"]
+    ]
+
+
+def _chunks(text: str) -> list:
+    words = text.split(" ")
+    return [w + (" " if i < len(words) - 1 else "") for i, w in enumerate(words)]
+
+
+def _usage(body: dict, completion: str) -> dict:
+    prompt = sum(len(str(m.get("content") or "")) for m in body.get("messages") or []) // 4
+    out = len(completion) // 4
+    return {"prompt_tokens": prompt, "completion_tokens": out, "total_tokens": prompt + out}
+
+
+async def _first_token_delay() -> None:
+    delay = CONFIG["latency_ms"] + random.uniform(-CONFIG["jitter_ms"], CONFIG["jitter_ms"])
+    await asyncio.sleep(max(0.0, delay) / 1000)
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    STATS["requests"] += 1
+    if CONFIG["error_rate"] and random.random() < CONFIG["error_rate"]:
+        STATS["errors_injected"] += 1
+        return JSONResponse(
+            {"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_error"}},
+            status_code=429, headers={"Retry-After": "1"},
+        )
+
+    step = _next_step(body)
+    model = body.get("model", "mock")
+    created = int(time.time())
+
+    if body.get("stream"):
+        STATS["streamed"] += 1
+
+        async def sse():
+            await _first_token_delay()
+            base = {"id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "object": "chat.completion.chunk", "created": created, "model": model}
+            if "tool_calls" in step:
+                for i, tc in enumerate(_tool_calls(step)):
+                    args = tc["function"]["arguments"]
+                    half = len(args) // 2
+                    for part in (
+                        {"index": i, "id": tc["id"], "type": "function", "function": {"name": tc["function"]["name"], "arguments": args[:half]}},
+                        {"index": i, "function": {"arguments": args[half:]}},
+                    ):
+                        yield f"data: {json.dumps({**base, 'choices': [{'index': 0, 'delta': {'tool_calls': [part]}}]})}\n\n"
+                        await asyncio.sleep(CONFIG["chunk_delay_ms"] / 1000)
+                finish = "tool_calls"
+            else:
+                for piece in _chunks(step["content"]):
+                    yield f"data: {json.dumps({**base, 'choices': [{'index': 0, 'delta': {'content': piece}}]})}\n\n"
+                    await asyncio.sleep(CONFIG["chunk_delay_ms"] / 1000)
+                finish = "stop"
+            yield f"data: {json.dumps({**base, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': finish}]})}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(sse(), media_type="text/event-stream")
+
+    await _first_token_delay()
+    if "tool_calls" in step:
+        message = {"role": "assistant", "content": None, "tool_calls": _tool_calls(step)}
+        finish, text = "tool_calls", json.dumps(step["tool_calls"])
+        n_chunks = 2 * len(step["tool_calls"])
+    else:
+        message = {"role": "assistant", "content": step["content"]}
+        finish, text = "stop", step["content"]
+        n_chunks = len(_chunks(text))
+    # non-stream: tổng thời gian tương đương bản stream
+    await asyncio.sleep(n_chunks * CONFIG["chunk_delay_ms"] / 1000)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "message": message, "finish_reason": finish}],
+        "usage": _usage(body, text),
+    }
+
+
+@app.get("/stats")
+def stats():
+    return STATS
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local OpenAI chat-completions stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--script", type=Path, help="JSON file with the tool-call script")
+    parser.add_argument("--latency-ms", type=float, default=CONFIG["latency_ms"])
+    parser.add_argument("--jitter-ms", type=float, default=CONFIG["jitter_ms"])
+    parser.add_argument("--chunk-delay-ms", type=float, default=CONFIG["chunk_delay_ms"])
+    parser.add_argument("--error-rate", type=float, default=CONFIG["error_rate"])
+    args = parser.parse_args()
+
+    if args.script:
+        CONFIG["script"] = json.loads(args.script.read_text(encoding="utf-8"))
+    CONFIG.update(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        chunk_delay_ms=args.chunk_delay_ms, error_rate=args.error_rate,
+    )
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
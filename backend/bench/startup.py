@@ -0,0 +1,187 @@
+# bench/startup.py
+"""
+Benchmark khởi động worker, mỗi lần đo là một process mới (cold start):
+    import   : thời gian `import app` + các thư viện nặng đã bị kéo vào lúc import
+    server   : spawn uvicorn -> GET /health trả 200 (time-to-first-request), request /sessions đầu tiên,
+               và (PREWARM=1) lúc prewarm nền xong, đọc từ gauge lazy_imports_prewarm_done trên /metrics
+
+    python -m bench.startup --runs 5
+    python -m bench.startup --runs 5 --no-prewarm --json out.json --compare baseline.json
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+HEAVY_MODULES = ("pandas", "numpy", "matplotlib", "PIL", "pyarrow")
+
+_IMPORT_PROBE = f"""
+import json, sys, time
+started = time.perf_counter()
+import app
+print(json.dumps({{
+    "import_s": time.perf_counter() - started,
+    "heavy_loaded": [m for m in {HEAVY_MODULES!r} if m in sys.modules],
+}}))
+"""
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _env(tmp: Path, prewarm: bool) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "bench")  # không gọi OpenAI, chỉ để import llm
+    env["DATABASE_URL"] = f"sqlite:///{tmp / 'db.sqlite3'}"  # DB riêng, không đụng db.sqlite3 thật
+    env["PREWARM"] = "1" if prewarm else "0"
+    return env
+
+
+def measure_import(env: Dict[str, str]) -> dict:
+    started = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, "-c", _IMPORT_PROBE], cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result["process_s"] = time.perf_counter() - started
+    return result
+
+
+def _metric(text: str, name: str) -> Optional[float]:
+    for line in text.splitlines():
+        if line.startswith(name + " "):
+            return float(line.split()[1])
+    return None
+
+
+def measure_server(env: Dict[str, str], prewarm: bool, timeout: float) -> dict:
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    result: dict = {}
+    try:
+        with httpx.Client(base_url=base, timeout=5) as client:
+            while True:
+                if proc.poll() is not None:
+                    raise RuntimeError(f"uvicorn exited: {proc.stderr.read().decode(errors='replace')[-2000:]}")
+                if time.perf_counter() - started > timeout:
+                    raise TimeoutError(f"server not ready after {timeout}s")
+                try:
+                    if client.get("/health").status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.01)
+            result["first_request_s"] = time.perf_counter() - started
+
+            t = time.perf_counter()
+            client.get("/sessions").raise_for_status()
+            result["first_sessions_ms"] = (time.perf_counter() - t) * 1000
+
+            if prewarm:
+                while time.perf_counter() - started < timeout:
+                    text = client.get("/metrics").text
+                    if _metric(text, "lazy_imports_prewarm_done") == 1:
+                        result["warm_s"] = time.perf_counter() - started
+                        result["prewarm_s"] = _metric(text, "lazy_imports_prewarm_seconds")
+                        break
+                    time.sleep(0.05)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return result
+
+
+def _summary(values: List[float]) -> dict:
+    return {"median": round(statistics.median(values), 4), "min": round(min(values), 4), "max": round(max(values), 4)}
+
+
+def run(args) -> dict:
+    samples: Dict[str, List[float]] = {}
+    heavy: set = set()
+    for i in range(args.runs):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = _env(Path(tmp), args.prewarm)
+            imp = measure_import(env)
+            heavy.update(imp["heavy_loaded"])
+            srv = measure_server(env, args.prewarm, args.timeout)
+        for k, v in {**imp, **srv}.items():
+            if isinstance(v, (int, float)):
+                samples.setdefault(k, []).append(v)
+        print(f"run {i + 1}/{args.runs}: import {imp['import_s']:.3f}s, first request {srv['first_request_s']:.3f}s"
+              + (f", warm {srv['warm_s']:.3f}s" if "warm_s" in srv else ""))
+    return {
+        "runs": args.runs,
+        "prewarm": args.prewarm,
+        "heavy_modules_at_import": sorted(heavy),
+        "metrics": {k: _summary(v) for k, v in samples.items()},
+    }
+
+
+def print_report(result: dict) -> None:
+    print(f"\nruns={result['runs']} prewarm={result['prewarm']} "
+          f"heavy modules at import: {', '.join(result['heavy_modules_at_import']) or 'none'}")
+    print(f"{'metric':<22}{'median':>10}{'min':>10}{'max':>10}")
+    for name, s in result["metrics"].items():
+        print(f"{name:<22}{s['median']:>10}{s['min']:>10}{s['max']:>10}")
+
+
+def compare(result: dict, baseline: dict, max_regression: float) -> List[str]:
+    """
+    So median từng metric với baseline; trả về các metric chậm hơn quá `max_regression` (0.2 = 20%).
+    """
+    failures = []
+    for name, s in result["metrics"].items():
+        base = baseline.get("metrics", {}).get(name)
+        if not base or not base.get("median"):
+            continue
+        ratio = s["median"] / base["median"] - 1
+        if ratio > max_regression:
+            failures.append(f"{name}: median {base['median']} -> {s['median']} (+{ratio:.0%})")
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Cold-start benchmark for the chat backend")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--no-prewarm", dest="prewarm", action="store_false", help="start workers with PREWARM=0")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--json", type=Path, help="write results as JSON")
+    parser.add_argument("--compare", type=Path, help="baseline JSON from a previous run")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+
+    result = run(args)
+    print_report(result)
+    if args.json:
+        args.json.write_text(json.dumps(result, indent=2), encoding="utf-8")
+    if args.compare:
+        failures = compare(result, json.loads(args.compare.read_text(encoding="utf-8")), args.max_regression)
+        if failures:
+            print("\nRegressions:\n  " + "\n  ".join(failures))
+            sys.exit(1)
+        print("\nNo regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+# migrations.py
+import os
+import json
+import time
+import hashlib
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import OperationalError
+
+from models import Base
+
+# Migration dữ liệu có đánh số, mỗi cái chạy đúng một lần (ghi vào bảng schema_migrations).
+# Thay đổi schema dạng cộng thêm (bảng / cột nullable / index mới) được sync tự động trước đó.
+
+# Nhiều worker khởi động cùng lúc: chỉ một process nâng cấp, các process khác chờ tối đa chừng này giây
+DB_UPGRADE_LOCK_TIMEOUT = float(os.getenv("DB_UPGRADE_LOCK_TIMEOUT", "300"))
+_PG_UPGRADE_LOCK_ID = 720514  # id khoá advisory của Postgres, cố định cho app này
+
+
+def _backfill_session_aggregates(conn: Connection) -> None:
+    # message_count / last_message_at / last_message_preview cho các session có từ trước
+    conn.execute(text("""
+        UPDATE sessions SET
+            message_count = (SELECT count(*) FROM messages m WHERE m.session_id = sessions.id),
+            last_message_at = (SELECT max(m.created_at) FROM messages m WHERE m.session_id = sessions.id),
+            last_message_preview = (
+                SELECT substr(m.content, 1, 200) FROM messages m
+                WHERE m.session_id = sessions.id
+                ORDER BY m.created_at DESC, m.id DESC LIMIT 1
+            )
+        WHERE message_count IS NULL
+    """))
+
+
+def _normalize_sqlite_updated_at(conn: Connection) -> None:
+    # bản cũ ghi updated_at bằng func.now() ('YYYY-MM-DD HH:MM:SS'), chuẩn hoá để so sánh keyset đúng
+    if conn.dialect.name == "sqlite":
+        conn.execute(text(
+            "UPDATE sessions SET updated_at = updated_at || '.000000' WHERE length(updated_at) = 19"
+        ))
+
+
+def _backfill_latest_asset_pointers(conn: Connection) -> None:
+    for kind in ("csv", "image"):
+        conn.execute(text(f"""
+            UPDATE sessions SET latest_{kind}_attachment_id = (
+                SELECT a.id FROM attachments a JOIN messages m ON a.message_id = m.id
+                WHERE m.session_id = sessions.id AND a.kind = :kind
+                ORDER BY a.created_at DESC, a.id DESC LIMIT 1
+            )
+            WHERE latest_{kind}_attachment_id IS NULL
+        """), {"kind": kind})
+
+
+MIGRATIONS = [
+    (1, "backfill session aggregates", _backfill_session_aggregates),
+    (2, "normalize sqlite updated_at", _normalize_sqlite_updated_at),
+    (3, "backfill latest csv/image pointers", _backfill_latest_asset_pointers),
+]
+
+
+def _sync_additive_schema(engine: Engine, conn: Connection) -> None:
+    # Tạo bảng còn thiếu, thêm cột mới (nullable) và index mà db.sqlite3 cũ chưa có
+    Base.metadata.create_all(bind=conn)
+    insp = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {c["name"] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name in existing:
+                continue
+            coltype = col.type.compile(dialect=engine.dialect)
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {col.name} {coltype}"))
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def schema_fingerprint(engine: Engine) -> str:
+    # đổi model (bảng / cột / index) hoặc thêm migration -> fingerprint mới -> lần boot sau sync lại
+    parts: list = [engine.dialect.name, [version for version, _, _ in MIGRATIONS]]
+    for table in Base.metadata.sorted_tables:
+        parts.append([
+            table.name,
+            [[c.name, str(c.type.compile(dialect=engine.dialect))] for c in table.columns],
+            sorted(i.name for i in table.indexes),
+        ])
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+
+def _stored_fingerprint(conn: Connection) -> str | None:
+    if not inspect(conn).has_table("schema_state"):
+        return None
+    row = conn.execute(text("SELECT fingerprint FROM schema_state WHERE id = 1")).first()
+    return row[0] if row else None
+
+
+def _is_current(engine: Engine, fingerprint: str) -> bool:
+    with engine.connect() as conn:
+        return _stored_fingerprint(conn) == fingerprint
+
+
+def _lock_for_upgrade(conn: Connection) -> None:
+    """
+    Giữ khoá ghi của cả DB tới khi conn commit/rollback, để hai worker không cùng CREATE TABLE /
+    ADD COLUMN. SQLite: BEGIN IMMEDIATE (DDL của SQLite cũng nằm trong transaction).
+    Postgres: advisory lock theo transaction.
+    """
+    if conn.dialect.name == "sqlite":
+        deadline = time.monotonic() + DB_UPGRADE_LOCK_TIMEOUT
+        while True:
+            try:
+                conn.exec_driver_sql("BEGIN IMMEDIATE")
+                return
+            except OperationalError as e:
+                # busy_timeout đã chờ sẵn; worker kia nâng cấp lâu hơn thì thử lại tới deadline
+                conn.rollback()
+                if "locked" not in str(e) or time.monotonic() > deadline:
+                    raise
+    elif conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": _PG_UPGRADE_LOCK_ID})
+
+
+def upgrade(engine: Engine, *, force: bool = False) -> list[int]:
+    """
+    Nâng cấp DB tại chỗ: sync schema cộng thêm, rồi chạy các migration dữ liệu chưa áp dụng.
+    DB đã ở đúng schema_fingerprint() thì bỏ qua hết (một SELECT thay vì create_all + reflect mọi bảng
+    mỗi lần worker khởi động); `force=True` luôn sync.
+    Cả quá trình chạy dưới _lock_for_upgrade(): worker chờ khoá xong thấy fingerprint đã khớp thì bỏ qua.
+    Returns danh sách version vừa áp dụng.
+    """
+    fingerprint = schema_fingerprint(engine)
+    if not force and _is_current(engine, fingerprint):
+        return []
+    applied_now: list[int] = []
+    with engine.connect() as conn:
+        _lock_for_upgrade(conn)
+        if not force and _stored_fingerprint(conn) == fingerprint:
+            conn.rollback()
+            return []
+        _sync_additive_schema(engine, conn)
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY, name VARCHAR(200), applied_at TIMESTAMP)"
+        ))
+        done = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+        for version, name, fn in MIGRATIONS:
+            if version in done:
+                continue
+            fn(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+                {"v": version, "n": name, "t": datetime.utcnow()},
+            )
+            applied_now.append(version)
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_state (id INTEGER PRIMARY KEY, fingerprint VARCHAR(64), updated_at TIMESTAMP)"
+        ))
+        conn.execute(text("DELETE FROM schema_state"))
+        conn.execute(
+            text("INSERT INTO schema_state (id, fingerprint, updated_at) VALUES (1, :f, :t)"),
+            {"f": fingerprint, "t": datetime.utcnow()},
+        )
+        conn.commit()
+    return applied_now
+
+
+if __name__ == "__main__":
+    from deps import engine
+
+    # chạy tay: luôn sync, kể cả khi fingerprint khớp (vd. sau khi sửa DB bằng tay)
+    print("Applied migrations:", upgrade(engine, force=True) or "none")
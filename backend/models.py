@@ -1,7 +1,7 @@
 from __future__ import annotations
 from datetime import datetime
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-from sqlalchemy import String, Text, ForeignKey, Integer, DateTime, JSON
+from sqlalchemy import String, Text, ForeignKey, Integer, Float, DateTime, JSON, Index
 
 class Base(DeclarativeBase):
     pass
@@ -12,11 +12,23 @@ class SessionChat(Base):
     title: Mapped[str | None] = mapped_column(String(200), nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    # rolling summary của các message cũ (id <= summary_upto_id) không còn gửi nguyên văn cho model
+    summary: Mapped[str | None] = mapped_column(Text, nullable=True)
+    summary_upto_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    # aggregate denormalized, cập nhật trong transaction của /chat (GET /sessions chỉ cần 1 query)
+    last_message_preview: Mapped[str | None] = mapped_column(String(200), nullable=True)
+    last_message_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    message_count: Mapped[int | None] = mapped_column(Integer, default=0, nullable=True)
+    # con trỏ tới csv/ảnh mới nhất của session, cập nhật khi insert attachment -> resolve asset O(1)
+    latest_csv_attachment_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    latest_image_attachment_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
 
     messages: Mapped[list["Message"]] = relationship(
         back_populates="session", cascade="all, delete-orphan", order_by="Message.created_at"
     )
 
+    __table_args__ = (Index("ix_sessions_updated_at_id", "updated_at", "id"),)
+
 class Message(Base):
     __tablename__ = "messages"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
@@ -31,6 +43,8 @@ class Message(Base):
         back_populates="message", cascade="all, delete-orphan"
     )
 
+    __table_args__ = (Index("ix_messages_session_id_id", "session_id", "id"),)
+
 class Attachment(Base):
     __tablename__ = "attachments"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
@@ -39,6 +53,36 @@ class Attachment(Base):
     path: Mapped[str] = mapped_column(Text)        # absolute or project-relative path
     original_name: Mapped[str | None] = mapped_column(String(255), nullable=True)
     mime: Mapped[str | None] = mapped_column(String(128), nullable=True)
+    sidecar_path: Mapped[str | None] = mapped_column(Text, nullable=True)  # Arrow sidecar của csv
+    profile: Mapped[dict | None] = mapped_column(JSON, nullable=True)      # sha256, bytes, rows, columns, dtypes
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     message: Mapped["Message"] = relationship(back_populates="attachments")
+
+    __table_args__ = (Index("ix_attachments_message_id_kind", "message_id", "kind"),)
+
+class Job(Base):
+    __tablename__ = "jobs"
+    id: Mapped[str] = mapped_column(String(32), primary_key=True)  # uuid4 hex
+    session_id: Mapped[str] = mapped_column(ForeignKey("sessions.id", ondelete="CASCADE"))
+    kind: Mapped[str] = mapped_column(String(32))  # 'analyze_csv' | 'plot_histograms'
+    args: Mapped[dict] = mapped_column(JSON)
+    status: Mapped[str] = mapped_column(String(16), default="queued")  # queued | running | done | error | cancelled
+    progress: Mapped[float] = mapped_column(Float, default=0.0)
+    markdown: Mapped[str | None] = mapped_column(Text, nullable=True)  # kết quả từng phần khi running, đầy đủ khi done
+    result: Mapped[dict | None] = mapped_column(JSON, nullable=True)   # tool_outputs + attachments
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    message_id: Mapped[int | None] = mapped_column(Integer, nullable=True)  # assistant message chứa kết quả
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    # worker đang chạy job giữ lease, gia hạn định kỳ; lease hết hạn (worker chết/restart) -> job được chạy lại
+    lease_owner: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    lease_until: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    started_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_jobs_status_created_at", "status", "created_at"),
+        Index("ix_jobs_session_id_created_at", "session_id", "created_at"),
+    )
@@ -1,17 +1,28 @@
 # routers/chat.py
 from typing import Optional, List
+from datetime import datetime
 from pathlib import Path
-import shutil
+import asyncio
+import base64
+import json
+import math
+import os
+import uuid
 
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Query
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
-from sqlalchemy import select, func, desc
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Query, Request, BackgroundTasks
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.orm import Session, selectinload, load_only
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, desc, func
 
-from deps import get_db
-from models import SessionChat, Message, Attachment
-from services.llm import chat_orchestrator  # dùng orchestrator (LLM tool-calling)
-from services.csv_tools import ensure_dirs, download_csv_from_url
+from deps import get_db, get_async_db, SessionLocal, AsyncSessionLocal
+from models import SessionChat, Message, Attachment, Job
+from services.llm import chat_orchestrator, chat_orchestrator_stream, load_context, update_rolling_summary  # dùng orchestrator (LLM tool-calling)
+from services.csv_tools import (
+    ensure_dirs, download_csv_from_url, CsvTooLargeError, UploadProfiler, remember_dataset_hash,
+)
+from services.metrics import span
+from services.openai_scheduler import session_turns, OpenAIBusyError
 
 router = APIRouter(prefix="", tags=["chat"])
 
@@ -21,6 +32,11 @@ IMG_DIR = UPLOAD_DIR / "images"
 CSV_DIR = UPLOAD_DIR / "csv"
 ensure_dirs(IMG_DIR, CSV_DIR, UPLOAD_DIR)
 
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+UPLOAD_MAX_IMAGE_BYTES = int(os.getenv("UPLOAD_MAX_IMAGE_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_MAX_CSV_BYTES = int(os.getenv("UPLOAD_MAX_CSV_BYTES", str(500 * 1024 * 1024)))
+MESSAGES_PAGE_SIZE = int(os.getenv("MESSAGES_PAGE_SIZE", "100"))
+
 
 def make_public_url(path: str) -> Optional[str]:
     """
@@ -35,26 +51,83 @@ def make_public_url(path: str) -> Optional[str]:
         return None
 
 
-@router.post("/chat")
-async def chat(
-    session_id: str = Form(...),
-    message: str = Form(...),
-    file: Optional[UploadFile] = File(None),  # <-- PHẢI LÀ UploadFile
-    csv_url: Optional[str] = Form(None),
-    db: Session = Depends(get_db),
+def _record_message(sess: SessionChat, msg: Message) -> None:
+    """
+    Cập nhật aggregate denormalized của session trong cùng transaction với message mới.
+    """
+    # biểu thức SQL: không cần đọc giá trị hiện tại (không lazy-load trên AsyncSession)
+    sess.message_count = func.coalesce(SessionChat.message_count, 0) + 1
+    sess.last_message_preview = (msg.content or "")[:200]
+    sess.last_message_at = msg.created_at
+
+
+async def _flush(db: AsyncSession) -> None:
+    with span("db_flush"):
+        await db.flush()
+
+
+async def _commit(db: AsyncSession) -> None:
+    with span("db_commit"):
+        await db.commit()
+
+
+def _record_attachment(sess: SessionChat, att: Attachment) -> None:
+    # con trỏ csv/ảnh mới nhất (xem _latest_attachment trong services/llm.py)
+    if att.kind == "csv":
+        sess.latest_csv_attachment_id = att.id
+    elif att.kind == "image":
+        sess.latest_image_attachment_id = att.id
+
+
+def _write_chunk(f, profiler: UploadProfiler, chunk: bytes) -> None:
+    profiler.feed(chunk)
+    f.write(chunk)
+
+
+async def _save_upload(file: UploadFile, dest: Path, max_bytes: int, profiler: UploadProfiler) -> dict:
+    """
+    Ghi upload theo chunk (đọc/ghi/hash đều ngoài event loop) vào file tạm rồi rename.
+    Vượt max_bytes -> 413. Returns profile (xem UploadProfiler.finish)
+    """
+    tmp = dest.with_name(f".{uuid.uuid4().hex}.part")
+    try:
+        with open(tmp, "wb") as f:
+            while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+                if profiler.bytes + len(chunk) > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"File is larger than the {max_bytes} byte limit.")
+                await asyncio.to_thread(_write_chunk, f, profiler, chunk)
+        os.replace(tmp, dest)
+    finally:
+        tmp.unlink(missing_ok=True)
+    profile = profiler.finish()
+    remember_dataset_hash(dest, profile["sha256"])
+    return profile
+
+
+async def _prepare_user_turn(
+    db: AsyncSession,
+    session_id: str,
+    message: str,
+    file: Optional[UploadFile],
+    csv_url: Optional[str],
 ):
+    """
+    Bước 1-5 của một lượt chat: session, lưu file, tải CSV, lưu user message + attachments.
+    Returns (sess, user_msg, saved_image_path, saved_csv_path, user_attachments)
+    """
     # 1) Lấy / tạo session
-    sess = db.get(SessionChat, session_id)
+    sess = await db.get(SessionChat, session_id)
     if not sess:
         sess = SessionChat(id=session_id, title=message[:120])
-        db.add(sess)
-        db.flush()
+        db.add(sess)  # INSERT cùng lúc với user message -> không giữ write lock của SQLite trong lúc upload
     else:
         sess.title = sess.title or message[:120]
 
     # 2) Lưu file user upload (nếu có)
     saved_image_path = None
     saved_csv_path = None
+    image_profile = None
+    csv_profile = None
     user_attachments: List[dict] = []
 
     if file is not None:
@@ -64,23 +137,29 @@ async def chat(
 
         if "image" in content_type or suffix in [".png", ".jpg", ".jpeg"]:
             saved_image_path = IMG_DIR / f"{session_id}_{filename}"
-            with open(saved_image_path, "wb") as f:
-                shutil.copyfileobj(file.file, f)
+            image_profile = await _save_upload(
+                file, saved_image_path, UPLOAD_MAX_IMAGE_BYTES, UploadProfiler(csv=False)
+            )
         elif suffix == ".csv" or "csv" in content_type:
             saved_csv_path = CSV_DIR / f"{session_id}_{filename}"
-            with open(saved_csv_path, "wb") as f:
-                shutil.copyfileobj(file.file, f)
+            csv_profile = await _save_upload(
+                file, saved_csv_path, UPLOAD_MAX_CSV_BYTES, UploadProfiler(csv=True)
+            )
         else:
             raise HTTPException(status_code=400, detail="Unsupported file type.")
 
     # 3) Tải CSV từ URL nếu có
     if csv_url and not saved_csv_path:
-        saved_csv_path = await download_csv_from_url(csv_url, CSV_DIR, session_id)
+        try:
+            saved_csv_path, csv_profile = await download_csv_from_url(csv_url, CSV_DIR, session_id)
+        except CsvTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
 
     # 4) Lưu user message
     user_msg = Message(session_id=session_id, role="user", content=message, tool_outputs=None)
     db.add(user_msg)
-    db.flush()
+    await _flush(db)
+    _record_message(sess, user_msg)
 
     # 5) Lưu attachments của user (image / csv)
     if saved_image_path:
@@ -90,9 +169,11 @@ async def chat(
             path=str(saved_image_path),
             original_name=file.filename if file else None,
             mime=file.content_type if file else None,
+            profile=image_profile,
         )
         db.add(att)
-        db.flush()
+        await _flush(db)
+        _record_attachment(sess, att)
         user_attachments.append({
             "id": att.id,
             "kind": "image",
@@ -109,9 +190,11 @@ async def chat(
             path=str(saved_csv_path),
             original_name=file.filename if file else None,
             mime=file.content_type if file else None,
+            profile=csv_profile,
         )
         db.add(att)
-        db.flush()
+        await _flush(db)
+        _record_attachment(sess, att)
         user_attachments.append({
             "id": att.id,
             "kind": "csv",
@@ -121,22 +204,61 @@ async def chat(
             "public_url": make_public_url(att.path),
         })
 
-    # 6) Gọi orchestrator (LLM sẽ tự quyết định dùng tool nào, và tự tái dùng CSV/ảnh đã lưu nếu không có file mới)
-    assistant_message, tool_outputs, _, new_asst_attachments = await chat_orchestrator(
-        db=db,
-        session_id=session_id,
-        message=message,
-        history=[{"role": m.role, "content": m.content} for m in sess.messages],
-        image_path=str(saved_image_path) if saved_image_path else None,
-        csv_path=str(saved_csv_path) if saved_csv_path else None,
+    return sess, user_msg, saved_image_path, saved_csv_path, user_attachments
+
+
+async def _cancel_on_disconnect(request: Request, coro, poll: float = 0.5):
+    """
+    Chạy coro; nếu client ngắt kết nối giữa chừng thì huỷ nó (kéo theo huỷ các tool đang chờ trong pool).
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                raise HTTPException(status_code=499, detail="Client disconnected.")
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+async def _save_assistant_turn(
+    db: AsyncSession,
+    sess: SessionChat,
+    assistant_message: str,
+    tool_outputs: Optional[dict],
+    new_asst_attachments: Optional[List[dict]],
+):
+    """
+    Bước 7-9: lưu assistant message, attachments do tool sinh ra, commit.
+    Returns (asst_msg, assistant_attachments)
+    """
+    asst_msg, assistant_attachments = await _add_assistant_message(
+        db, sess, assistant_message, tool_outputs, new_asst_attachments
     )
+    # 9) Commit (thời gian Python, cùng định dạng với created_at để so sánh keyset chính xác)
+    sess.updated_at = datetime.utcnow()
+    await _commit(db)
+    return asst_msg, assistant_attachments
+
 
+async def _add_assistant_message(
+    db: AsyncSession,
+    sess: SessionChat,
+    assistant_message: str,
+    tool_outputs: Optional[dict],
+    new_asst_attachments: Optional[List[dict]],
+):
     # 7) Lưu assistant message
     asst_msg = Message(
-        session_id=session_id, role="assistant", content=assistant_message, tool_outputs=tool_outputs or None
+        session_id=sess.id, role="assistant", content=assistant_message, tool_outputs=tool_outputs or None
     )
     db.add(asst_msg)
-    db.flush()
+    await _flush(db)
+    _record_message(sess, asst_msg)
 
     # 8) Lưu attachments do tool sinh ra (ví dụ: ảnh histogram)
     assistant_attachments: List[dict] = []
@@ -149,76 +271,284 @@ async def chat(
             mime=meta.get("mime"),
         )
         db.add(att)
-        db.flush()
+        await _flush(db)
+        _record_attachment(sess, att)
         meta["id"] = att.id
         meta["public_url"] = meta.get("public_url") or make_public_url(att.path)
         assistant_attachments.append(meta)
+    return asst_msg, assistant_attachments
 
-    # 9) Commit & trả về
-    sess.updated_at = func.now()
-    db.commit()
-    db.refresh(asst_msg)
 
-    return JSONResponse(
-        {
-            "session_id": session_id,
-            "assistant_message": assistant_message,
-            "tool_outputs": tool_outputs,
-            "message_id": asst_msg.id,
-            "user_message": {
-                "id": user_msg.id,
+async def deliver_job_result(db: AsyncSession, job: Job, content: str, result: dict) -> Optional[int]:
+    """
+    Kết quả job nền (services/jobs.py) -> assistant message + attachments của session.
+    Chưa commit: runner commit cùng lúc với việc đánh dấu job xong. Returns message id.
+    """
+    sess = await db.get(SessionChat, job.session_id)
+    if not sess:
+        return None
+    tool_outputs = {**(result.get("tool_outputs") or {}), "job_id": job.id}
+    asst_msg, _ = await _add_assistant_message(db, sess, content, tool_outputs, result.get("new_attachments"))
+    sess.updated_at = datetime.utcnow()
+    return asst_msg.id
+
+
+@router.post("/chat")
+async def chat(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    session_id: str = Form(...),
+    message: str = Form(...),
+    file: Optional[UploadFile] = File(None),  # <-- PHẢI LÀ UploadFile
+    csv_url: Optional[str] = Form(None),
+    no_cache: bool = Form(False),  # bỏ qua LLM response cache cho lượt này
+    db: AsyncSession = Depends(get_async_db),
+):
+    # một lượt mỗi session: lượt sau đọc history sau khi lượt trước đã lưu assistant message
+    async with session_turns.turn(session_id):
+        sess, user_msg, saved_image_path, saved_csv_path, user_attachments = await _prepare_user_turn(
+            db, session_id, message, file, csv_url
+        )
+        history = await load_context(db, session_id, before_id=user_msg.id)
+        # commit user turn trước khi gọi LLM (như /chat/stream): không giữ transaction ghi suốt lượt chat
+        await _commit(db)
+
+        # 6) Gọi orchestrator (LLM sẽ tự quyết định dùng tool nào, và tự tái dùng CSV/ảnh đã lưu nếu không có file mới)
+        try:
+            assistant_message, tool_outputs, _, new_asst_attachments = await _cancel_on_disconnect(
+                request,
+                chat_orchestrator(
+                    db=db,
+                    session_id=session_id,
+                    message=message,
+                    history=history,
+                    image_path=str(saved_image_path) if saved_image_path else None,
+                    csv_path=str(saved_csv_path) if saved_csv_path else None,
+                    cache=not no_cache,
+                ),
+            )
+        except OpenAIBusyError as e:
+            raise HTTPException(
+                status_code=503, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))}
+            )
+
+        asst_msg, assistant_attachments = await _save_assistant_turn(
+            db, sess, assistant_message, tool_outputs, new_asst_attachments
+        )
+        # cập nhật rolling summary sau khi đã trả response
+        background_tasks.add_task(update_rolling_summary, AsyncSessionLocal, session_id)
+
+        return JSONResponse(
+            {
+                "session_id": session_id,
+                "assistant_message": assistant_message,
+                "tool_outputs": tool_outputs,
+                "message_id": asst_msg.id,
+                "user_message": {
+                    "id": user_msg.id,
+                    "attachments": user_attachments,
+                },
+                "assistant_message_meta": {
+                    "id": asst_msg.id,
+                    "attachments": assistant_attachments,
+                },
+            }
+        )
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.post("/chat/stream")
+async def chat_stream(
+    session_id: str = Form(...),
+    message: str = Form(...),
+    file: Optional[UploadFile] = File(None),
+    csv_url: Optional[str] = Form(None),
+    no_cache: bool = Form(False),  # bỏ qua LLM response cache cho lượt này
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Giống /chat nhưng trả về Server-Sent Events:
+      user_message -> (delta | tool_start | tool_end)* -> done | error
+    User turn được commit trước khi stream; assistant message được lưu khi stream kết thúc.
+    """
+    # giữ lượt của session tới khi stream kết thúc (release trong event_stream và trong background task)
+    release_turn = await session_turns.acquire(session_id)
+    try:
+        sess, user_msg, saved_image_path, saved_csv_path, user_attachments = await _prepare_user_turn(
+            db, session_id, message, file, csv_url
+        )
+        history = await load_context(db, session_id, before_id=user_msg.id)
+        await _commit(db)
+    except BaseException:
+        release_turn()
+        raise
+    user_msg_id = user_msg.id
+
+    async def event_stream():
+        # Session riêng: dependency get_async_db đã đóng khi response bắt đầu stream
+        sdb = AsyncSessionLocal()
+        try:
+            yield _sse("user_message", {
+                "session_id": session_id,
+                "id": user_msg_id,
                 "attachments": user_attachments,
-            },
-            "assistant_message_meta": {
-                "id": asst_msg.id,
-                "attachments": assistant_attachments,
-            },
-        }
+            })
+            async for ev in chat_orchestrator_stream(
+                db=sdb,
+                session_id=session_id,
+                message=message,
+                history=history,
+                image_path=str(saved_image_path) if saved_image_path else None,
+                csv_path=str(saved_csv_path) if saved_csv_path else None,
+                cache=not no_cache,
+            ):
+                if ev["type"] == "tool_end":
+                    for meta in ev["attachments"]:
+                        meta["public_url"] = meta.get("public_url") or make_public_url(meta["path"])
+                if ev["type"] != "done":
+                    yield _sse(ev["type"], ev)
+                    continue
+
+                stream_sess = await sdb.get(SessionChat, session_id)
+                asst_msg, assistant_attachments = await _save_assistant_turn(
+                    sdb, stream_sess, ev["content"], ev["tool_outputs"], ev["attachments"]
+                )
+                yield _sse("done", {
+                    "session_id": session_id,
+                    "assistant_message": ev["content"],
+                    "tool_outputs": ev["tool_outputs"],
+                    "message_id": asst_msg.id,
+                    "assistant_message_meta": {
+                        "id": asst_msg.id,
+                        "attachments": assistant_attachments,
+                    },
+                })
+        except Exception as e:
+            await sdb.rollback()
+            error = {"detail": str(e)}
+            if isinstance(e, OpenAIBusyError):
+                error["retry_after"] = e.retry_after
+            yield _sse("error", error)
+        finally:
+            await sdb.close()
+            release_turn()
+
+    background = BackgroundTasks()
+    background.add_task(release_turn)  # phòng khi stream không bao giờ được chạy (client ngắt sớm)
+    background.add_task(update_rolling_summary, AsyncSessionLocal, session_id)
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=background,
     )
 
 
+def _encode_cursor(updated_at, session_id: str) -> str:
+    raw = json.dumps([updated_at.isoformat(), session_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor: str):
+    try:
+        ts, sid = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(ts), sid
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+
 @router.get("/sessions")
 def list_sessions(
     db: Session = Depends(get_db),
     limit: int = Query(50, ge=1, le=200),
-    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None),
 ):
-    q = db.query(SessionChat).order_by(desc(SessionChat.updated_at)).offset(offset).limit(limit)
-    rows = []
-    for s in q.all():
-        last_msg = db.execute(
-            select(Message).where(Message.session_id == s.id).order_by(desc(Message.created_at)).limit(1)
-        ).scalar_one_or_none()
-        count = db.execute(
-            select(func.count()).select_from(Message).where(Message.session_id == s.id)
-        ).scalar_one()
-        rows.append(
-            {
-                "id": s.id,
-                "title": s.title,
-                "created_at": s.created_at.isoformat(),
-                "updated_at": s.updated_at.isoformat(),
-                "last_message": last_msg.content[:200] if last_msg else "",
-                "message_count": int(count),
-            }
+    """
+    Một query duy nhất trên index (updated_at, id); phân trang keyset bằng `cursor` (next_cursor của trang trước).
+    """
+    q = select(
+        SessionChat.id,
+        SessionChat.title,
+        SessionChat.created_at,
+        SessionChat.updated_at,
+        SessionChat.last_message_preview,
+        SessionChat.message_count,
+    ).order_by(desc(SessionChat.updated_at), desc(SessionChat.id))
+    if cursor:
+        ts, sid = _decode_cursor(cursor)
+        q = q.where(
+            (SessionChat.updated_at < ts) | ((SessionChat.updated_at == ts) & (SessionChat.id < sid))
         )
-    return {"sessions": rows, "offset": offset, "limit": limit}
+    page = db.execute(q.limit(limit + 1)).all()
+
+    rows = [
+        {
+            "id": s.id,
+            "title": s.title,
+            "created_at": s.created_at.isoformat(),
+            "updated_at": s.updated_at.isoformat(),
+            "last_message": s.last_message_preview or "",
+            "message_count": int(s.message_count or 0),
+        }
+        for s in page[:limit]
+    ]
+    next_cursor = _encode_cursor(page[limit - 1].updated_at, page[limit - 1].id) if len(page) > limit else None
+    return {"sessions": rows, "limit": limit, "next_cursor": next_cursor}
 
 
-@router.get("/sessions/{session_id}/messages")
-def get_session_messages(session_id: str, db: Session = Depends(get_db)):
-    sess = db.get(SessionChat, session_id)
-    if not sess:
-        raise HTTPException(status_code=404, detail="Session not found")
+MESSAGE_FIELDS = ("role", "content", "tool_outputs", "created_at", "attachments")
+_MESSAGE_COLUMNS = {
+    "role": Message.role,
+    "content": Message.content,
+    "tool_outputs": Message.tool_outputs,
+    "created_at": Message.created_at,
+}
+_NDJSON_PAGE = 200
+
+
+def _parse_fields(fields: Optional[str]) -> tuple:
+    if not fields:
+        return MESSAGE_FIELDS
+    wanted = tuple(f.strip() for f in fields.split(",") if f.strip() and f.strip() != "id")
+    unknown = [f for f in wanted if f not in MESSAGE_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return wanted
 
-    def serialize_message(m: Message):
-        return {
-            "id": m.id,
-            "role": m.role,
-            "content": m.content,
-            "tool_outputs": m.tool_outputs,
-            "created_at": m.created_at.isoformat(),
-            "attachments": [
+
+def _messages_page(db: Session, session_id: str, before: Optional[int], after: Optional[int], limit: int, fields: tuple):
+    """
+    Một trang message theo keyset trên (session_id, id), trả về theo thứ tự tăng dần.
+    Có `after` -> các message ngay sau id đó (và trước `before` nếu có);
+    không có -> các message mới nhất trước `before`.
+    Attachments nạp bằng một query selectinload cho cả trang; cột không yêu cầu thì không đọc.
+    Returns (messages, has_more)
+    """
+    q = select(Message).where(Message.session_id == session_id).options(
+        load_only(Message.id, *(_MESSAGE_COLUMNS[f] for f in fields if f in _MESSAGE_COLUMNS))
+    )
+    if "attachments" in fields:
+        q = q.options(selectinload(Message.attachments))
+    if before is not None:
+        q = q.where(Message.id < before)
+    if after is not None:
+        q = q.where(Message.id > after).order_by(Message.id)
+    else:
+        q = q.order_by(desc(Message.id))
+    page = db.scalars(q.limit(limit + 1)).all()
+    has_more = len(page) > limit
+    page = page[:limit]
+    return (page if after is not None else page[::-1]), has_more
+
+
+def _serialize_message(m: Message, fields: tuple) -> dict:
+    out = {"id": m.id}
+    for f in fields:
+        if f == "attachments":
+            out["attachments"] = [
                 {
                     "id": a.id,
                     "kind": a.kind,
@@ -228,15 +558,95 @@ def get_session_messages(session_id: str, db: Session = Depends(get_db)):
                     "public_url": make_public_url(a.path),
                 }
                 for a in m.attachments
-            ],
-        }
+            ]
+        elif f == "created_at":
+            out["created_at"] = m.created_at.isoformat()
+        else:
+            out[f] = getattr(m, f)
+    return out
+
+
+def _serialize_session(sess: SessionChat) -> dict:
+    return {
+        "id": sess.id,
+        "title": sess.title,
+        "created_at": sess.created_at.isoformat(),
+        "updated_at": sess.updated_at.isoformat(),
+        "message_count": int(sess.message_count or 0),
+    }
+
+
+def _ndjson_messages(session_id: str, before: Optional[int], after: Optional[int], limit: Optional[int], fields: tuple):
+    """
+    NDJSON: {"type":"session"} rồi mỗi dòng một {"type":"message"} (tăng dần theo id), kết thúc bằng {"type":"end"}.
+    Đọc theo trang _NDJSON_PAGE nên bộ nhớ không phụ thuộc độ dài session; limit=None -> tới hết.
+    """
+    # Session riêng: dependency get_db đã đóng khi response bắt đầu stream
+    db = SessionLocal()
+    try:
+        sess = db.get(SessionChat, session_id)
+        yield json.dumps({"type": "session", "session": _serialize_session(sess)}, ensure_ascii=False) + "\n"
+
+        if after is None and limit is not None:
+            # `limit` message mới nhất trước `before`: tìm id đầu khoảng rồi stream xuôi từ đó
+            q = select(Message.id).where(Message.session_id == session_id)
+            if before is not None:
+                q = q.where(Message.id < before)
+            ids = q.order_by(desc(Message.id)).limit(limit).subquery()
+            after = (db.scalar(select(func.min(ids.c.id))) or 1) - 1
+        after = after or 0
+
+        sent = 0
+        while limit is None or sent < limit:
+            size = _NDJSON_PAGE if limit is None else min(_NDJSON_PAGE, limit - sent)
+            page, has_more = _messages_page(db, session_id, before, after, size, fields)
+            for m in page:
+                yield json.dumps({"type": "message", **_serialize_message(m, fields)}, ensure_ascii=False) + "\n"
+            sent += len(page)
+            db.expunge_all()  # không giữ message đã gửi trong identity map
+            if not page or not has_more:
+                break
+            after = page[-1].id
+        yield json.dumps({"type": "end", "count": sent}) + "\n"
+    finally:
+        db.close()
+
+
+@router.get("/sessions/{session_id}/messages")
+def get_session_messages(
+    session_id: str,
+    request: Request,
+    db: Session = Depends(get_db),
+    before: Optional[int] = Query(None, description="Message id; trả về các message cũ hơn"),
+    after: Optional[int] = Query(None, description="Message id; trả về các message mới hơn"),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    fields: Optional[str] = Query(None, description="Ví dụ: role,content,created_at,attachments"),
+    format: Optional[str] = Query(None, pattern="^(json|ndjson)$"),
+):
+    """
+    Lịch sử message phân trang theo id. Mặc định: MESSAGES_PAGE_SIZE message mới nhất (JSON),
+    `next_before` / `next_after` là cursor cho trang kế tiếp (null khi hết).
+    `format=ndjson` (hoặc Accept: application/x-ndjson) stream từng message; không có limit -> cả khoảng.
+    """
+    if before is not None and after is not None:
+        raise HTTPException(status_code=400, detail="Use either 'before' or 'after', not both.")
+    wanted = _parse_fields(fields)
+    sess = db.get(SessionChat, session_id)
+    if not sess:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    if format == "ndjson" or (format is None and "application/x-ndjson" in request.headers.get("accept", "")):
+        return StreamingResponse(
+            _ndjson_messages(session_id, before, after, limit, wanted),
+            media_type="application/x-ndjson",
+        )
 
+    limit = limit or MESSAGES_PAGE_SIZE
+    page, has_more = _messages_page(db, session_id, before, after, limit, wanted)
     return {
-        "session": {
-            "id": sess.id,
-            "title": sess.title,
-            "created_at": sess.created_at.isoformat(),
-            "updated_at": sess.updated_at.isoformat(),
-        },
-        "messages": [serialize_message(m) for m in sess.messages],
+        "session": _serialize_session(sess),
+        "messages": [_serialize_message(m, wanted) for m in page],
+        "limit": limit,
+        "next_before": page[0].id if page and (after is not None or has_more) else None,
+        "next_after": page[-1].id if page and (has_more if after is not None else before is not None) else None,
     }
@@ -0,0 +1,45 @@
+# routers/jobs.py
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from sqlalchemy import select, desc
+
+from deps import get_db
+from models import Job
+from services.jobs import job_runner, serialize_job
+
+router = APIRouter(prefix="", tags=["jobs"])
+
+
+@router.get("/jobs/{job_id}")
+def get_job(job_id: str, db: Session = Depends(get_db)):
+    """
+    Trạng thái job nền: status (queued | running | done | error | cancelled), progress 0..1,
+    markdown từng phần khi đang chạy, message_id của assistant message chứa kết quả khi xong.
+    """
+    job = db.get(Job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return serialize_job(job)
+
+
+@router.get("/sessions/{session_id}/jobs")
+def list_session_jobs(
+    session_id: str,
+    db: Session = Depends(get_db),
+    status: Optional[str] = Query(None, description="queued | running | done | error | cancelled"),
+    limit: int = Query(20, ge=1, le=100),
+):
+    q = select(Job).where(Job.session_id == session_id)
+    if status:
+        q = q.where(Job.status == status)
+    jobs = db.execute(q.order_by(desc(Job.created_at)).limit(limit)).scalars().all()
+    return {"jobs": [serialize_job(j) for j in jobs]}
+
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    if not await job_runner.cancel(job_id):
+        raise HTTPException(status_code=409, detail="Job not found or already finished.")
+    return {"id": job_id, "status": "cancelled"}
@@ -1,29 +1,665 @@
 from __future__ import annotations
 from pathlib import Path
+from collections import OrderedDict
+import asyncio
+import hashlib
 import io
-import pandas as pd
-import numpy as np
-import httpx
-import matplotlib
-matplotlib.use("Agg")  
-import matplotlib.pyplot as plt
+import logging
+import os
+import threading
+import uuid
+import zlib
+from typing import Callable
+
+from .http_client import get_http_client
+from .lazy import lazy_import
+from .metrics import span
+
+# import thật khi tool dùng tới lần đầu (xem services/lazy.py)
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
 
 def ensure_dirs(*dirs: Path):
     for d in dirs:
         d.mkdir(parents=True, exist_ok=True)
 
-async def download_csv_from_url(url: str, out_dir: Path, session_id: str) -> Path:
+CSV_URL_MAX_BYTES = int(os.getenv("CSV_URL_MAX_BYTES", str(500 * 1024 * 1024)))
+CSV_SNIFF_ROWS = 50
+CSV_URL_CHUNK_BYTES = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+class CsvTooLargeError(ValueError):
+    pass
+
+def sniff_csv_head(data: bytes, nrows: int = CSV_SNIFF_ROWS) -> dict:
+    """
+    Đoán header + dtypes từ đoạn đầu file (bỏ dòng cuối có thể bị cắt dở).
+    """
+    cut = data.rfind(b"\n")
+    if cut <= 0:
+        return {"columns": [], "dtypes": {}}
+    try:
+        df = pd.read_csv(io.BytesIO(data[: cut + 1]), nrows=nrows)
+    except Exception:
+        return {"columns": [], "dtypes": {}}
+    return {"columns": df.columns.tolist(), "dtypes": {c: str(t) for c, t in df.dtypes.items()}}
+
+class UploadProfiler:
+    """
+    Profile tính dần trên từng chunk bytes khi file đang được ghi: sha256, số byte và
+    (với csv) số dòng + header/dtypes đoán từ đoạn đầu. Không cần pandas đọc lại cả file.
+    """
+
+    def __init__(self, csv: bool = True):
+        self.csv = csv
+        self.bytes = 0
+        self._h = hashlib.sha256()
+        self._newlines = 0
+        self._quotes = 0
+        self._last = b""
+        self._head = bytearray()
+        self.sniff: dict | None = None
+
+    def feed(self, data: bytes) -> dict | None:
+        """
+        Cập nhật với chunk kế tiếp. Trả về kết quả sniff đúng một lần, khi đã đủ dữ liệu đầu file.
+        """
+        if not data:
+            return None
+        self.bytes += len(data)
+        self._h.update(data)
+        if not self.csv:
+            return None
+        self._newlines += data.count(b"\n")
+        self._quotes += data.count(b'"')
+        self._last = data[-1:]
+        if self.sniff is None:
+            self._head += data
+            if self._head.count(b"\n") > CSV_SNIFF_ROWS or len(self._head) >= 1 << 20:
+                self.sniff = sniff_csv_head(bytes(self._head))
+                self._head = bytearray()
+                return self.sniff
+        return None
+
+    @property
+    def sha256(self) -> str:
+        return self._h.hexdigest()
+
+    def finish(self) -> dict:
+        profile = {"sha256": self.sha256, "bytes": self.bytes}
+        if not self.csv:
+            return profile
+        if self.sniff is None:
+            self.sniff = sniff_csv_head(bytes(self._head) + b"\n")
+            self._head = bytearray()
+        lines = self._newlines + (1 if self.bytes and self._last != b"\n" else 0)
+        profile.update({"rows": max(lines - 1, 0), "columns": self.sniff["columns"], "dtypes": self.sniff["dtypes"]})
+        if self._quotes:
+            # đếm theo dòng: trường trong ngoặc kép có thể chứa xuống dòng -> số dòng chỉ là ước lượng
+            profile["rows_estimated"] = True
+        return profile
+
+def _is_gzip_source(first_bytes: bytes) -> bool:
+    # Content-Encoding: gzip đã được httpx tự giải nén; ở đây là file .csv.gz thật sự (magic bytes)
+    return first_bytes[:2] == b"\x1f\x8b"
+
+async def download_csv_from_url(
+    url: str,
+    out_dir: Path,
+    session_id: str,
+    *,
+    max_bytes: int | None = None,
+    on_sniff=None,
+) -> tuple[Path, dict]:
+    """
+    Tải CSV theo stream: ghi từng chunk vào file tạm, profile (sha256, rows, header) trong lúc tải,
+    rồi rename atomic.
+    - Bộ nhớ không phụ thuộc kích thước file; vượt `max_bytes` (sau giải nén) -> CsvTooLargeError.
+    - Nguồn .csv.gz được giải nén dần.
+    - `on_sniff(dict)` (tuỳ chọn) được gọi một lần với header/dtypes đoán từ chunk đầu, trước khi tải xong.
+    Tên file gắn hash nội dung nên các lần tải song song trong cùng session không ghi đè nhau.
+    Returns (out_path, profile)
+    """
+    max_bytes = max_bytes or CSV_URL_MAX_BYTES
     out_dir.mkdir(parents=True, exist_ok=True)
-    filename = f"{session_id}_from_url.csv"
-    out_path = out_dir / filename
-    async with httpx.AsyncClient(timeout=60) as client:
-        r = await client.get(url)
-        r.raise_for_status()
-        out_path.write_bytes(r.content)
-    return out_path
+    tmp_path = out_dir / f".{session_id}_{uuid.uuid4().hex}.part"
+    profiler = UploadProfiler(csv=True)
+    decomp = None
+
+    def write_piece(f, data: bytes):
+        if profiler.bytes + len(data) > max_bytes:
+            raise CsvTooLargeError(f"CSV at URL is larger than the {max_bytes} byte limit.")
+        sniff = profiler.feed(data)
+        f.write(data)
+        return sniff
+
+    def write_chunk(f, chunk: bytes, flush: bool = False):
+        # chạy trong thread (như _save_upload): giải nén + sha256/sniff + ghi file đều ngoài event loop
+        if not decomp:
+            return write_piece(f, chunk)
+        if flush:
+            return write_piece(f, decomp.flush())
+        # giải nén từng phần tối đa CSV_URL_CHUNK_BYTES rồi mới kiểm tra giới hạn: một chunk gzip nén cao
+        # (gzip bomb) không được bung hết vào RAM trước khi bị chặn
+        sniff = None
+        buf = chunk
+        while buf:
+            data = decomp.decompress(buf, CSV_URL_CHUNK_BYTES)
+            buf = decomp.unconsumed_tail
+            sniff = write_piece(f, data) or sniff
+        return sniff
+
+    async def write(f, chunk: bytes, flush: bool = False) -> None:
+        sniff = await asyncio.to_thread(write_chunk, f, chunk, flush)
+        if sniff is not None and on_sniff is not None:
+            on_sniff(sniff)
+
+    client = get_http_client()
+    try:
+        async with client.stream("GET", url, timeout=60) as r:
+            r.raise_for_status()
+            declared = r.headers.get("content-length")
+            if declared and declared.isdigit() and int(declared) > max_bytes:
+                raise CsvTooLargeError(f"CSV at URL is larger than the {max_bytes} byte limit.")
+
+            with open(tmp_path, "wb") as f:
+                first = True
+                async for chunk in r.aiter_bytes(CSV_URL_CHUNK_BYTES):
+                    if first:
+                        first = False
+                        if _is_gzip_source(chunk):
+                            decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                    await write(f, chunk)
+                if decomp:
+                    await write(f, b"", flush=True)
+
+        sniffed_late = profiler.sniff is None
+        profile = profiler.finish()
+        if sniffed_late and on_sniff is not None:
+            on_sniff(profiler.sniff)
+        out_path = out_dir / f"{session_id}_from_url_{profile['sha256'][:16]}.csv"
+        os.replace(tmp_path, out_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    remember_dataset_hash(out_path, profile["sha256"])
+    return out_path, profile
+
+class DataFrameCache:
+    """
+    Cache DataFrame đã parse, dùng chung cho cả process.
+    Key = (resolved path, mtime_ns, size, columns) nên file bị ghi đè sẽ tự miss.
+    Giới hạn tổng bytes theo DataFrame.memory_usage(deep=True), evict theo LRU.
+    DataFrame trả về được dùng chung giữa các request -> coi như read-only.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple, tuple[pd.DataFrame, int]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._key_locks: dict[tuple, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(path: Path, columns: tuple | None = None) -> tuple:
+        rp = Path(path).resolve()
+        st = rp.stat()
+        return (str(rp), st.st_mtime_ns, st.st_size, columns)
+
+    def get_or_load(self, path: Path, loader, columns: tuple | None = None) -> pd.DataFrame:
+        key = self.make_key(path, columns)
+        with self._lock:
+            hit = self._lookup(key)
+            if hit is not None:
+                return hit
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Chỉ một request parse cùng một file; các request khác đợi rồi lấy từ cache
+        with key_lock:
+            with self._lock:
+                hit = self._lookup(key)
+                if hit is not None:
+                    return hit
+                self.misses += 1
+            try:
+                df = loader(Path(key[0]), list(columns) if columns is not None else None)
+                self._store(key, df)
+            finally:
+                with self._lock:
+                    self._key_locks.pop(key, None)
+            return df
+
+    def _lookup(self, key: tuple):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def _store(self, key: tuple, df: pd.DataFrame) -> None:
+        size = int(df.memory_usage(deep=True).sum())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            # bỏ các phiên bản cũ của cùng file (mtime/size khác)
+            for old in [k for k in self._entries if k[0] == key[0] and k[1:3] != key[1:3]]:
+                self._bytes -= self._entries.pop(old)[1]
+            self._entries[key] = (df, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+CSV_CACHE_MAX_BYTES = int(os.getenv("CSV_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+df_cache = DataFrameCache(CSV_CACHE_MAX_BYTES)
+
+_hash_memo: dict[tuple, str] = {}
+_hash_lock = threading.Lock()
+
+def remember_dataset_hash(path: Path, digest: str) -> None:
+    """
+    Ghi nhận hash đã tính sẵn lúc ingest (stream) để dataset_hash() không phải đọc lại file.
+    """
+    rp = Path(path).resolve()
+    st = rp.stat()
+    with _hash_lock:
+        _hash_memo[(str(rp), st.st_mtime_ns, st.st_size)] = digest
+
+def dataset_hash(path: Path) -> str:
+    """
+    sha256 nội dung file (đọc theo block), nhớ theo (path, mtime_ns, size) để không hash lại file chưa đổi.
+    """
+    rp = Path(path).resolve()
+    st = rp.stat()
+    key = (str(rp), st.st_mtime_ns, st.st_size)
+    with _hash_lock:
+        if key in _hash_memo:
+            return _hash_memo[key]
+    h = hashlib.sha256()
+    with open(rp, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    digest = h.hexdigest()
+    with _hash_lock:
+        _hash_memo[key] = digest
+    return digest
+
+# ---------- Columnar sidecar ----------
+# CSV được parse một lần lúc upload rồi lưu thành Arrow IPC (Feather v2, không nén) cạnh file gốc,
+# để các lần đọc sau memory-map và chỉ lấy các cột cần thiết. pyarrow là optional: thiếu thì đọc CSV như cũ.
+SIDECAR_SUFFIX = ".arrow"
+
+def _pyarrow_feather():
+    try:
+        import pyarrow.feather as feather
+    except ImportError:
+        return None
+    return feather
+
+def sidecar_path_for(csv_path: Path) -> Path:
+    p = Path(csv_path)
+    return p.with_name(p.name + SIDECAR_SUFFIX)
+
+def _fresh_sidecar(csv_path: Path) -> Path | None:
+    sc = sidecar_path_for(csv_path)
+    try:
+        if sc.stat().st_mtime_ns >= Path(csv_path).stat().st_mtime_ns:
+            return sc
+    except FileNotFoundError:
+        pass
+    return None
+
+def ingest_csv(csv_path: Path, df: pd.DataFrame | None = None) -> Path | None:
+    """
+    Ghi sidecar Arrow cho CSV (từ `df` nếu caller đã parse sẵn, không thì parse CSV một lần).
+    Trả về đường dẫn sidecar, hoặc None nếu không có pyarrow / CSV không parse được
+    (tool sẽ tự fallback về đọc CSV).
+    """
+    feather = _pyarrow_feather()
+    if feather is None:
+        return None
+    csv_path = Path(csv_path)
+    sc = sidecar_path_for(csv_path)
+    # tên tạm riêng cho mỗi thread: hai lần load đầu tiên song song không ghi chung một file
+    tmp = sc.with_name(f"{sc.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with span("csv_ingest"):
+            if df is None and csv_path.stat().st_size > CSV_STREAM_THRESHOLD_BYTES:
+                _ingest_csv_streaming(csv_path, tmp)
+            else:
+                df = pd.read_csv(csv_path) if df is None else df
+                feather.write_feather(df, tmp, compression="uncompressed")
+        os.replace(tmp, sc)
+    except Exception:
+        logger.exception("CSV ingest failed for %s", csv_path)
+        tmp.unlink(missing_ok=True)
+        return None
+    return sc
+
+def _ingest_csv_streaming(csv_path: Path, out_path: Path) -> None:
+    # File lớn: pyarrow đọc CSV theo block và ghi từng record batch -> bộ nhớ không tăng theo kích thước file
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    reader = pacsv.open_csv(csv_path)
+    with pa.OSFile(str(out_path), "wb") as sink, pa.ipc.new_file(sink, reader.schema) as writer:
+        for batch in reader:
+            writer.write_batch(batch)
+
+def csv_columns(path: Path) -> list[str]:
+    """
+    Tên cột, đọc từ schema của sidecar nếu có, không thì từ header CSV.
+    """
+    sc = _fresh_sidecar(path)
+    if sc is not None:
+        import pyarrow as pa
+        with pa.memory_map(str(sc)) as source:
+            return pa.ipc.open_file(source).schema.names
+    return pd.read_csv(path, nrows=0).columns.tolist()
+
+def _read_csv_or_sidecar(path: Path, columns: list[str] | None) -> pd.DataFrame:
+    # sidecar được dựng ở lần load đầu tiên (không phải lúc upload): /chat không phải chờ parse cả file
+    sc = _fresh_sidecar(path)
+    if sc is None and _pyarrow_feather() is not None:
+        if columns is None:
+            with span("csv_parse", "csv"):
+                df = pd.read_csv(path)
+            ingest_csv(path, df)  # ghi sidecar từ chính DataFrame vừa parse, không parse lại
+            return df
+        sc = ingest_csv(path)
+    if sc is not None and _pyarrow_feather() is not None:
+        with span("csv_parse", "arrow"):
+            table = _pyarrow_feather().read_table(sc, columns=columns, memory_map=True)
+            return table.to_pandas(split_blocks=True)
+    with span("csv_parse", "csv"):
+        return pd.read_csv(path, usecols=columns)
 
-def load_csv(path: Path) -> pd.DataFrame:
-    return pd.read_csv(path)
+def load_csv(path: Path, columns: list[str] | None = None) -> pd.DataFrame:
+    """
+    Đọc CSV qua cache (xem DataFrameCache), ưu tiên sidecar Arrow.
+    `columns`: chỉ đọc các cột này (cột không tồn tại bị bỏ qua). Không sửa DataFrame trả về.
+    """
+    with span("csv_load"):
+        if columns is not None:
+            available = set(csv_columns(path))
+            columns = [c for c in columns if c in available]
+        return df_cache.get_or_load(
+            path, _read_csv_or_sidecar, tuple(columns) if columns is not None else None
+        )
+
+def iter_csv_chunks(
+    path: Path,
+    chunksize: int | None = None,
+    columns: list[str] | None = None,
+    progress: Callable[[float], None] | None = None,
+):
+    """
+    Đọc CSV theo từng chunk DataFrame (record batch của sidecar nếu có) để bộ nhớ không phụ thuộc kích thước file.
+    `progress(fraction)` (tuỳ chọn) được gọi sau khi caller xử lý xong mỗi chunk: phần file đã đọc
+    (bytes / kích thước file, hoặc số batch của sidecar).
+    """
+    sc = _fresh_sidecar(path)
+    if sc is not None and _pyarrow_feather() is not None:
+        import pyarrow as pa
+        with pa.memory_map(str(sc)) as source:
+            reader = pa.ipc.open_file(source)
+            n = reader.num_record_batches
+            for i in range(n):
+                batch = reader.get_batch(i)
+                yield (batch.select(columns) if columns else batch).to_pandas()
+                if progress:
+                    progress((i + 1) / n)
+        return
+    size = max(Path(path).stat().st_size, 1)
+    with open(path, "rb") as fh, pd.read_csv(fh, chunksize=chunksize or CSV_STREAM_CHUNK_ROWS, usecols=columns) as reader:
+        for chunk in reader:
+            yield chunk
+            if progress:
+                progress(min(fh.tell() / size, 1.0))
+
+# ---------- Streaming statistics ----------
+CSV_STREAM_THRESHOLD_BYTES = int(os.getenv("CSV_STREAM_THRESHOLD_BYTES", str(100 * 1024 * 1024)))
+CSV_STREAM_CHUNK_ROWS = int(os.getenv("CSV_STREAM_CHUNK_ROWS", "100000"))
+CSV_SAMPLE_ROWS = int(os.getenv("CSV_SAMPLE_ROWS", "10000"))
+
+class RunningStats:
+    """
+    count/mean/std/min/max/nulls một lượt, merge được (công thức Chan et al. cho mean/M2).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.nulls = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values: np.ndarray) -> None:
+        values = np.asarray(values, dtype="float64")
+        mask = np.isnan(values)
+        self.nulls += int(mask.sum())
+        v = values[~mask]
+        if v.size == 0:
+            return
+        other = RunningStats()
+        other.count = int(v.size)
+        other.mean = float(v.mean())
+        other.m2 = float(((v - other.mean) ** 2).sum())
+        other.min = float(v.min())
+        other.max = float(v.max())
+        self.merge(other)
+
+    def merge(self, other: "RunningStats") -> None:
+        self.nulls += other.nulls
+        if other.count == 0:
+            return
+        n = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / n
+        self.m2 += other.m2 + delta * delta * self.count * other.count / n
+        self.count = n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def std(self) -> float:
+        # ddof=1 giống pandas describe()
+        return float(np.sqrt(self.m2 / (self.count - 1))) if self.count > 1 else float("nan")
+
+class QuantileSketch:
+    """
+    Sketch phân vị kiểu KLL: các level buffer, level h có trọng số 2**h; buffer đầy thì sort và
+    đẩy một nửa (so le ngẫu nhiên) lên level trên. Bộ nhớ ~ k * số level, merge được giữa các chunk.
+    """
+
+    def __init__(self, k: int = 2048, seed: int = 0):
+        self.k = k
+        self.n = 0
+        self.levels: list[np.ndarray] = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    @property
+    def exact(self) -> bool:
+        return len(self.levels) == 1
+
+    def update(self, values: np.ndarray) -> None:
+        values = np.asarray(values, dtype="float64")
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return
+        self.n += int(values.size)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def merge(self, other: "QuantileSketch") -> None:
+        self.n += other.n
+        for h, buf in enumerate(other.levels):
+            if h == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[h] = np.concatenate([self.levels[h], buf])
+        self._compress()
+
+    def _compress(self) -> None:
+        h = 0
+        while h < len(self.levels):
+            buf = self.levels[h]
+            if buf.size > self.k:
+                buf = np.sort(buf)
+                rest = buf[-1:] if buf.size % 2 else buf[:0]
+                even = buf[: buf.size - rest.size]
+                promoted = even[int(self._rng.integers(2))::2]
+                self.levels[h] = rest
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+            h += 1
+
+    def quantiles(self, qs: list[float]) -> list[float]:
+        if self.n == 0:
+            return [float("nan")] * len(qs)
+        vals = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(b.size, 2.0 ** h) for h, b in enumerate(self.levels)])
+        order = np.argsort(vals)
+        vals, cum = vals[order], np.cumsum(weights[order])
+        if self.exact:
+            return [float(np.quantile(vals, q)) for q in qs]
+        idx = np.searchsorted(cum, np.asarray(qs) * cum[-1], side="left")
+        return [float(vals[min(i, vals.size - 1)]) for i in idx]
+
+def _widen_dtype(a, b):
+    if a is None:
+        return b
+    if a == b:
+        return a
+    if pd.api.types.is_numeric_dtype(a) and pd.api.types.is_numeric_dtype(b) \
+            and not pd.api.types.is_bool_dtype(a) and not pd.api.types.is_bool_dtype(b):
+        return np.result_type(a, b)
+    return np.dtype("object")
+
+STAT_ROWS = ["count", "mean", "std", "min", "25%", "50%", "75%", "max"]
+
+def stream_csv_stats(
+    path: Path,
+    *,
+    approximate: bool = False,
+    sample_size: int | None = None,
+    chunksize: int | None = None,
+    head: int = 5,
+    progress: Callable[[float], None] | None = None,
+    on_head: Callable[[pd.DataFrame], None] | None = None,
+) -> dict:
+    """
+    Thống kê CSV theo chunk, bộ nhớ phẳng bất kể kích thước file.
+    - exact (mặc định): rows/nulls/count/mean/std/min/max chính xác; 25/50/75% từ QuantileSketch
+      (`quantiles_approximate` = True khi sketch đã phải nén).
+    - approximate=True: rows/nulls vẫn đếm đủ, còn bảng số liệu tính trên reservoir sample
+      `sample_size` dòng (chọn đều, không phụ thuộc thứ tự chunk), kết quả gắn nhãn approximate.
+    - `progress(fraction)`: phần file đã xử lý sau mỗi chunk; `on_head(df)`: `head` dòng đầu, ngay sau chunk đầu tiên.
+    Returns {"rows", "columns", "dtypes", "head", "numeric", "missing_values",
+             "approximate", "quantiles_approximate", "sample_rows"}
+    """
+    sample_size = sample_size or CSV_SAMPLE_ROWS
+    rng = np.random.default_rng(0)
+    rows = 0
+    head_df = None
+    dtypes: dict = {}
+    nulls: dict = {}
+    moments: dict[str, RunningStats] = {}
+    sketches: dict[str, QuantileSketch] = {}
+    non_numeric: set = set()
+    sample = None  # DataFrame + cột "__key" (reservoir bằng random key, giữ sample_size key nhỏ nhất)
+
+    for chunk in iter_csv_chunks(path, chunksize, progress=progress):
+        if head_df is None:
+            head_df = chunk.head(head)
+            if on_head:
+                on_head(head_df)
+        rows += len(chunk)
+        for col, na in chunk.isna().sum().items():
+            nulls[col] = nulls.get(col, 0) + int(na)
+        for col, dt in chunk.dtypes.items():
+            dtypes[col] = _widen_dtype(dtypes.get(col), dt)
+            if not pd.api.types.is_numeric_dtype(dt) or pd.api.types.is_bool_dtype(dt):
+                non_numeric.add(col)
+
+        if approximate:
+            keyed = chunk.assign(__key=rng.random(len(chunk)))
+            sample = keyed if sample is None else pd.concat([sample, keyed], ignore_index=True)
+            if len(sample) > sample_size:
+                sample = sample.nsmallest(sample_size, "__key")
+            continue
+
+        for col in chunk.columns:
+            if col in non_numeric:
+                continue
+            vals = chunk[col].to_numpy(dtype="float64", na_value=np.nan)
+            moments.setdefault(col, RunningStats()).update(vals)
+            sketches.setdefault(col, QuantileSketch()).update(vals)
+
+    columns = list(dtypes)
+    numeric_cols = [c for c in columns if c not in non_numeric]
+    numeric: dict[str, dict] = {}
+    if approximate:
+        if sample is not None and numeric_cols:
+            desc = sample[numeric_cols].apply(pd.to_numeric, errors="coerce").describe()
+            numeric = {c: {k: float(v) for k, v in desc[c].items()} for c in numeric_cols}
+    else:
+        for c in numeric_cols:
+            m, sk = moments[c], sketches[c]
+            q25, q50, q75 = sk.quantiles([0.25, 0.5, 0.75])
+            numeric[c] = {
+                "count": float(m.count), "mean": m.mean if m.count else float("nan"), "std": m.std,
+                "min": m.min if m.count else float("nan"), "25%": q25, "50%": q50, "75%": q75,
+                "max": m.max if m.count else float("nan"),
+            }
+
+    return {
+        "rows": rows,
+        "columns": columns,
+        "dtypes": {c: str(t) for c, t in dtypes.items()},
+        "head": head_df if head_df is not None else pd.DataFrame(),
+        "numeric": numeric,
+        "missing_values": {c: n for c, n in sorted(nulls.items(), key=lambda kv: -kv[1]) if n > 0},
+        "approximate": approximate,
+        "quantiles_approximate": approximate or any(not sk.exact for sk in sketches.values()),
+        "sample_rows": min(rows, sample_size) if approximate else None,
+    }
+
+def basic_stats_streaming(path: Path, *, approximate: bool = False) -> dict:
+    """
+    Như basic_stats() nhưng đọc theo chunk, không load cả file.
+    """
+    st = stream_csv_stats(path, approximate=approximate)
+    stats = {}
+    if st["numeric"]:
+        stats["numeric_summary"] = st["numeric"]
+    stats["missing_values"] = st["missing_values"]
+    if approximate:
+        stats["approximate"] = True
+    return stats
 
 def summarize_dataframe(df: pd.DataFrame) -> str:
     rows, cols = df.shape
@@ -45,48 +681,228 @@ def basic_stats(df: pd.DataFrame) -> dict:
     stats["missing_values"] = mv[mv > 0].to_dict()
     return stats
 
-def histogram_plot(df: pd.DataFrame, column: str, out_dir: Path, session_id: str) -> Path:
-    if column not in df.columns:
-        raise ValueError(f"Column '{column}' not found.")
-    series = pd.to_numeric(df[column], errors="coerce").dropna()
-    if series.empty:
-        raise ValueError(f"Column '{column}' is not numeric or has no data.")
+# ---------- Table rendering ----------
+# Format cả cột một lần (không iterrows); chỉ các cột/dòng vừa ngân sách ký tự mới được format,
+# nên chi phí gần như không đổi dù file có 10 hay 500 cột.
+TABLE_MAX_CHARS = int(os.getenv("TABLE_MAX_CHARS", "4000"))      # tổng ký tự một bảng
+TABLE_MAX_LINE_CHARS = int(os.getenv("TABLE_MAX_LINE_CHARS", "600"))  # độ rộng một dòng -> số cột
+TABLE_MAX_CELL_CHARS = int(os.getenv("TABLE_MAX_CELL_CHARS", "32"))
+TABLE_SIG_DIGITS = 5
 
-    out_dir.mkdir(parents=True, exist_ok=True)
-    out_path = out_dir / f"{session_id}_hist_{column}.png"
-
-    plt.figure()
-    plt.hist(series, bins=20)
-    plt.title(f"Histogram of {column}")
-    plt.xlabel(column)
-    plt.ylabel("Frequency")
-    plt.tight_layout()
-    plt.savefig(out_path)
-    plt.close()
-    return out_path
+_MIN_CELL_CHARS = 4  # "| x " -> cận trên số cột có thể vừa một dòng
+_MISSING = "NA"
 
 def _escape_md(val: str) -> str:
     return str(val).replace("|", "\\|")
 
-def df_to_markdown_table(df, *, max_rows: int = 5, max_cols: int = 8) -> str:
+def _float_format(values: np.ndarray) -> str:
+    # một format cho cả cột, chọn theo độ lớn: số nguyên -> %.0f, còn lại ~TABLE_SIG_DIGITS chữ số có nghĩa
+    finite = values[np.isfinite(values)]
+    if finite.size == 0:
+        return "%g"
+    mag = float(np.abs(finite).max())
+    if mag < 1e15 and np.array_equal(finite, np.round(finite)):
+        return "%.0f"
+    if mag >= 1e9 or mag < 1e-4:
+        return f"%.{TABLE_SIG_DIGITS - 1}g"
+    decimals = int(min(8, max(0, TABLE_SIG_DIGITS - 1 - np.floor(np.log10(mag)))))
+    nonzero = np.abs(finite[finite != 0])
+    if nonzero.size and nonzero.min() < 10.0 ** (1 - decimals):
+        # độ lớn chênh nhau quá nhiều (vd. 2e6 và 0.003): fixed-point sẽ làm tròn số nhỏ về 0
+        return f"%.{TABLE_SIG_DIGITS - 1}g"
+    return f"%.{decimals}f"
+
+def _format_floats(values: np.ndarray, fmt: str) -> np.ndarray:
+    out = np.char.mod(fmt, values)
+    if fmt.endswith("f") and fmt != "%.0f":
+        out = np.char.rstrip(np.char.rstrip(out, "0"), ".")
+    out = out.astype(object)
+    out[np.isnan(values)] = _MISSING
+    return out
+
+def _format_float_rows(values: np.ndarray) -> np.ndarray:
+    """
+    Ma trận float -> str, mỗi dòng một format theo độ lớn của chính dòng đó; các dòng cùng format
+    được format chung một lần.
+    """
+    out = np.empty(values.shape, dtype=object)
+    fmts = np.array([_float_format(row) for row in values])
+    for fmt in np.unique(fmts):
+        rows = fmts == fmt
+        out[rows] = _format_floats(values[rows], fmt)
+    return out
+
+def format_column(series: pd.Series, *, max_chars: int | None = None, escape_md: bool = True) -> np.ndarray:
+    """
+    Series -> mảng str (object) theo dtype: số cùng một format cho cả cột, bool True/False,
+    datetime ISO, chuỗi bị cắt còn `max_chars` ký tự. Giá trị thiếu -> "NA".
+    """
+    max_chars = max_chars or TABLE_MAX_CELL_CHARS
+    dt = series.dtype
+    missing = series.isna().to_numpy()
+    if pd.api.types.is_bool_dtype(dt):
+        out = np.where(series.to_numpy(dtype=object) == True, "True", "False").astype(object)  # noqa: E712
+    elif pd.api.types.is_float_dtype(dt):
+        vals = series.to_numpy(dtype="float64", na_value=np.nan)
+        out = _format_floats(vals, _float_format(vals))
+    elif pd.api.types.is_datetime64_any_dtype(dt):
+        ts = series.dt.tz_localize(None) if getattr(series.dt, "tz", None) is not None else series
+        midnight = (ts.dropna() == ts.dropna().dt.normalize()).all()
+        out = series.dt.strftime("%Y-%m-%d" if midnight else "%Y-%m-%d %H:%M:%S").to_numpy(dtype=object)
+    else:
+        # int (kể cả Int64 nullable) đi đường astype(str) để không mất chính xác > 2**53
+        text = series.astype(str)
+        if not pd.api.types.is_numeric_dtype(dt):
+            text = text.str.replace("\r", " ", regex=False).str.replace("\n", " ", regex=False)
+            if escape_md:
+                text = text.str.replace("|", "\\|", regex=False)
+            long = text.str.len() > max_chars
+            if long.any():
+                text = text.where(~long, text.str.slice(0, max_chars - 1) + "…")
+        out = text.to_numpy(dtype=object)
+    out[missing] = _MISSING
+    return out
+
+def _fit_table(df: pd.DataFrame, *, max_rows: int, max_cols: int | None, max_chars: int, escape_md: bool):
+    """
+    Chọn cột/dòng vừa ngân sách rồi format từng cột.
+    Returns (headers, columns[str arrays], n_rows_shown, omitted_columns)
+    """
+    n_rows = min(max_rows, len(df), max(1, max_chars // (2 * _MIN_CELL_CHARS)))
+    limit = max(1, TABLE_MAX_LINE_CHARS // _MIN_CELL_CHARS)
+    if max_cols:
+        limit = min(limit, max_cols)
+    cand = df.iloc[:n_rows, :limit]
+
+    headers, columns, width = [], [], 0
+    for i, name in enumerate(cand.columns):
+        header = str(name)
+        if escape_md:
+            header = _escape_md(header)
+        values = format_column(cand.iloc[:, i], escape_md=escape_md)
+        col_width = max(len(header), max((len(v) for v in values), default=0)) + 3
+        if columns and width + col_width > TABLE_MAX_LINE_CHARS:
+            break
+        headers.append(header)
+        columns.append(values)
+        width += col_width
+
+    # bỏ bớt dòng cuối nếu tổng vẫn vượt max_chars (ước lượng theo độ rộng dòng)
+    if width and n_rows > 1:
+        n_rows = max(1, min(n_rows, max_chars // width - 2))
+        columns = [c[:n_rows] for c in columns]
+    omitted = [str(c) for c in df.columns[len(headers):]]
+    return headers, columns, n_rows, omitted
+
+def _omitted_note(omitted: list, more_rows: int) -> str | None:
+    notes = []
+    if omitted:
+        names = ", ".join(_escape_md(c) for c in omitted[:10]) + (", …" if len(omitted) > 10 else "")
+        notes.append(f"{len(omitted)} more columns not shown: {names}")
+    if more_rows > 0:
+        notes.append(f"{more_rows} more rows not shown")
+    return "; ".join(notes) or None
+
+def df_to_markdown_table(
+    df, *, max_rows: int = 5, max_cols: int | None = None, max_chars: int | None = None,
+) -> str:
     if df is None or df.empty:
         return "> *(empty dataframe)*"
-    df2 = df.copy().iloc[:max_rows, :max_cols]
+    headers, columns, n_rows, omitted = _fit_table(
+        df, max_rows=max_rows, max_cols=max_cols, max_chars=max_chars or TABLE_MAX_CHARS, escape_md=True,
+    )
+    lines = ["| " + " | ".join(headers) + " |", "|" + " --- |" * len(headers)]
+    lines += ["| " + " | ".join(row) + " |" for row in zip(*columns)]
+    note = _omitted_note(omitted, min(max_rows, len(df)) - n_rows)
+    if note:
+        lines.append(f"\n_{note}._")
+    return "\n".join(lines)
+
+def df_to_csv_payload(
+    df, *, max_rows: int = 5, max_cols: int | None = None, max_chars: int | None = None,
+) -> str:
+    """
+    Bảng gọn cho tool message gửi model: CSV (header + dòng), cùng ngân sách và format số như bảng markdown.
+    """
+    if df is None or df.empty:
+        return ""
+    headers, columns, n_rows, omitted = _fit_table(
+        df, max_rows=max_rows, max_cols=max_cols, max_chars=max_chars or TABLE_MAX_CHARS, escape_md=False,
+    )
+    buf = io.StringIO()
+    pd.DataFrame(dict(enumerate(columns))).to_csv(buf, header=headers, index=False, lineterminator="\n")
+    out = buf.getvalue().rstrip("\n")
+    note = _omitted_note(omitted, min(max_rows, len(df)) - n_rows)
+    return f"{out}\n# {note}" if note else out
+
+def df_to_json_payload(
+    df, *, max_rows: int = 5, max_cols: int | None = None, max_chars: int | None = None,
+) -> dict:
+    """
+    Như df_to_csv_payload() nhưng dạng {"columns", "rows"[, "omitted_columns", "omitted_rows"]}.
+    """
+    if df is None or df.empty:
+        return {"columns": [], "rows": []}
+    headers, columns, n_rows, omitted = _fit_table(
+        df, max_rows=max_rows, max_cols=max_cols, max_chars=max_chars or TABLE_MAX_CHARS, escape_md=False,
+    )
+    out = {"columns": headers, "rows": [list(r) for r in zip(*columns)]}
+    if omitted:
+        out["omitted_columns"] = len(omitted)
+    if min(max_rows, len(df)) > n_rows:
+        out["omitted_rows"] = min(max_rows, len(df)) - n_rows
+    return out
 
-    headers = [str(c) for c in df2.columns.tolist()]
-    header_line = "| " + " | ".join(_escape_md(h) for h in headers) + " |"
-    sep_line = "|" + " --- |" * len(headers)
+def stats_frame(numeric) -> pd.DataFrame:
+    """
+    Bảng thống kê một dòng mỗi cột số (column, count, mean, …, max) — dài theo dòng chứ không theo cột,
+    nên file nhiều cột số vẫn bị cắt gọn theo ngân sách dòng.
+    Giá trị đã format sẵn thành chuỗi, độ chính xác chọn theo từng biến (dòng): biến nhỏ (rate ~0.005)
+    không bị làm tròn về 0 chỉ vì cùng cột stat có biến lớn (revenue ~2e6). `count` giữ dạng số.
+    `numeric`: {col: {stat: value}} (stream_csv_stats) hoặc DataFrame.describe().
+    """
+    desc = numeric if isinstance(numeric, pd.DataFrame) else pd.DataFrame(numeric)
+    t = desc.T.reindex(columns=[s for s in STAT_ROWS if s in desc.index]).astype("float64")
+    value_cols = [c for c in t.columns if c != "count"]
+    out = pd.DataFrame(_format_float_rows(t[value_cols].to_numpy()), columns=value_cols)
+    if "count" in t.columns:
+        out.insert(0, "count", t["count"].to_numpy())
+    out.insert(0, "column", t.index.astype(str))
+    return out
 
-    body_lines = []
-    for _, row in df2.iterrows():
-        cells = [ _escape_md(row[c]) if not isinstance(row[c], (int, float)) else row[c] for c in df2.columns ]
-        body_lines.append("| " + " | ".join(str(c) for c in cells) + " |")
+def stats_table_max_rows(max_chars: int | None = None) -> int:
+    # số cột số tối đa có thể hiện trong bảng stats -> chỉ cần describe() chừng đó cột
+    return max(1, (max_chars or TABLE_MAX_CHARS) // (len(STAT_ROWS) * _MIN_CELL_CHARS * 2))
 
-    return "\n".join([header_line, sep_line, *body_lines])
+def dtype_groups(dtypes_map: dict, *, max_names: int = 40) -> dict:
+    """
+    {dtype: [cột...]} thay cho {cột: dtype}; quá `max_names` tên thì chỉ giữ đầu danh sách + "+N more".
+    """
+    groups: dict[str, list] = {}
+    for col, dt in dtypes_map.items():
+        groups.setdefault(str(dt), []).append(str(col))
+    budget = max_names
+    out = {}
+    for dt, cols in groups.items():
+        keep = cols[:max(1, budget)]
+        budget -= len(keep)
+        out[dt] = keep + ([f"+{len(cols) - len(keep)} more"] if len(cols) > len(keep) else [])
+    return out
 
-def dtypes_to_markdown_table(dtypes_map: dict) -> str:
+def dtypes_to_markdown_table(dtypes_map: dict, *, max_rows: int = 40) -> str:
     if not dtypes_map:
         return "> *(no columns)*"
-    header = "| Column | Type |\n| --- | --- |"
-    rows = [f"| {_escape_md(k)} | {_escape_md(v)} |" for k, v in dtypes_map.items()]
-    return "\n".join([header, *rows])
\ No newline at end of file
+    if len(dtypes_map) <= max_rows:
+        header = "| Column | Type |\n| --- | --- |"
+        rows = [f"| {_escape_md(k)} | {_escape_md(v)} |" for k, v in dtypes_map.items()]
+        return "\n".join([header, *rows])
+    # nhiều cột: gom theo kiểu thay vì một dòng mỗi cột
+    header = "| Type | Count | Columns |\n| --- | --- | --- |"
+    counts: dict[str, int] = {}
+    for dt in dtypes_map.values():
+        counts[str(dt)] = counts.get(str(dt), 0) + 1
+    rows = [
+        f"| {_escape_md(dt)} | {counts[dt]} | {', '.join(_escape_md(c) for c in cols)} |"
+        for dt, cols in dtype_groups(dtypes_map, max_names=max_rows).items()
+    ]
+    return "\n".join([header, *rows])
@@ -0,0 +1,129 @@
+# services/disk_cache.py
+from __future__ import annotations
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+
+def canonical_hash(obj: Any) -> str:
+    """
+    sha256 của JSON chuẩn hoá (sort_keys, không khoảng trắng) -> cùng nội dung thì cùng key.
+    """
+    raw = json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class DiskCache:
+    """
+    Cache key -> JSON trong một file SQLite cục bộ, dùng chung giữa các process/lần chạy.
+    - ttl (giây, 0 = không hết hạn) kiểm tra lúc đọc.
+    - max_bytes: vượt tổng dung lượng value thì xoá các entry dùng lâu nhất trước.
+    Các hàm đều sync (vài ms); gọi từ async code qua asyncio.to_thread.
+    """
+
+    def __init__(self, path: Path, *, ttl: float = 0, max_bytes: int = 256 * 1024 * 1024):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.bypassed = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_accessed_at ON cache (accessed_at)")
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT value, created_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row and self.ttl and now - row[1] > self.ttl:
+                db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                db.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            db.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            db.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def has(self, key: str) -> bool:
+        """
+        Có entry còn hạn cho key không (không đọc value, không tính vào hits/misses).
+        """
+        with self._lock:
+            row = self._db().execute("SELECT created_at FROM cache WHERE key = ?", (key,)).fetchone()
+        return row is not None and not (self.ttl and time.time() - row[0] > self.ttl)
+
+    def set(self, key: str, value: Any) -> None:
+        raw = json.dumps(value, ensure_ascii=False, default=str)
+        if len(raw) > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, raw, len(raw), now, now),
+            )
+            self.stores += 1
+            self._evict(db)
+            db.commit()
+
+    def _evict(self, db: sqlite3.Connection) -> None:
+        if self.ttl:
+            self.evictions += db.execute("DELETE FROM cache WHERE created_at < ?", (time.time() - self.ttl,)).rowcount
+        total = db.execute("SELECT coalesce(sum(size), 0) FROM cache").fetchone()[0]
+        while total > self.max_bytes:
+            key, size = db.execute("SELECT key, size FROM cache ORDER BY accessed_at LIMIT 1").fetchone()
+            db.execute("DELETE FROM cache WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._db().execute("DELETE FROM cache WHERE key = ?", (key,))
+            self._db().commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db().execute("DELETE FROM cache")
+            self._db().commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._db().execute("SELECT count(*), coalesce(sum(size), 0) FROM cache").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "bypassed": self.bypassed,
+        }
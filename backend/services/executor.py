@@ -0,0 +1,101 @@
+# services/executor.py
+import os
+import asyncio
+import contextvars
+import threading
+import multiprocessing
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Callable, Optional
+
+# "thread" (mặc định) hoặc "process" cho CSV rất lớn / cần nhiều CPU core
+TOOL_EXECUTOR = os.getenv("TOOL_EXECUTOR", "thread").lower()
+TOOL_WORKERS = max(1, int(os.getenv("TOOL_WORKERS", str(min(4, os.cpu_count() or 1)))))
+TOOL_QUEUE_MAX = max(0, int(os.getenv("TOOL_QUEUE_MAX", "16")))
+TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", "120"))
+
+
+class ToolBusyError(RuntimeError):
+    """Pool đã đầy (workers + queue), từ chối nhận thêm việc."""
+
+
+class ToolTimeoutError(TimeoutError):
+    """Tool chạy quá thời gian cho phép."""
+
+
+_executor: Optional[Executor] = None
+_pending = 0
+_pending_lock = threading.Lock()
+
+
+def tool_timeout(name: str) -> float:
+    """
+    Timeout riêng cho từng tool qua env TOOL_TIMEOUT_<NAME>, ví dụ TOOL_TIMEOUT_ANALYZE_CSV=300.
+    """
+    return float(os.getenv(f"TOOL_TIMEOUT_{name.upper()}", TOOL_TIMEOUT))
+
+
+def get_tool_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        if TOOL_EXECUTOR == "process":
+            # spawn: tránh fork một process đang có thread (uvicorn, thread pool)
+            _executor = ProcessPoolExecutor(
+                max_workers=TOOL_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        else:
+            _executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="tool")
+    return _executor
+
+
+def shutdown_tool_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = None
+
+
+def pending_tools() -> int:
+    return _pending
+
+
+def _release(_fut) -> None:
+    global _pending
+    with _pending_lock:
+        _pending -= 1
+
+
+async def run_tool(name: str, fn: Callable[..., Any], *args: Any, timeout: Optional[float] = None) -> Any:
+    """
+    Chạy thân tool (hàm sync, CPU-bound) trên worker pool thay vì event loop.
+    - Quá TOOL_WORKERS + TOOL_QUEUE_MAX việc đang chờ/chạy -> ToolBusyError.
+    - Quá `timeout` (mặc định tool_timeout(name)) -> ToolTimeoutError.
+    - Coroutine bị huỷ (client ngắt kết nối) -> việc còn trong hàng đợi bị huỷ theo;
+      việc đang chạy dở chạy nốt nhưng kết quả bị bỏ.
+    """
+    global _pending
+    with _pending_lock:
+        if _pending >= TOOL_WORKERS + TOOL_QUEUE_MAX:
+            raise ToolBusyError(f"Server is busy running other analyses; '{name}' was rejected. Please retry shortly.")
+        _pending += 1
+
+    try:
+        executor = get_tool_executor()
+        if isinstance(executor, ThreadPoolExecutor):
+            # mang theo contextvars (span/Server-Timing của request, xem services/metrics.py) sang worker thread
+            fut = executor.submit(contextvars.copy_context().run, fn, *args)
+        else:
+            fut = executor.submit(fn, *args)
+    except BaseException:
+        _release(None)
+        raise
+    fut.add_done_callback(_release)
+
+    timeout = tool_timeout(name) if timeout is None else timeout
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(fut), timeout=timeout)
+    except asyncio.TimeoutError:
+        fut.cancel()
+        raise ToolTimeoutError(f"Tool '{name}' timed out after {timeout:g}s.")
+    except asyncio.CancelledError:
+        fut.cancel()
+        raise
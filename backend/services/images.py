@@ -0,0 +1,133 @@
+# services/images.py
+from __future__ import annotations
+import os
+import base64
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from .lazy import lazy_import
+
+Image = lazy_import("PIL.Image")
+ImageOps = lazy_import("PIL.ImageOps")
+
+# Giới hạn của vision model (detail=high): ảnh được thu về trong 2048x2048 rồi cạnh ngắn còn 768px,
+# gửi lớn hơn chỉ tốn upload + thời gian decode phía API
+VISION_MAX_SIDE = int(os.getenv("VISION_MAX_SIDE", "2048"))
+VISION_SHORT_SIDE = int(os.getenv("VISION_SHORT_SIDE", "768"))
+VISION_JPEG_QUALITY = int(os.getenv("VISION_JPEG_QUALITY", "85"))
+VISION_PASSTHROUGH_BYTES = int(os.getenv("VISION_PASSTHROUGH_BYTES", str(512 * 1024)))
+VISION_PAYLOAD_CACHE_BYTES = int(os.getenv("VISION_PAYLOAD_CACHE_BYTES", str(32 * 1024 * 1024)))
+
+_MIME = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+_EXT_MIME = {".jpg": "image/jpeg", ".png": "image/png", ".webp": "image/webp", ".gif": "image/gif"}
+
+
+def _target_size(width: int, height: int) -> tuple[int, int]:
+    scale = min(1.0, VISION_MAX_SIDE / max(width, height), VISION_SHORT_SIDE / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _variant_stem(digest: str) -> str:
+    # tham số resize/encode nằm trong tên -> đổi cấu hình thì tạo variant mới
+    return f"{digest[:32]}_{VISION_MAX_SIDE}x{VISION_SHORT_SIDE}q{VISION_JPEG_QUALITY}"
+
+
+def _has_alpha(img: Image.Image) -> bool:
+    return img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info)
+
+
+def vision_variant(path: Path, digest: str, out_dir: Path) -> tuple[Path, str]:
+    """
+    Bản ảnh vừa đủ cho vision model: xoay theo EXIF, thu nhỏ, JPEG (PNG nếu có kênh alpha).
+    Ảnh nhỏ, đúng định dạng API nhận thì dùng nguyên file. Tạo một lần cho mỗi `digest` (sha256 nội dung).
+    Returns (path, mime)
+    """
+    path = Path(path)
+    stem = _variant_stem(digest)
+    for ext, mime in _EXT_MIME.items():
+        existing = out_dir / f"{stem}{ext}"
+        if existing.is_file():
+            return existing, mime
+
+    with Image.open(path) as img:
+        fmt, size = img.format, img.size
+        target = _target_size(*size)
+        rotated = img.getexif().get(0x0112, 1) != 1  # EXIF Orientation
+        if fmt in _MIME and target == size and not rotated and path.stat().st_size <= VISION_PASSTHROUGH_BYTES:
+            return path, _MIME[fmt]
+
+        if fmt == "JPEG":
+            img.draft("RGB", target)  # decode JPEG ở độ phân giải thấp hơn ngay từ đầu, nhanh hơn nhiều
+        img = ImageOps.exif_transpose(img)
+        if img.size != _target_size(*img.size):
+            img = img.resize(_target_size(*img.size), Image.LANCZOS, reducing_gap=3.0)
+
+        out_dir.mkdir(parents=True, exist_ok=True)
+        if _has_alpha(img):
+            out, mime, save_kw = out_dir / f"{stem}.png", "image/png", {"format": "PNG"}
+            img = img.convert("RGBA")
+        else:
+            out, mime = out_dir / f"{stem}.jpg", "image/jpeg"
+            save_kw = {"format": "JPEG", "quality": VISION_JPEG_QUALITY, "optimize": True}
+            img = img.convert("RGB")
+        # ghi file tạm rồi rename, như render_histogram
+        tmp = out.with_name(f"{out.stem}.{os.getpid()}.{threading.get_ident()}.tmp")
+        img.save(tmp, **save_kw)
+        os.replace(tmp, out)
+    return out, mime
+
+
+def encode_data_url(path: Path, mime: str) -> str:
+    with open(path, "rb") as f:
+        return f"data:{mime};base64,{base64.b64encode(f.read()).decode()}"
+
+
+def vision_data_url(path: str, digest: str, out_dir: str) -> str:
+    # Chạy trên worker pool (xem services/executor.py)
+    variant, mime = vision_variant(Path(path), digest, Path(out_dir))
+    return encode_data_url(variant, mime)
+
+
+class PayloadCache:
+    """
+    LRU data URL (base64) đã encode, theo sha256 nội dung ảnh; giới hạn tổng số ký tự.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, digest: str) -> str | None:
+        with self._lock:
+            url = self._entries.get(digest)
+            if url is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return url
+
+    def put(self, digest: str, url: str) -> None:
+        if len(url) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(digest, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[digest] = url
+            self._bytes += len(url)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+
+vision_payloads = PayloadCache(VISION_PAYLOAD_CACHE_BYTES)
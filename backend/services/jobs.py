@@ -0,0 +1,301 @@
+# services/jobs.py
+from __future__ import annotations
+import os
+import socket
+import logging
+import uuid
+import asyncio
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+
+from sqlalchemy import select, update, func, or_, and_
+
+from models import Job
+from .executor import ToolBusyError
+from .openai_scheduler import session_turns
+
+# Job nền chạy trong chính process API, hàng đợi là bảng `jobs` (không cần broker).
+# Tool nặng trên file lớn trả ngay "job started"; kết quả được gửi vào session thành một assistant message.
+JOB_THRESHOLD_BYTES = int(os.getenv("JOB_THRESHOLD_BYTES", str(50 * 1024 * 1024)))  # -1 = không dùng job
+JOB_CONCURRENCY = max(1, int(os.getenv("JOB_CONCURRENCY", "2")))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "30"))
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "2"))
+JOB_MAX_ATTEMPTS = max(1, int(os.getenv("JOB_MAX_ATTEMPTS", "3")))
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", "3600"))  # thay cho TOOL_TIMEOUT khi tool chạy trong job
+
+ACTIVE_STATUSES = ("queued", "running")
+
+logger = logging.getLogger(__name__)
+
+JobHandler = Callable[[dict, "JobProgress"], Awaitable[dict]]
+_handlers: Dict[str, JobHandler] = {}
+
+
+def job_handler(kind: str):
+    """
+    Đăng ký hàm chạy job `kind`: async (args, progress) -> dict như kết quả tool
+    ({"markdown", "tool_outputs", "new_attachments"} hoặc {"error"}).
+    """
+    def register(fn: JobHandler) -> JobHandler:
+        _handlers[kind] = fn
+        return fn
+    return register
+
+
+class JobProgress:
+    """
+    Handler báo tiến độ qua update() (gọi được từ worker thread của tool); runner ghi xuống DB theo nhịp heartbeat.
+    """
+
+    def __init__(self):
+        self.fraction = 0.0
+        self.parts: list[str] = []
+        self.dirty = False
+
+    def update(self, fraction: float, markdown: Optional[str] = None) -> None:
+        self.fraction = max(self.fraction, min(1.0, fraction))
+        if markdown:
+            self.parts.append(markdown)
+        self.dirty = True
+
+    @property
+    def markdown(self) -> Optional[str]:
+        return "\n\n".join(self.parts) or None
+
+
+def serialize_job(job: Job) -> dict:
+    return {
+        "id": job.id,
+        "session_id": job.session_id,
+        "kind": job.kind,
+        "status": job.status,
+        "progress": round(job.progress or 0.0, 4),
+        "markdown": job.markdown,
+        "result": job.result,
+        "error": job.error,
+        "message_id": job.message_id,
+        "attempts": job.attempts,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def _claimable(now: datetime):
+    # job chờ chạy, hoặc đang "running" nhưng lease đã hết (worker cũ chết/restart)
+    return or_(Job.status == "queued", and_(Job.status == "running", Job.lease_until < now))
+
+
+class JobRunner:
+    """
+    Vòng lặp nền: claim job từ bảng `jobs` (UPDATE có điều kiện, an toàn khi nhiều worker),
+    chạy tối đa JOB_CONCURRENCY job, heartbeat ghi progress + gia hạn lease, xong thì gửi
+    kết quả vào session (deliver) và đánh dấu job trong cùng transaction.
+    """
+
+    def __init__(self):
+        self.owner = f"{socket.gethostname()[:40]}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._session_factory = None
+        self._deliver = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._stopping = False
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def running(self) -> bool:
+        return self._loop_task is not None and not self._loop_task.done()
+
+    async def start(self, session_factory, deliver: Callable[..., Awaitable[Optional[int]]]) -> None:
+        """
+        `deliver(db, job, content, result)` thêm assistant message (chưa commit) và trả về message id.
+        """
+        self._session_factory = session_factory
+        self._deliver = deliver
+        self._stopping = False
+        self._wake = asyncio.Event()
+        self._loop_task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        # job đang chạy dở được trả về hàng đợi -> lần khởi động sau chạy lại ngay, không chờ hết lease
+        self._stopping = True
+        tasks = list(self._tasks.values())
+        if self._loop_task:
+            tasks.append(self._loop_task)
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._loop_task = None
+
+    async def enqueue(self, session_id: str, kind: str, args: dict) -> dict:
+        async with self._session_factory() as db:
+            job = Job(id=uuid.uuid4().hex, session_id=session_id, kind=kind, args=args, status="queued", progress=0.0)
+            db.add(job)
+            await db.commit()
+            data = serialize_job(job)
+        self._wake.set()
+        return data
+
+    async def cancel(self, job_id: str) -> bool:
+        async with self._session_factory() as db:
+            now = datetime.utcnow()
+            res = await db.execute(
+                update(Job).where(Job.id == job_id, Job.status.in_(ACTIVE_STATUSES))
+                .values(status="cancelled", finished_at=now, updated_at=now, lease_owner=None, lease_until=None)
+            )
+            await db.commit()
+        task = self._tasks.get(job_id)
+        if task:
+            task.cancel()  # worker khác phát hiện qua heartbeat
+        return res.rowcount == 1
+
+    # ---------- vòng lặp ----------
+    async def _loop(self) -> None:
+        while True:
+            try:
+                while len(self._tasks) < JOB_CONCURRENCY:
+                    job = await self._claim()
+                    if job is None:
+                        break
+                    task = asyncio.create_task(self._run(job))
+                    self._tasks[job.id] = task
+                    task.add_done_callback(lambda _t, job_id=job.id: self._finished(job_id))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Job runner poll failed")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def _finished(self, job_id: str) -> None:
+        self._tasks.pop(job_id, None)
+        if self._wake:
+            self._wake.set()
+
+    async def _claim(self) -> Optional[Job]:
+        async with self._session_factory() as db:
+            now = datetime.utcnow()
+            ids = (await db.execute(
+                select(Job.id).where(_claimable(now)).order_by(Job.created_at).limit(JOB_CONCURRENCY)
+            )).scalars().all()
+            for job_id in ids:
+                if job_id in self._tasks:
+                    continue
+                res = await db.execute(
+                    update(Job).where(Job.id == job_id, _claimable(now)).values(
+                        status="running", lease_owner=self.owner,
+                        lease_until=now + timedelta(seconds=JOB_LEASE_SECONDS),
+                        attempts=func.coalesce(Job.attempts, 0) + 1,
+                        started_at=func.coalesce(Job.started_at, now), updated_at=now,
+                    )
+                )
+                await db.commit()
+                if res.rowcount == 1:
+                    return (await db.execute(
+                        select(Job).where(Job.id == job_id).execution_options(populate_existing=True)
+                    )).scalar_one()
+        return None
+
+    async def _heartbeat(self, job_id: str, progress: JobProgress, task: asyncio.Task) -> None:
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            values = {"lease_until": datetime.utcnow() + timedelta(seconds=JOB_LEASE_SECONDS)}
+            if progress.dirty:
+                progress.dirty = False  # reset trước khi đọc: update() từ worker thread chen vào vẫn được ghi lần sau
+                values.update(progress=progress.fraction, markdown=progress.markdown)
+            try:
+                async with self._session_factory() as db:
+                    res = await db.execute(
+                        update(Job).where(Job.id == job_id, Job.status == "running", Job.lease_owner == self.owner)
+                        .values(updated_at=datetime.utcnow(), **values)
+                    )
+                    await db.commit()
+            except Exception as e:
+                logger.warning("Job %s heartbeat failed: %s", job_id, e)
+                continue
+            if res.rowcount == 0:
+                task.cancel()  # job bị huỷ hoặc lease đã sang worker khác
+                return
+
+    async def _run(self, job: Job) -> None:
+        progress = JobProgress()
+        handler = _handlers.get(job.kind)
+        if job.attempts > JOB_MAX_ATTEMPTS:
+            result = {"error": f"Gave up after {JOB_MAX_ATTEMPTS} attempts (the worker stopped while running it)."}
+        elif handler is None:
+            result = {"error": f"Unknown job kind '{job.kind}'."}
+        else:
+            hb = asyncio.create_task(self._heartbeat(job.id, progress, asyncio.current_task()))
+            try:
+                while True:
+                    try:
+                        result = await handler(job.args or {}, progress)
+                        break
+                    except ToolBusyError:
+                        await asyncio.sleep(JOB_POLL_SECONDS)  # worker pool đang đầy: giữ lease, thử lại sau
+            except asyncio.CancelledError:
+                if self._stopping:
+                    await self._requeue(job.id)
+                raise
+            except Exception as e:
+                result = {"error": f"{type(e).__name__}: {e}"}
+            finally:
+                hb.cancel()
+        await self._complete(job, result, progress)
+
+    async def _requeue(self, job_id: str) -> None:
+        async with self._session_factory() as db:
+            await db.execute(
+                update(Job).where(Job.id == job_id, Job.status == "running", Job.lease_owner == self.owner).values(
+                    status="queued", lease_owner=None, lease_until=None, updated_at=datetime.utcnow(),
+                    attempts=func.coalesce(Job.attempts, 1) - 1,  # không tính là một lần thất bại
+                )
+            )
+            await db.commit()
+
+    async def _complete(self, job: Job, result: dict, progress: JobProgress) -> None:
+        failed = "error" in result
+        if failed:
+            content = f"Background `{job.kind}` job failed: {result['error']}"
+        else:
+            content = result.get("markdown") or progress.markdown or f"Background `{job.kind}` job finished."
+        # cùng khoá với lượt chat: message kết quả không chen vào giữa user message và câu trả lời của lượt đang chạy
+        async with session_turns.turn(job.session_id):
+            async with self._session_factory() as db:
+                now = datetime.utcnow()
+                res = await db.execute(
+                    update(Job).where(Job.id == job.id, Job.status == "running", Job.lease_owner == self.owner).values(
+                        status="error" if failed else "done",
+                        progress=progress.fraction if failed else 1.0,
+                        markdown=progress.markdown if failed else content,
+                        error=result.get("error"),
+                        result=None if failed else {
+                            "tool_outputs": result.get("tool_outputs"),
+                            "attachments": result.get("new_attachments") or [],
+                        },
+                        lease_owner=None, lease_until=None, finished_at=now, updated_at=now,
+                    )
+                )
+                if res.rowcount == 0:  # bị huỷ trong lúc chạy
+                    await db.rollback()
+                    return
+                message_id = await self._deliver(db, job, content, result)
+                if message_id is not None:
+                    await db.execute(update(Job).where(Job.id == job.id).values(message_id=message_id))
+                await db.commit()
+        if failed:
+            self.failed += 1
+        else:
+            self.completed += 1
+
+    def stats(self) -> dict:
+        return {"running": len(self._tasks), "completed": self.completed, "failed": self.failed}
+
+
+job_runner = JobRunner()
@@ -0,0 +1,96 @@
+# services/lazy.py
+from __future__ import annotations
+import os
+import time
+import logging
+import importlib
+from types import ModuleType
+from typing import Callable, Dict, List, Optional
+
+# pandas / numpy / matplotlib / PIL chỉ được import khi tool dùng tới lần đầu: worker chỉ phục vụ
+# /sessions, /static không phải trả ~1.5s import lúc khởi động. PREWARM=1 import sẵn trong nền sau startup.
+PREWARM = os.getenv("PREWARM", "1").lower() in ("1", "true", "yes")
+
+_modules: Dict[str, "LazyModule"] = {}
+_prewarm_hooks: List[Callable[[], None]] = []
+_stats = {"prewarm_seconds": 0.0, "prewarm_done": 0}
+
+logger = logging.getLogger(__name__)
+
+
+class LazyModule:
+    """
+    Đứng thay cho module `name`; lần truy cập thuộc tính đầu tiên mới import thật (rồi gọi on_load).
+    Sau đó namespace của module được chép vào instance nên các lần truy cập sau không qua __getattr__.
+    """
+
+    def __init__(self, name: str, on_load: Optional[Callable[[ModuleType], None]] = None):
+        self._lazy_name = name
+        self._lazy_on_load = on_load
+        self._lazy_module: Optional[ModuleType] = None
+        self._lazy_seconds = 0.0
+
+    def _lazy_load(self) -> ModuleType:
+        if self._lazy_module is None:
+            started = time.perf_counter()
+            module = importlib.import_module(self._lazy_name)
+            if self._lazy_on_load:
+                self._lazy_on_load(module)
+            self.__dict__.update({k: v for k, v in vars(module).items() if not k.startswith("_lazy_")})
+            self._lazy_seconds = time.perf_counter() - started
+            self._lazy_module = module
+        return self._lazy_module
+
+    def __getattr__(self, attr: str):
+        if attr.startswith("_lazy_"):
+            raise AttributeError(attr)
+        return getattr(self._lazy_load(), attr)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self._lazy_module is not None else "not loaded"
+        return f"<lazy module '{self._lazy_name}' ({state})>"
+
+
+def lazy_import(name: str, on_load: Optional[Callable[[ModuleType], None]] = None) -> LazyModule:
+    """
+    `pd = lazy_import("pandas")` thay cho `import pandas as pd`; cùng tên module dùng chung một proxy.
+    """
+    if name not in _modules:
+        _modules[name] = LazyModule(name, on_load)
+    return _modules[name]
+
+
+def register_prewarm(fn: Callable[[], None]) -> Callable[[], None]:
+    # việc khởi tạo thêm sau khi import (vd. font cache của matplotlib), chạy trong prewarm()
+    _prewarm_hooks.append(fn)
+    return fn
+
+
+def prewarm() -> Dict[str, float]:
+    """
+    Import mọi module lazy + chạy các hook (gọi trong thread nền). Returns {module: giây import}.
+    """
+    started = time.perf_counter()
+    for mod in list(_modules.values()):
+        try:
+            mod._lazy_load()
+        except ImportError as e:
+            logger.warning("Prewarm: cannot import %s: %s", mod._lazy_name, e)
+    for hook in _prewarm_hooks:
+        try:
+            hook()
+        except Exception:
+            logger.exception("Prewarm hook %s failed", getattr(hook, "__name__", hook))
+    _stats["prewarm_seconds"] = round(time.perf_counter() - started, 4)
+    _stats["prewarm_done"] = 1
+    return {name: round(m._lazy_seconds, 4) for name, m in _modules.items()}
+
+
+def stats() -> dict:
+    loaded = [m for m in _modules.values() if m._lazy_module is not None]
+    return {
+        "modules": len(_modules),
+        "loaded": len(loaded),
+        "import_seconds": round(sum(m._lazy_seconds for m in loaded), 4),
+        **_stats,
+    }
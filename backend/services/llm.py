@@ -1,16 +1,31 @@
 # services/llm.py
-import os, base64, json, re
-from typing import List, Dict, Optional, Tuple
+import os, json
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import List, Dict, Optional, Tuple, AsyncIterator, Awaitable, Callable
 from pathlib import Path
 from dotenv import load_dotenv
-import httpx
-from sqlalchemy.orm import Session as OrmSession
-from sqlalchemy import desc
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import desc, select
 
-from models import Attachment, Message
+from models import Attachment, Message, SessionChat
 from .csv_tools import (
-    load_csv, basic_stats, histogram_plot, df_to_markdown_table, dtypes_to_markdown_table
+    load_csv, df_to_markdown_table, dtypes_to_markdown_table,
+    df_to_csv_payload, df_to_json_payload, dtype_groups, stats_frame, stats_table_max_rows,
+    stream_csv_stats, CSV_STREAM_THRESHOLD_BYTES, dataset_hash,
+    TABLE_MAX_CHARS, TABLE_MAX_LINE_CHARS, TABLE_MAX_CELL_CHARS, TABLE_SIG_DIGITS,
 )
+from .plots import plot_histograms, touch_plot, DEFAULT_BINS, HIST_STYLE
+from .http_client import get_http_client
+from .executor import run_tool, ToolBusyError, ToolTimeoutError, TOOL_EXECUTOR
+from .disk_cache import DiskCache, canonical_hash
+from .images import vision_data_url, vision_payloads
+from .metrics import span, record_span, record_openai_usage, tool_calls as tool_calls_counter
+from .singleflight import SingleFlight
+from .jobs import job_runner, job_handler, JobProgress, JOB_THRESHOLD_BYTES, JOB_TIMEOUT
+from .openai_scheduler import openai_scheduler, estimate_request_tokens, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
 
 BASE_DIR = Path(__file__).resolve().parents[1]
 UPLOADS = BASE_DIR / "uploads"
@@ -20,44 +35,203 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     raise RuntimeError("Missing OPENAI_API_KEY in environment (.env).")
 
-OPENAI_URL = "https://api.openai.com/v1/chat/completions"
+# trỏ sang server giả lập khi benchmark (xem bench/mock_openai.py)
+OPENAI_URL = os.getenv("OPENAI_URL", "https://api.openai.com/v1/chat/completions")
 TEXT_MODEL = os.getenv("OPENAI_TEXT_MODEL", "gpt-4o-mini")
 VISION_MODEL = os.getenv("OPENAI_VISION_MODEL", TEXT_MODEL)
+TOOL_CONCURRENCY = max(1, int(os.getenv("TOOL_CONCURRENCY", "4")))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+SUMMARY_MODEL = os.getenv("OPENAI_SUMMARY_MODEL", TEXT_MODEL)
+# None = mặc định của API; đặt 0 để câu trả lời tất định (và cache được)
+OPENAI_TEMPERATURE = float(os.environ["OPENAI_TEMPERATURE"]) if os.getenv("OPENAI_TEMPERATURE") else None
+
+# Cache response (opt-in): chỉ request tất định (temperature=0, n=1) và chỉ response không gọi tool
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "0").lower() in ("1", "true", "yes")
+llm_cache = DiskCache(
+    Path(os.getenv("LLM_CACHE_PATH", str(BASE_DIR / "cache" / "llm_cache.sqlite3"))),
+    ttl=float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600))),
+    max_bytes=int(os.getenv("LLM_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+)
+
+# Memo kết quả tool theo (tool, hash nội dung dataset, args chuẩn hoá); file đổi -> hash đổi -> key mới
+TOOL_CACHE_ENABLED = os.getenv("TOOL_CACHE_ENABLED", "1").lower() in ("1", "true", "yes")
+tool_cache = DiskCache(
+    Path(os.getenv("TOOL_CACHE_PATH", str(BASE_DIR / "cache" / "tool_cache.sqlite3"))),
+    ttl=float(os.getenv("TOOL_CACHE_TTL", str(30 * 24 * 3600))),
+    max_bytes=int(os.getenv("TOOL_CACHE_MAX_BYTES", str(128 * 1024 * 1024))),
+)
+# Tool message gửi model: bảng dạng csv | json (gọn hơn markdown) hoặc markdown (như trước)
+TOOL_PAYLOAD_FORMAT = os.getenv("TOOL_PAYLOAD_FORMAT", "csv").lower()
+PROFILE_MAX_COLUMN_NAMES = int(os.getenv("PROFILE_MAX_COLUMN_NAMES", "200"))
+
+# Kết quả tool đã lưu còn phụ thuộc cấu hình render (format bảng gửi model, ngân sách bảng, style plot):
+# nằm trong key -> đổi cấu hình thì miss thay vì trả bản render cũ tới hết TTL.
+# Tăng TOOL_RESULT_VERSION khi đổi cấu trúc kết quả tool.
+TOOL_RESULT_VERSION = 3
+TOOL_RESULT_FORMAT = canonical_hash([
+    TOOL_RESULT_VERSION, TOOL_PAYLOAD_FORMAT,
+    TABLE_MAX_CHARS, TABLE_MAX_LINE_CHARS, TABLE_MAX_CELL_CHARS, TABLE_SIG_DIGITS, HIST_STYLE,
+])[:16]
+
+def _tool_cache_key(name: str, digest: str, args: dict) -> str:
+    return canonical_hash([name, TOOL_RESULT_FORMAT, digest, args])
+
+# Việc giống hệt nhau đang chạy đồng thời (double-submit, nhiều tab cùng một file) chỉ chạy một lần
+inflight = SingleFlight()
 
 # ---------- Low-level API callers ----------
-async def _openai_post(payload: dict) -> dict:
+def _cache_key(payload: dict) -> Optional[str]:
+    """
+    Key = hash chuẩn hoá của (model, messages, tools, params); None nếu request không tất định.
+    """
+    if not LLM_CACHE_ENABLED or payload.get("temperature") != 0 or payload.get("n", 1) != 1:
+        return None
+    return canonical_hash({k: v for k, v in payload.items() if k != "stream"})
+
+def _is_final(data: dict) -> bool:
+    return not data["choices"][0]["message"].get("tool_calls")
+
+async def _cached_lookup(key: Optional[str], cache: bool) -> Optional[dict]:
+    if key is None:
+        return None
+    if not cache:
+        llm_cache.bypassed += 1
+        return None
+    return await asyncio.to_thread(llm_cache.get, key)
+
+async def _openai_post(
+    payload: dict, cache: bool = True, kind: str = "chat", priority: int = PRIORITY_INTERACTIVE
+) -> dict:
+    """
+    `cache=False`: bỏ qua cache khi đọc (vẫn ghi đè bằng response mới).
+    `kind`: nhãn metrics (chat | vision | summary).
+    `priority`: thứ tự trong hàng đợi của openai_scheduler (xem services/openai_scheduler.py).
+    """
+    key = _cache_key(payload)
+    hit = await _cached_lookup(key, cache)
+    if hit is not None:
+        return hit
+
     headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
-    async with httpx.AsyncClient(timeout=120, trust_env=True) as client:
-        r = await client.post(OPENAI_URL, headers=headers, json=payload)
+    client = get_http_client()
+    tokens = estimate_request_tokens(payload)
+    with span("openai", kind):
+        r = await openai_scheduler.post(
+            client, OPENAI_URL, headers=headers, payload=payload, tokens=tokens, priority=priority
+        )
+    if r.status_code >= 400:
+        record_openai_usage(payload["model"], kind, None, status=str(r.status_code))
+        try:
+            print("OpenAI error payload:", r.json())
+        except Exception:
+            print("OpenAI error text:", r.text)
+    r.raise_for_status()
+    data = r.json()
+    record_openai_usage(payload["model"], kind, data)
+    openai_scheduler.reconcile(tokens, data.get("usage"))
+    if key is not None and _is_final(data):
+        await asyncio.to_thread(llm_cache.set, key, data)
+    return data
+
+def _text_payload(messages: List[Dict], tools: Optional[List[Dict]]) -> dict:
+    payload = {"model": TEXT_MODEL, "messages": messages}
+    if OPENAI_TEMPERATURE is not None:
+        payload["temperature"] = OPENAI_TEMPERATURE
+    if tools:
+        payload["tools"] = tools
+        payload["tool_choice"] = "auto"
+    return payload
+
+async def call_openai(messages: List[Dict], tools: Optional[List[Dict]] = None, cache: bool = True) -> dict:
+    return await _openai_post(_text_payload(messages, tools), cache=cache)
+
+async def _openai_stream(payload: dict) -> AsyncIterator[dict]:
+    """
+    POST với stream=True, yield từng chunk JSON (SSE `data: {...}`) cho đến `[DONE]`.
+    """
+    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
+    client = get_http_client()
+    # include_usage: chunk cuối (choices rỗng) mang token usage cho metrics
+    body = {**payload, "stream": True, "stream_options": {"include_usage": True}}
+    usage_chunk = None
+    tokens = estimate_request_tokens(payload)
+    started = time.perf_counter()
+    async with openai_scheduler.stream(client, OPENAI_URL, headers=headers, payload=body, tokens=tokens) as r:
+        record_span("openai", time.perf_counter() - started, "stream_first_byte")
         if r.status_code >= 400:
+            record_openai_usage(payload["model"], "stream", None, status=str(r.status_code))
+            await r.aread()
             try:
                 print("OpenAI error payload:", r.json())
             except Exception:
                 print("OpenAI error text:", r.text)
-        r.raise_for_status()
-        return r.json()
+            r.raise_for_status()
+        async for line in r.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            chunk = json.loads(data)
+            if chunk.get("usage"):
+                usage_chunk = chunk
+            yield chunk
+    record_openai_usage(payload["model"], "stream", usage_chunk)
+    openai_scheduler.reconcile(tokens, (usage_chunk or {}).get("usage"))
 
-async def call_openai(messages: List[Dict], tools: Optional[List[Dict]] = None) -> dict:
-    payload = {"model": TEXT_MODEL, "messages": messages}
-    if tools:
-        payload["tools"] = tools
-        payload["tool_choice"] = "auto"
-    return await _openai_post(payload)
+async def call_openai_stream(
+    messages: List[Dict], tools: Optional[List[Dict]] = None, cache: bool = True
+) -> AsyncIterator[dict]:
+    payload = _text_payload(messages, tools)
+    key = _cache_key(payload)
+    hit = await _cached_lookup(key, cache)
+    if hit is not None:
+        # cache hit: phát lại cả câu trả lời trong một chunk
+        yield {"choices": [{"index": 0, "delta": hit["choices"][0]["message"], "finish_reason": "stop"}]}
+        return
+
+    parts: List[str] = []
+    has_tool_calls = False
+    async for chunk in _openai_stream(payload):
+        for choice in chunk.get("choices") or []:
+            delta = choice.get("delta") or {}
+            parts.append(delta.get("content") or "")
+            has_tool_calls = has_tool_calls or bool(delta.get("tool_calls"))
+        yield chunk
+    if key is not None and not has_tool_calls:
+        # lưu cùng dạng với response non-stream -> /chat và /chat/stream dùng chung entry
+        data = {"choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(parts)}, "finish_reason": "stop"}]}
+        await asyncio.to_thread(llm_cache.set, key, data)
+
+async def _vision_image_url(image_path: str, digest: str) -> str:
+    """
+    Data URL của bản ảnh đã thu nhỏ/encode lại (xem services/images.py), cache theo hash nội dung.
+    """
+    url = vision_payloads.get(digest)
+    if url is None:
+        url = await run_tool("prepare_image", vision_data_url, image_path, digest, str(UPLOADS / "images" / "vision"))
+        vision_payloads.put(digest, url)
+    return url
 
 async def call_openai_vision(prompt: str, image_path: str) -> str:
-    with open(image_path, "rb") as f:
-        b64 = base64.b64encode(f.read()).decode()
+    # cùng ảnh (theo nội dung) + cùng prompt đang được hỏi ở request khác -> chờ chung câu trả lời đó
+    digest = await asyncio.to_thread(dataset_hash, Path(image_path))
+    key = canonical_hash(["vision", VISION_MODEL, digest, prompt])
+    return await inflight.do(key, lambda: _call_openai_vision(prompt, image_path, digest))
+
+async def _call_openai_vision(prompt: str, image_path: str, digest: str) -> str:
+    image_url = await _vision_image_url(image_path, digest)
     payload = {
         "model": VISION_MODEL,
         "messages": [{
             "role": "user",
             "content": [
                 {"type": "text", "text": prompt},
-                {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{b64}"}},
+                {"type": "image_url", "image_url": {"url": image_url}},
             ],
         }],
     }
-    data = await _openai_post(payload)
+    data = await _openai_post(payload, kind="vision")
     return data["choices"][0]["message"]["content"]
 
 # ---------- Runtime helpers ----------
@@ -67,18 +241,24 @@ def _public_url(path: Path) -> Optional[str]:
     except Exception:
         return None
 
-def _latest_attachment(db: OrmSession, session_id: str, kind: str) -> Optional[Attachment]:
-    return (
-        db.query(Attachment)
-        .join(Message, Attachment.message_id == Message.id)
-        .filter(Message.session_id == session_id, Attachment.kind == kind)
-        .order_by(Attachment.created_at.desc())
-        .first()
-    )
-    
-def _resolve_csv_path(db: OrmSession, session_id: str, csv_path: Optional[str]) -> Optional[Path]:
+def _db_lock(db: AsyncSession) -> asyncio.Lock:
+    """
+    AsyncSession không dùng đồng thời được; các tool chạy song song trong một lượt chat
+    dùng chung session nên truy vấn DB của chúng đi qua lock này.
+    """
+    return db.info.setdefault("tool_lock", asyncio.Lock())
+
+async def _latest_attachment(db: AsyncSession, session_id: str, kind: str) -> Optional[Attachment]:
+    """
+    csv/ảnh mới nhất của session qua con trỏ trên SessionChat (2 lần get theo khoá chính).
+    """
+    sess = await db.get(SessionChat, session_id)
+    att_id = getattr(sess, f"latest_{kind}_attachment_id", None) if sess else None
+    return await db.get(Attachment, att_id) if att_id else None
+
+async def _resolve_csv_path(db: AsyncSession, session_id: str, csv_path: Optional[str]) -> Optional[Path]:
     """
-    Cố gắng tìm đúng CSV thật trong uploads/csv theo format {session_id}_{tênfile}.csv
+    Cố gắng tìm đúng CSV thật theo format {session_id}_{tênfile}.csv, không quét thư mục uploads/csv.
     """
     if not csv_path:
         return None
@@ -87,102 +267,377 @@ def _resolve_csv_path(db: OrmSession, session_id: str, csv_path: Optional[str])
     if p.is_file():
         return p
 
-    csv_dir = UPLOADS / "csv"
+    name = p.name
+    async with _db_lock(db):
+        latest = await _latest_attachment(db, session_id, "csv")
 
-    # Trường hợp model chỉ gửi 'products_sample.csv' → tìm file có prefix session_id_
-    for cand in csv_dir.glob(f"{session_id}_*{Path(csv_path).name}"):
-        if cand.is_file():
-            return cand
+    # Trường hợp model chỉ gửi 'products_sample.csv' → csv của session có tên kết thúc bằng tên đó;
+    # thường là CSV mới nhất (con trỏ trên session) nên khỏi query
+    if latest and Path(latest.path).name.endswith(name) and Path(latest.path).is_file():
+        return Path(latest.path)
+
+    async with _db_lock(db):
+        # autoescape: '_' / '%' trong tên file là ký tự thường, không phải wildcard của LIKE
+        att = await db.scalar(
+            select(Attachment)
+            .join(Message, Attachment.message_id == Message.id)
+            .where(
+                Message.session_id == session_id, Attachment.kind == "csv",
+                Attachment.path.endswith(name, autoescape=True),
+            )
+            .order_by(desc(Attachment.id))
+            .limit(1)
+        )
+    if att and Path(att.path).is_file():
+        return Path(att.path)
 
     # Trường hợp model gửi thẳng 'abc_products_sample.csv'
-    maybe = csv_dir / csv_path
+    maybe = UPLOADS / "csv" / csv_path
     if maybe.is_file():
         return maybe
 
-    # Fallback: tìm trong DB Attachment mới nhất
-    att = (
-        db.query(Attachment)
-        .join(Message, Attachment.message_id == Message.id)
-        .filter(Message.session_id == session_id, Attachment.kind == "csv")
-        .order_by(desc(Attachment.created_at))
-        .first()
-    )
-    if att and Path(att.path).is_file():
-        return Path(att.path)
+    # Fallback: CSV mới nhất của session
+    if latest and Path(latest.path).is_file():
+        return Path(latest.path)
 
     return None
 
 # ---------- Tool implementations ----------
-async def tool_get_context_assets(db: OrmSession, session_id: str, prefer: Optional[str] = None) -> dict:
+async def _csv_profile(db: AsyncSession, session_id: str, csv_path: Optional[str]) -> Optional[dict]:
+    """
+    Profile lưu lúc upload (rows, columns, dtypes, bytes, sha256) của CSV này, nếu có.
+    """
+    if not csv_path:
+        return None
+    async with _db_lock(db):
+        latest = await _latest_attachment(db, session_id, "csv")
+        if latest and latest.path == str(csv_path):
+            return latest.profile
+        att = await db.scalar(
+            select(Attachment)
+            .join(Message, Attachment.message_id == Message.id)
+            .where(Message.session_id == session_id, Attachment.kind == "csv", Attachment.path == str(csv_path))
+            .order_by(desc(Attachment.created_at))
+            .limit(1)
+        )
+    return att.profile if att else None
+
+def _profile_summary(profile: dict) -> dict:
+    # cột gom theo dtype: không lặp tên kiểu cho từng cột khi file rất rộng
+    out = {k: profile[k] for k in ("rows", "rows_estimated", "bytes") if k in profile}
+    if "dtypes" in profile:
+        out["columns"] = len(profile["dtypes"])
+        out["dtypes"] = dtype_groups(profile["dtypes"], max_names=PROFILE_MAX_COLUMN_NAMES)
+    return out
+
+async def tool_get_context_assets(db: AsyncSession, session_id: str, prefer: Optional[str] = None) -> dict:
     """
     Return latest csv/image for this session if exist.
     prefer: 'csv' | 'image' | None
     """
     out = {}
-    if prefer in (None, "csv"):
-        last_csv = _latest_attachment(db, session_id, "csv")
-        if last_csv:
-            out["csv_path"] = str(last_csv.path)
-            out["csv_public_url"] = _public_url(Path(last_csv.path))
-    if prefer in (None, "image"):
-        last_img = _latest_attachment(db, session_id, "image")
-        if last_img:
-            out["image_path"] = str(last_img.path)
-            out["image_public_url"] = _public_url(Path(last_img.path))
+    async with _db_lock(db):
+        if prefer in (None, "csv"):
+            last_csv = await _latest_attachment(db, session_id, "csv")
+            if last_csv:
+                out["csv_path"] = str(last_csv.path)
+                out["csv_public_url"] = _public_url(Path(last_csv.path))
+                if last_csv.profile:
+                    out["csv_profile"] = _profile_summary(last_csv.profile)
+        if prefer in (None, "image"):
+            last_img = await _latest_attachment(db, session_id, "image")
+            if last_img:
+                out["image_path"] = str(last_img.path)
+                out["image_public_url"] = _public_url(Path(last_img.path))
     return out
 
-async def tool_analyze_csv(db: OrmSession, session_id: str, csv_path: str, question: str) -> dict:
+def _table_payload(df):
+    if TOOL_PAYLOAD_FORMAT == "json":
+        return df_to_json_payload(df, max_rows=len(df))
+    return df_to_csv_payload(df, max_rows=len(df))
+
+def _overview_markdown(n_rows: int, n_cols: int, notes: List[str]) -> str:
+    return "\n\n".join([f"### CSV Overview\n- **Rows**: {n_rows}  \n- **Columns**: {n_cols}", *notes])
+
+def _preview_markdown(head) -> str:
+    return "\n\n".join(["**Preview (first 5 rows)**", df_to_markdown_table(head)])
+
+def _dtypes_markdown(dtypes_map: dict) -> str:
+    return "\n\n".join(["**Columns & Types**", dtypes_to_markdown_table(dtypes_map)])
+
+def _no_progress(fraction: float, markdown: Optional[str] = None) -> None:
+    pass
+
+def _analysis_result(
+    n_rows: int, n_cols: int, notes: List[str], head, dtypes_map: dict,
+    stats, n_numeric: int, stats_title: str, tool_outputs: dict,
+) -> dict:
+    """
+    Kết quả analyze_csv: markdown (hiển thị / kết quả job) + payload gọn cho model (xem _tool_message).
+    `stats`: stats_frame() hoặc None khi không có cột số.
+    """
+    parts = [_overview_markdown(n_rows, n_cols, notes), _preview_markdown(head), _dtypes_markdown(dtypes_map)]
+    payload = {"rows": n_rows, "columns": n_cols, "notes": notes or None,
+               "preview": _table_payload(head), "dtypes": dtype_groups(dtypes_map)}
+    if stats is not None and not stats.empty:
+        parts += [f"\n### {stats_title}", df_to_markdown_table(stats, max_rows=len(stats))]
+        payload["stats"] = _table_payload(stats)
+        payload["numeric_columns"] = n_numeric
+    return {
+        "markdown": "\n\n".join(parts),
+        "payload": {k: v for k, v in payload.items() if v is not None},
+        "tool_outputs": tool_outputs,
+    }
+
+def _analyze_csv_streaming(path: str, approximate: bool, progress: Optional[Callable] = None) -> dict:
+    # File lớn: thống kê theo chunk, không load cả DataFrame
+    report = progress or _no_progress
+    with span("csv_stream_stats", "approximate" if approximate else "exact"):
+        st = stream_csv_stats(
+            Path(path), approximate=approximate,
+            progress=lambda fraction: report(0.95 * fraction),
+            on_head=lambda head: report(0.0, _preview_markdown(head)),
+        )
+    n_rows, n_cols = st["rows"], len(st["columns"])
+    notes = []
+    if st["approximate"]:
+        notes.append(f"> **Approximate**: stats below are computed on a uniform sample of {st['sample_rows']} rows.")
+    elif st["quantiles_approximate"]:
+        notes.append("> Percentiles (25%/50%/75%) are approximate (streaming quantile sketch).")
+
+    report(0.95, _overview_markdown(n_rows, n_cols, notes))
+    report(0.95, _dtypes_markdown(st["dtypes"]))
+
+    tool_outputs = {"csv_rows": n_rows, "csv_cols": n_cols}
+    if st["approximate"]:
+        tool_outputs["approximate"] = True
+    stats = stats_frame(st["numeric"]) if st["numeric"] else None
+    title = "Basic Stats (approximate)" if st["approximate"] else "Basic Stats"
+    return _analysis_result(n_rows, n_cols, notes, st["head"], st["dtypes"], stats, len(st["numeric"]), title, tool_outputs)
+
+def _analyze_csv_sync(path: str, approximate: bool = False, progress: Optional[Callable] = None) -> dict:
+    """
+    Chạy trên worker pool (xem services/executor.py).
+    `progress(fraction, markdown)` (JobProgress.update của job) nhận từng phần overview/preview/dtypes khi tính xong.
+    """
+    if approximate or Path(path).stat().st_size > CSV_STREAM_THRESHOLD_BYTES:
+        return _analyze_csv_streaming(path, approximate, progress)
+
+    report = progress or _no_progress
+    df = load_csv(Path(path))
+    dtypes_map = {c: str(t) for c, t in df.dtypes.items()}
+    report(0.5, _overview_markdown(int(df.shape[0]), int(df.shape[1]), []))
+    report(0.5, _preview_markdown(df.head(5)))
+    report(0.5, _dtypes_markdown(dtypes_map))
+
+    # Basic stats nếu có cột số; chỉ describe() những cột còn vừa bảng stats
+    num_cols = df.select_dtypes("number").columns.tolist()
+    stats = stats_frame(df[num_cols[:stats_table_max_rows()]].describe()) if num_cols else None
+
+    n_rows, n_cols = int(df.shape[0]), int(df.shape[1])
+    tool_outputs = {"csv_rows": n_rows, "csv_cols": n_cols}
+    return _analysis_result(n_rows, n_cols, [], df.head(5), dtypes_map, stats, len(num_cols), "Basic Stats", tool_outputs)
+
+async def _memoized_tool(
+    name: str, path: Path, args: dict, compute: Callable[[], Awaitable], valid: Optional[Callable] = None
+):
+    """
+    Trả kết quả đã lưu của tool `name` trên cùng nội dung file + cùng args; chưa có thì chạy
+    compute() rồi lưu. `valid(result)` loại các kết quả cũ không còn dùng được (vd. ảnh đã bị xoá).
+    Các lời gọi đồng thời cùng key dùng chung một lần chạy (kể cả khi tắt TOOL_CACHE_ENABLED).
+    """
+    digest = await asyncio.to_thread(dataset_hash, path)
+    key = _tool_cache_key(name, digest, args)
+    return await inflight.do(key, lambda: _cached_compute(key, compute, valid))
+
+async def _cached_compute(key: str, compute: Callable[[], Awaitable], valid: Optional[Callable]):
+    if not TOOL_CACHE_ENABLED:
+        return await compute()
+    hit = await asyncio.to_thread(tool_cache.get, key)
+    if hit is not None and (valid is None or valid(hit)):
+        return hit
+    result = await compute()
+    await asyncio.to_thread(tool_cache.set, key, result)
+    return result
+
+async def tool_analyze_csv(
+    db: AsyncSession,
+    session_id: str,
+    csv_path: str,
+    question: str,
+    approximate: bool = False,
+    overview_only: bool = False,
+) -> dict:
     # Resolve đường dẫn thật
-    rp = _resolve_csv_path(db, session_id, csv_path)
+    rp = await _resolve_csv_path(db, session_id, csv_path)
     if not rp or not rp.is_file():
         return {"error": f"CSV file not found for path: {csv_path}"}
 
-    df = load_csv(rp)
-    parts = [f"### CSV Overview\n- **Rows**: {df.shape[0]}  \n- **Columns**: {df.shape[1]}"]
+    if overview_only:
+        # trả lời "bao nhiêu dòng / cột gì" thẳng từ profile lúc upload, không cần pandas
+        # (file có ngoặc kép: số dòng đếm theo newline chưa chắc đúng -> phân tích đầy đủ bên dưới)
+        profile = await _csv_profile(db, session_id, str(rp))
+        if profile and "rows" in profile and not profile.get("rows_estimated"):
+            return {
+                "markdown": "\n\n".join([
+                    f"### CSV Overview\n- **Rows**: {profile['rows']}  \n- **Columns**: {len(profile['columns'])}"
+                    f"  \n- **Size**: {profile['bytes']} bytes",
+                    "**Columns & Types**",
+                    dtypes_to_markdown_table(profile["dtypes"]),
+                ]),
+                "payload": _profile_summary(profile),
+                "tool_outputs": {"csv_rows": int(profile["rows"]), "csv_cols": len(profile["columns"])},
+            }
 
-    dtypes_map = {c: str(t) for c, t in df.dtypes.items()}
-    parts += ["**Preview (first 5 rows)**", df_to_markdown_table(df.head(5)), "**Columns & Types**", dtypes_to_markdown_table(dtypes_map)]
+    # `question` không ảnh hưởng kết quả nên không nằm trong key
+    memo_args = {"approximate": bool(approximate)}
+    job = await _start_job_if_large(session_id, "analyze_csv", rp, memo_args, {"csv_path": str(rp), **memo_args})
+    if job:
+        return job
+    return await _memoized_tool(
+        "analyze_csv", rp, memo_args,
+        lambda: run_tool("analyze_csv", _analyze_csv_sync, str(rp), bool(approximate)),
+    )
 
-    # Basic stats nếu có cột số
-    num_cols = df.select_dtypes("number").columns.tolist()
-    if num_cols:
-        desc = df[num_cols].describe().round(4)
-        header = "| Stat | " + " | ".join(num_cols) + " |"
-        sep = "|" + ("---|" * (len(num_cols) + 1))
-        rows = ["| " + " | ".join([idx] + [str(v) for v in row.tolist()]) + " |" for idx, row in desc.iterrows()]
-        parts += ["\n### Basic Stats", "\n".join([header, sep, *rows])]
 
+def _plot_histograms_sync(
+    path: str, columns: List[str], out_dir: str, bins: int, progress: Optional[Callable] = None
+) -> List[dict]:
+    # Chạy trên worker pool (xem services/executor.py)
+    return [
+        {**r, "path": str(r["path"])} if "path" in r else r
+        for r in plot_histograms(Path(path), columns, Path(out_dir), bins=bins, progress=progress)
+    ]
+
+def _histogram_attachment(out_path: Path) -> dict:
     return {
-        "markdown": "\n\n".join(parts),
-        "tool_outputs": {"csv_rows": int(df.shape[0]), "csv_cols": int(df.shape[1])},
+        "kind": "plot",
+        "path": str(out_path),
+        "mime": "image/png",
+        "original_name": out_path.name,
+        "public_url": _public_url(out_path),
     }
 
+async def _render_histograms(
+    rp: Path, columns: List[str], bins: int, timeout: Optional[float] = None, progress: Optional[Callable] = None
+) -> List[dict]:
+    out_dir = UPLOADS / "images" / "plots"
+    return await _memoized_tool(
+        "plot_histograms", rp, {"columns": list(columns), "bins": int(bins)},
+        lambda: run_tool(
+            "plot_histograms", _plot_histograms_sync, str(rp), list(columns), str(out_dir), int(bins), progress,
+            timeout=timeout,
+        ),
+        valid=lambda rs: all(touch_plot(Path(r["path"])) for r in rs if "path" in r),
+    )
 
-async def tool_plot_histogram(db: OrmSession, session_id: str, csv_path: str, column: str) -> dict:
-    rp = _resolve_csv_path(db, session_id, csv_path)
+async def tool_plot_histograms(
+    db: AsyncSession, session_id: str, csv_path: str, columns: List[str], bins: int = DEFAULT_BINS
+) -> dict:
+    rp = await _resolve_csv_path(db, session_id, csv_path)
     if not rp or not rp.is_file():
         return {"error": f"CSV file not found for path: {csv_path}"}
+    if not columns:
+        return {"error": "No columns given to plot."}
 
-    df = load_csv(rp)
-    out_dir = UPLOADS / "images" / "plots"
-    out_path = histogram_plot(df, column, out_dir, session_id)
-    public = _public_url(out_path)
+    memo_args = {"columns": list(columns), "bins": int(bins)}
+    job = await _start_job_if_large(session_id, "plot_histograms", rp, memo_args, {"csv_path": str(rp), **memo_args})
+    if job:
+        return job
+    return _histograms_result(await _render_histograms(rp, columns, bins))
+
+def _histograms_result(rendered: List[dict]) -> dict:
+    md_parts: List[str] = []
+    attachments: List[dict] = []
+    errors: List[str] = []
+    for r in rendered:
+        if "error" in r:
+            errors.append(r["error"])
+            continue
+        att = _histogram_attachment(Path(r["path"]))
+        attachments.append(att)
+        md_parts.append(f"### Histogram of `{r['column']}`\n\n![Histogram]({att['public_url']})\n\n_File_: `{att['original_name']}`")
 
-    md = f"### Histogram of `{column}`\n\n![Histogram]({public})\n\n_File_: `{out_path.name}`"
+    if not attachments:
+        return {"error": " ".join(errors)}
+    if errors:
+        md_parts.append("\n".join(f"- {e}" for e in errors))
     return {
-        "markdown": md,
-        "tool_outputs": {"histogram_image": str(out_path)},
-        "new_attachments": [
-            {
-                "kind": "plot",
-                "path": str(out_path),
-                "mime": "image/png",
-                "original_name": out_path.name,
-                "public_url": public,
-            }
-        ],
+        "markdown": "\n\n".join(md_parts),
+        "tool_outputs": {
+            "histogram_image": attachments[-1]["path"],
+            "histogram_images": [a["path"] for a in attachments],
+        },
+        "new_attachments": attachments,
+    }
+
+async def tool_plot_histogram(
+    db: AsyncSession, session_id: str, csv_path: str, column: str, bins: int = DEFAULT_BINS
+) -> dict:
+    result = await tool_plot_histograms(db, session_id, csv_path, [column], bins)
+    if "tool_outputs" in result:
+        result["tool_outputs"].pop("histogram_images", None)
+    return result
+
+
+# ---------- Background jobs (services/jobs.py) ----------
+async def _start_job_if_large(
+    session_id: str, kind: str, path: Path, memo_args: dict, job_args: dict
+) -> Optional[dict]:
+    """
+    File >= JOB_THRESHOLD_BYTES và chưa có kết quả trong tool_cache -> tạo job nền thay vì chạy trong
+    request. Returns tool result "job started" (None = chạy ngay như bình thường).
+    """
+    if JOB_THRESHOLD_BYTES < 0 or not job_runner.running:
+        return None
+    size = path.stat().st_size
+    if size < JOB_THRESHOLD_BYTES:
+        return None
+    if TOOL_CACHE_ENABLED:
+        digest = await asyncio.to_thread(dataset_hash, path)
+        if await asyncio.to_thread(tool_cache.has, _tool_cache_key(kind, digest, memo_args)):
+            return None
+    job = await job_runner.enqueue(session_id, kind, job_args)
+    return {
+        "markdown": (
+            f"Started background job `{job['id']}` ({kind} on a {size / 1e6:.0f} MB file). "
+            "The result will be posted to this chat when it finishes."
+        ),
+        "job": {"id": job["id"], "kind": kind, "status": job["status"], "status_url": f"/jobs/{job['id']}"},
     }
 
+def _worker_progress(progress: JobProgress) -> Optional[Callable]:
+    # tool gọi progress ngay trong worker thread; với TOOL_EXECUTOR=process không gửi callback qua process
+    # được -> job chỉ báo tiến độ lúc xong
+    return None if TOOL_EXECUTOR == "process" else progress.update
+
+@job_handler("analyze_csv")
+async def _analyze_csv_job(args: dict, progress: JobProgress) -> dict:
+    path = Path(args["csv_path"])
+    if not path.is_file():
+        return {"error": f"CSV file not found for path: {path}"}
+    approximate = bool(args.get("approximate"))
+    report = _worker_progress(progress)
+    return await _memoized_tool(
+        "analyze_csv", path, {"approximate": approximate},
+        lambda: run_tool("analyze_csv", _analyze_csv_sync, str(path), approximate, report, timeout=JOB_TIMEOUT),
+    )
+
+@job_handler("plot_histograms")
+async def _plot_histograms_job(args: dict, progress: JobProgress) -> dict:
+    path = Path(args["csv_path"])
+    if not path.is_file():
+        return {"error": f"CSV file not found for path: {path}"}
+    columns, bins = list(args["columns"]), int(args["bins"])
+    report = _worker_progress(progress)
+
+    def on_column(fraction: float, result: dict) -> None:
+        # CSV đọc một lần cho mọi cột (plot_histograms); mỗi cột xong -> progress + markdown từng phần
+        report(fraction, _histograms_result([result]).get("markdown"))
+
+    rendered = await _render_histograms(path, columns, bins, timeout=JOB_TIMEOUT, progress=on_column if report else None)
+    return _histograms_result(rendered)
+
 
 async def tool_answer_about_image(image_path: str, question: str) -> dict:
     ans = await call_openai_vision(
@@ -190,6 +645,134 @@ async def tool_answer_about_image(image_path: str, question: str) -> dict:
     )
     return {"markdown": ans}
 
+# ---------- Conversation context ----------
+_HISTORY_PAGE = 50
+_summary_locks: Dict[str, List] = {}  # session_id -> [lock, số caller đang giữ / chờ]
+
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def _summary_lock(session_id: str):
+    # một summary mỗi session tại một thời điểm; entry bị xoá khi không còn ai dùng -> dict không phình theo số session
+    entry = _summary_locks.get(session_id)
+    if entry is None:
+        entry = _summary_locks[session_id] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0 and _summary_locks.get(session_id) is entry:
+            del _summary_locks[session_id]
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """
+    Ước lượng token cục bộ (~4 ký tự / token + overhead mỗi message), đủ để chia budget.
+    """
+    return len(text or "") // 4 + 4
+
+def _summary_message(summary: str) -> dict:
+    return {"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}
+
+async def _iter_recent_messages(db: AsyncSession, session_id: str, after_id: int, before_id: Optional[int]):
+    # Đọc từ mới -> cũ theo trang, chỉ các cột cần thiết; dừng sớm khi caller không cần thêm
+    upper = before_id
+    while True:
+        q = select(Message.id, Message.role, Message.content).where(
+            Message.session_id == session_id, Message.id > after_id
+        )
+        if upper is not None:
+            q = q.where(Message.id < upper)
+        page = (await db.execute(q.order_by(Message.id.desc()).limit(_HISTORY_PAGE))).all()
+        if not page:
+            return
+        for row in page:
+            yield row
+        upper = page[-1].id
+
+async def load_context(
+    db: AsyncSession, session_id: str, *, before_id: Optional[int] = None, budget: Optional[int] = None
+) -> List[Dict]:
+    """
+    History gửi cho model, gói trong `budget` token: rolling summary (nếu có) + các message mới nhất
+    vừa đủ budget. Chỉ đọc từ DB các message sau summary_upto_id và dừng khi hết budget.
+    `before_id`: bỏ qua message từ id này trở đi (user message của lượt hiện tại).
+    """
+    budget = CONTEXT_TOKEN_BUDGET if budget is None else budget
+    sess = await db.get(SessionChat, session_id)
+    head: List[Dict] = []
+    if sess and sess.summary:
+        head.append(_summary_message(sess.summary))
+        budget -= estimate_tokens(head[0]["content"])
+
+    recent: List[Dict] = []
+    async for m in _iter_recent_messages(db, session_id, (sess.summary_upto_id or 0) if sess else 0, before_id):
+        cost = estimate_tokens(m.content)
+        if cost > budget:
+            break
+        budget -= cost
+        recent.append({"role": m.role, "content": m.content})
+    return head + recent[::-1]
+
+async def update_rolling_summary(session_factory, session_id: str, budget: Optional[int] = None) -> None:
+    """
+    Chạy sau khi trả response (background). Nếu phần chưa tóm tắt vượt budget, gộp các message cũ nhất
+    vào summary hiện có (incremental, chỉ gửi summary cũ + message mới bị đẩy ra) cho tới khi phần
+    còn lại chỉ chiếm ~1/2 budget, để không phải tóm tắt lại ở mỗi lượt.
+    """
+    budget = CONTEXT_TOKEN_BUDGET if budget is None else budget
+    async with _summary_lock(session_id):
+        db = session_factory()
+        try:
+            sess = await db.get(SessionChat, session_id)
+            if not sess:
+                return
+            summary_cost = estimate_tokens(sess.summary) if sess.summary else 0
+            pending = [m async for m in _iter_recent_messages(db, session_id, sess.summary_upto_id or 0, None)][::-1]
+            total = summary_cost + sum(estimate_tokens(m.content) for m in pending)
+            if total <= budget:
+                return
+
+            keep_budget = budget // 2
+            kept = 0
+            cut = len(pending)
+            while cut > 0 and kept + estimate_tokens(pending[cut - 1].content) <= keep_budget:
+                cut -= 1
+                kept += estimate_tokens(pending[cut].content)
+            folded = pending[:cut]
+            if not folded:
+                return
+
+            transcript = "\n\n".join(f"{m.role.upper()}: {m.content}" for m in folded)
+            data = await _openai_post({
+                "model": SUMMARY_MODEL,
+                "messages": [
+                    {
+                        "role": "system",
+                        "content": (
+                            "You maintain a running summary of a chat between a user and an AI assistant that "
+                            "works with CSV files and images. Update the summary with the new messages. Keep facts, "
+                            "file names, column names, numbers and open questions; drop pleasantries. "
+                            "Reply with the updated summary only, at most 250 words."
+                        ),
+                    },
+                    {
+                        "role": "user",
+                        "content": f"Current summary:\n{sess.summary or '(empty)'}\n\nNew messages:\n{transcript}",
+                    },
+                ],
+                "temperature": 0,
+            }, kind="summary", priority=PRIORITY_BACKGROUND)
+            sess.summary = data["choices"][0]["message"]["content"]
+            sess.summary_upto_id = folded[-1].id
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            logger.exception("Rolling summary update failed for session %s", session_id)
+        finally:
+            await db.close()
+
 # ---------- Orchestrator with tools ----------
 TOOLS_SPEC = [
     {
@@ -214,6 +797,14 @@ TOOLS_SPEC = [
                 "properties": {
                     "csv_path": {"type": "string"},
                     "question": {"type": "string"},
+                    "approximate": {
+                        "type": "boolean",
+                        "description": "Fast sampled stats for very large files; output is labelled approximate.",
+                    },
+                    "overview_only": {
+                        "type": "boolean",
+                        "description": "Only row count, columns and types (from upload metadata, no parsing).",
+                    },
                 },
                 "required": ["csv_path", "question"],
             },
@@ -229,11 +820,28 @@ TOOLS_SPEC = [
                 "properties": {
                     "csv_path": {"type": "string"},
                     "column": {"type": "string"},
+                    "bins": {"type": "integer", "minimum": 1, "maximum": 200},
                 },
                 "required": ["csv_path", "column"],
             },
         },
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "plot_histograms",
+            "description": "Create histogram images for several numeric columns in one pass over the data; returns markdown with the public URLs.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "csv_path": {"type": "string"},
+                    "columns": {"type": "array", "items": {"type": "string"}},
+                    "bins": {"type": "integer", "minimum": 1, "maximum": 200},
+                },
+                "required": ["csv_path", "columns"],
+            },
+        },
+    },
     {
         "type": "function",
         "function": {
@@ -258,102 +866,292 @@ SYSTEM_PROMPT = {
         "- If the user asks about CSV (summary, stats, missing, histogram), call tools; "
         "first call get_context_assets if csv_path is unknown.\n"
         "- If the user asks about an image, call get_context_assets and then answer_about_image.\n"
+        "- Tools on very large files may return a started background job instead of a result; tell the user "
+        "the result will appear in the chat when the job finishes, and do not call the same tool again.\n"
         "- Prefer returning clean Markdown with lists/tables when helpful.\n"
         "- If no file exists yet, ask the user to upload a CSV/image briefly."
     ),
 }
 
+def _build_messages(
+    history: List[Dict], message: str, image_path: Optional[str], csv_path: Optional[str]
+) -> List[Dict]:
+    messages = [SYSTEM_PROMPT] + history + [{"role": "user", "content": message}]
+
+    # seed context if caller already knows fresh paths
+    tool_context_note = []
+    if csv_path:
+        tool_context_note.append(f"(server-note: csv_path ready at {csv_path})")
+    if image_path:
+        tool_context_note.append(f"(server-note: image_path ready at {image_path})")
+    if tool_context_note:
+        messages.append({"role": "system", "content": " ".join(tool_context_note)})
+    return messages
+
+async def _run_tool_call(db: AsyncSession, session_id: str, tc: dict, state: dict) -> Tuple[str, dict]:
+    """
+    Thực thi một tool call. `state` giữ csv_path/image_path đã resolve trong lượt chat này.
+    Returns (tool_name, result)
+    """
+    name = tc["function"]["name"]
+    try:
+        with span("tool", name):
+            result = await _dispatch_tool(db, session_id, name, tc, state)
+    except (ToolBusyError, ToolTimeoutError) as e:
+        # báo lỗi rõ ràng cho model thay vì làm hỏng cả lượt chat
+        tool_calls_counter.inc(tool=name, outcome="busy" if isinstance(e, ToolBusyError) else "timeout")
+        return name, {"error": str(e)}
+    tool_calls_counter.inc(tool=name, outcome="error" if "error" in result else "ok")
+    return name, result
+
+async def _dispatch_tool(db: AsyncSession, session_id: str, name: str, tc: dict, state: dict) -> dict:
+    args = json.loads(tc["function"]["arguments"] or "{}")
+    csv_path, image_path = state.get("csv_path"), state.get("image_path")
+
+    if name == "get_context_assets":
+        prefer = args.get("prefer")
+        if not csv_path or prefer == "csv":
+            if not csv_path:
+                ctx = await tool_get_context_assets(db, session_id, prefer="csv")
+                csv_path = ctx.get("csv_path") or csv_path
+        if not image_path or prefer == "image":
+            if not image_path:
+                ctx = await tool_get_context_assets(db, session_id, prefer="image")
+                image_path = ctx.get("image_path") or image_path
+        state["csv_path"], state["image_path"] = csv_path, image_path
+        result = {"csv_path": csv_path, "image_path": image_path}
+        profile = await _csv_profile(db, session_id, csv_path)
+        if profile:
+            result["csv_profile"] = _profile_summary(profile)
+
+    elif name == "analyze_csv":
+        cp = args.get("csv_path") or csv_path
+        if not cp:
+            result = {"error": "No CSV available in this session. Ask user to upload one."}
+        else:
+            result = await tool_analyze_csv(
+                db, session_id, cp, args.get("question", ""),
+                approximate=bool(args.get("approximate")),
+                overview_only=bool(args.get("overview_only")),
+            )
+
+    elif name == "plot_histogram":
+        cp = args.get("csv_path") or csv_path
+        if not cp:
+            result = {"error": "No CSV available in this session to plot."}
+        else:
+            result = await tool_plot_histogram(db, session_id, cp, args["column"], args.get("bins") or DEFAULT_BINS)
+
+    elif name == "plot_histograms":
+        cp = args.get("csv_path") or csv_path
+        if not cp:
+            result = {"error": "No CSV available in this session to plot."}
+        else:
+            result = await tool_plot_histograms(db, session_id, cp, args.get("columns") or [], args.get("bins") or DEFAULT_BINS)
+
+    elif name == "answer_about_image":
+        ip = args.get("image_path") or image_path
+        if not ip:
+            result = {"error": "No image available in this session. Ask user to upload one."}
+        else:
+            result = await tool_answer_about_image(ip, args.get("question", ""))
+
+    else:
+        result = {"error": f"Unknown tool {name}"}
+
+    return result
+
+async def _run_tool_round(
+    db: AsyncSession, session_id: str, tool_calls: List[dict], state: dict
+) -> AsyncIterator[Tuple[int, str, dict]]:
+    """
+    Chạy các tool call của một round, yield (index, tool_name, result) theo thứ tự hoàn thành.
+    get_context_assets chạy trước, tuần tự, vì nó resolve csv_path/image_path vào `state`;
+    các tool còn lại độc lập nên chạy đồng thời (tối đa TOOL_CONCURRENCY) trên cùng snapshot của state.
+    """
+    independent: List[int] = []
+    for i, tc in enumerate(tool_calls):
+        if tc["function"]["name"] == "get_context_assets":
+            name, result = await _run_tool_call(db, session_id, tc, state)
+            yield i, name, result
+        else:
+            independent.append(i)
+
+    snapshot = dict(state)
+    sem = asyncio.Semaphore(TOOL_CONCURRENCY)
+
+    async def run(i: int) -> Tuple[int, str, dict]:
+        async with sem:
+            name, result = await _run_tool_call(db, session_id, tool_calls[i], dict(snapshot))
+            return i, name, result
+
+    tasks = [asyncio.ensure_future(run(i)) for i in independent]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            yield await fut
+    finally:
+        # lỗi ở một tool (hoặc client ngắt stream) -> huỷ các tool còn lại
+        for t in tasks:
+            t.cancel()
+
+def _collect_tool_result(name: str, result: dict, tool_outputs_acc: Dict, new_asst_attachments: List[dict]) -> None:
+    # collect outputs/attachments
+    if name in ("plot_histogram", "plot_histograms"):
+        tool_outputs_acc.update(result.get("tool_outputs") or {})
+        new_asst_attachments.extend(result.get("new_attachments") or [])
+    if result.get("job"):
+        # job nền: frontend poll GET /jobs/{id}, kết quả đến sau thành một assistant message mới
+        tool_outputs_acc.setdefault("jobs", []).append(result["job"])
+
+def _tool_message(tc: dict, name: str, result: dict) -> dict:
+    if "payload" in result:
+        # model nhận bảng gọn (csv/json) thay cho markdown; markdown chỉ để hiển thị / kết quả job
+        drop = "payload" if TOOL_PAYLOAD_FORMAT == "markdown" else "markdown"
+        result = {k: v for k, v in result.items() if k != drop}
+    return {
+        "role": "tool",
+        "tool_call_id": tc["id"],
+        "name": name,
+        "content": json.dumps(result, ensure_ascii=False, separators=(",", ":"))
+    }
+
+MAX_TOOL_ROUNDS = 4
+FALLBACK_ANSWER = "I couldn't complete the request with tools. Could you upload a CSV or image if needed?"
+
 async def chat_orchestrator(
     *,
-    db: OrmSession,
+    db: AsyncSession,
     session_id: str,
     message: str,
     history: List[Dict],
     # optional “fresh” paths from current request:
     image_path: Optional[str],
     csv_path: Optional[str],
+    cache: bool = True,
 ) -> Tuple[str, Dict, List[Dict], List[dict]]:
     """
     Returns (assistant_markdown, tool_outputs, updated_history, new_attachments_for_assistant)
+    `cache=False`: không đọc LLM response cache cho lượt này.
     """
-    messages = [SYSTEM_PROMPT] + history + [{"role": "user", "content": message}]
+    messages = _build_messages(history, message, image_path, csv_path)
+    state = {"csv_path": csv_path, "image_path": image_path}
     tool_outputs_acc: Dict = {}
     new_asst_attachments: List[dict] = []
 
-    # seed context if caller already knows fresh paths
-    tool_context_note = []
-    if csv_path:
-        tool_context_note.append(f"(server-note: csv_path ready at {csv_path})")
-    if image_path:
-        tool_context_note.append(f"(server-note: image_path ready at {image_path})")
-    if tool_context_note:
-        messages.append({"role": "system", "content": " ".join(tool_context_note)})
-
     # tool-call loop
-    for _ in range(4):
-        data = await call_openai(messages, tools=TOOLS_SPEC)
-        msg = data["choices"][0]["message"]
-
-        if "tool_calls" not in msg:
-            # final text
-            ans = msg.get("content", "")
-            updated = history + [{"role": "user", "content": message}, {"role": "assistant", "content": ans}]
-            return ans, tool_outputs_acc, updated, new_asst_attachments
-
-        messages.append(msg)
-        
-        # execute tool calls
-        for tc in msg["tool_calls"]:
-            name = tc["function"]["name"]
-            args = json.loads(tc["function"]["arguments"] or "{}")
-
-            if name == "get_context_assets":
-                prefer = args.get("prefer")
-                if not csv_path or prefer == "csv":
-                    if not csv_path:
-                        ctx = await tool_get_context_assets(db, session_id, prefer="csv")
-                        csv_path = ctx.get("csv_path") or csv_path
-                if not image_path or prefer == "image":
-                    if not image_path:
-                        ctx = await tool_get_context_assets(db, session_id, prefer="image")
-                        image_path = ctx.get("image_path") or image_path
-                result = {"csv_path": csv_path, "image_path": image_path}
-
-            elif name == "analyze_csv":
-                cp = args.get("csv_path") or csv_path
-                if not cp:
-                    result = {"error": "No CSV available in this session. Ask user to upload one."}
-                else:
-                    result = await tool_analyze_csv(db, session_id, cp, args.get("question", ""))
-
-            elif name == "plot_histogram":
-                cp = args.get("csv_path") or csv_path
-                if not cp:
-                    result = {"error": "No CSV available in this session to plot."}
-                else:
-                    result = await tool_plot_histogram(db, session_id, cp, args["column"])
-                    # collect outputs/attachments
-                    tool_outputs_acc.update(result.get("tool_outputs") or {})
-                    new_asst_attachments.extend(result.get("new_attachments") or [])
-
-            elif name == "answer_about_image":
-                ip = args.get("image_path") or image_path
-                if not ip:
-                    result = {"error": "No image available in this session. Ask user to upload one."}
-                else:
-                    result = await tool_answer_about_image(ip, args.get("question", ""))
-
-            else:
-                result = {"error": f"Unknown tool {name}"}
-
-            messages.append({
-                "role": "tool",
-                "tool_call_id": tc["id"],
+    for _ in range(MAX_TOOL_ROUNDS):
+        with span("orchestrator_round"):
+            data = await call_openai(messages, tools=TOOLS_SPEC, cache=cache)
+            msg = data["choices"][0]["message"]
+
+            if "tool_calls" not in msg:
+                # final text
+                ans = msg.get("content", "")
+                updated = history + [{"role": "user", "content": message}, {"role": "assistant", "content": ans}]
+                return ans, tool_outputs_acc, updated, new_asst_attachments
+
+            messages.append(msg)
+
+            # execute tool calls (đồng thời), rồi gộp kết quả theo đúng thứ tự tool_call_id
+            results: Dict[int, Tuple[str, dict]] = {}
+            async for i, name, result in _run_tool_round(db, session_id, msg["tool_calls"], state):
+                results[i] = (name, result)
+            for i, tc in enumerate(msg["tool_calls"]):
+                name, result = results[i]
+                _collect_tool_result(name, result, tool_outputs_acc, new_asst_attachments)
+                messages.append(_tool_message(tc, name, result))
+
+    # safety net
+    updated = history + [{"role": "user", "content": message}, {"role": "assistant", "content": FALLBACK_ANSWER}]
+    return FALLBACK_ANSWER, tool_outputs_acc, updated, new_asst_attachments
+
+async def chat_orchestrator_stream(
+    *,
+    db: AsyncSession,
+    session_id: str,
+    message: str,
+    history: List[Dict],
+    image_path: Optional[str],
+    csv_path: Optional[str],
+    cache: bool = True,
+) -> AsyncIterator[dict]:
+    """
+    Bản streaming của chat_orchestrator. Yield các event:
+      {"type": "delta", "content": str}
+      {"type": "tool_start", "id": str, "name": str}
+      {"type": "tool_end", "id": str, "name": str, "error": str | None, "attachments": [...]}
+      {"type": "done", "content": str, "tool_outputs": dict, "attachments": [...]}  (luôn là event cuối)
+    """
+    messages = _build_messages(history, message, image_path, csv_path)
+    state = {"csv_path": csv_path, "image_path": image_path}
+    tool_outputs_acc: Dict = {}
+    new_asst_attachments: List[dict] = []
+
+    for _ in range(MAX_TOOL_ROUNDS):
+        # đo bằng tay: `with span(...)` bao quanh yield sẽ tính cả thời gian client đọc stream
+        round_started = time.perf_counter()
+        content_parts: List[str] = []
+        pending_calls: Dict[int, dict] = {}
+
+        async for chunk in call_openai_stream(messages, tools=TOOLS_SPEC, cache=cache):
+            choices = chunk.get("choices") or []
+            if not choices:
+                continue
+            delta = choices[0].get("delta") or {}
+            if delta.get("content"):
+                content_parts.append(delta["content"])
+                yield {"type": "delta", "content": delta["content"]}
+            # tool_calls đến theo từng mảnh, ghép lại theo index
+            for part in delta.get("tool_calls") or []:
+                slot = pending_calls.setdefault(
+                    part.get("index", 0),
+                    {"id": None, "type": "function", "function": {"name": "", "arguments": ""}},
+                )
+                if part.get("id"):
+                    slot["id"] = part["id"]
+                fn = part.get("function") or {}
+                slot["function"]["name"] += fn.get("name") or ""
+                slot["function"]["arguments"] += fn.get("arguments") or ""
+
+        content = "".join(content_parts)
+        if not pending_calls:
+            record_span("orchestrator_round", time.perf_counter() - round_started, "stream")
+            yield {
+                "type": "done",
+                "content": content,
+                "tool_outputs": tool_outputs_acc,
+                "attachments": new_asst_attachments,
+            }
+            return
+
+        tool_calls = [pending_calls[i] for i in sorted(pending_calls)]
+        messages.append({"role": "assistant", "content": content or None, "tool_calls": tool_calls})
+
+        for tc in tool_calls:
+            yield {"type": "tool_start", "id": tc["id"], "name": tc["function"]["name"]}
+
+        # tool_end phát theo thứ tự hoàn thành; messages/attachments gộp theo thứ tự tool_call_id
+        results: Dict[int, Tuple[str, dict]] = {}
+        async for i, name, result in _run_tool_round(db, session_id, tool_calls, state):
+            results[i] = (name, result)
+            yield {
+                "type": "tool_end",
+                "id": tool_calls[i]["id"],
                 "name": name,
-                "content": json.dumps(result, ensure_ascii=False)
-            })
+                "error": result.get("error"),
+                "attachments": result.get("new_attachments") or [],
+            }
+        for i, tc in enumerate(tool_calls):
+            name, result = results[i]
+            _collect_tool_result(name, result, tool_outputs_acc, new_asst_attachments)
+            messages.append(_tool_message(tc, name, result))
+        record_span("orchestrator_round", time.perf_counter() - round_started, "stream")
 
     # safety net
-    fallback = "I couldn't complete the request with tools. Could you upload a CSV or image if needed?"
-    updated = history + [{"role": "user", "content": message}, {"role": "assistant", "content": fallback}]
-    return fallback, tool_outputs_acc, updated, new_asst_attachments
+    yield {"type": "delta", "content": FALLBACK_ANSWER}
+    yield {
+        "type": "done",
+        "content": FALLBACK_ANSWER,
+        "tool_outputs": tool_outputs_acc,
+        "attachments": new_asst_attachments,
+    }
@@ -0,0 +1,194 @@
+# services/metrics.py
+from __future__ import annotations
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+# Metrics tự viết theo text format của Prometheus (không thêm dependency).
+# Span = đoạn code được đo thời gian: ghi vào histogram chat_span_seconds{span=...} và,
+# nếu request bật Server-Timing, cộng dồn vào header của request đó.
+METRICS_SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", "1.0"))  # tỉ lệ request/việc nền được đo span
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0").lower() in ("1", "true", "yes")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(str(labels.get(k, "")) for k in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_labels(self.labels, key)} {_num(value)}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self._series: Dict[tuple, list] = {}  # key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(k, "")) for k in self.labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._series.items()]
+        for key, s in items:
+            cum = 0
+            for bound, n in zip(self.buckets + (float("inf"),), s):
+                cum += n
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                yield f"{self.name}_bucket{_labels(self.labels + ('le',), key + (le,))} {cum}"
+            yield f"{self.name}_sum{_labels(self.labels, key)} {s[-2]:.6f}"
+            yield f"{self.name}_count{_labels(self.labels, key)} {s[-1]}"
+
+
+def _num(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+# ---------- Registry ----------
+span_seconds = Histogram("chat_span_seconds", "Duration of instrumented hot-path spans", ("span", "detail"))
+http_request_seconds = Histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route", "status"))
+openai_requests = Counter("openai_requests_total", "Calls to the OpenAI chat completions API", ("model", "kind", "status"))
+openai_tokens = Counter("openai_tokens_total", "Tokens reported by OpenAI usage", ("model", "type"))
+tool_calls = Counter("tool_calls_total", "Tool executions by outcome", ("tool", "outcome"))
+openai_retries = Counter("openai_retries_total", "OpenAI calls retried by the scheduler", ("reason",))
+
+_METRICS = [span_seconds, http_request_seconds, openai_requests, openai_tokens, tool_calls, openai_retries]
+_gauges: Dict[str, Callable[[], dict]] = {}
+
+
+def register_gauges(prefix: str, collect: Callable[[], dict]) -> None:
+    """
+    Gauge đọc lúc scrape từ một hàm trả dict số, ví dụ llm_cache.stats -> llm_cache_hits, llm_cache_entries...
+    """
+    _gauges[prefix] = collect
+
+
+def render_metrics() -> str:
+    lines = []
+    for m in _METRICS:
+        lines.extend(m.render())
+    for prefix, collect in _gauges.items():
+        try:
+            values = collect()
+        except Exception:
+            continue
+        for k, v in values.items():
+            if isinstance(v, (int, float)) and not isinstance(v, bool):
+                lines += [f"# TYPE {prefix}_{k} gauge", f"{prefix}_{k} {_num(v)}"]
+    return "\n".join(lines) + "\n"
+
+
+# ---------- Spans / Server-Timing ----------
+class _Trace:
+    __slots__ = ("sampled", "timings")
+
+    def __init__(self, sampled: bool, timings: Optional[Dict[str, float]]):
+        self.sampled = sampled
+        self.timings = timings  # tên span -> tổng ms, chỉ khi bật Server-Timing
+
+
+_trace: ContextVar[Optional[_Trace]] = ContextVar("metrics_trace", default=None)
+
+
+def start_trace(server_timing: bool = SERVER_TIMING):
+    """
+    Gọi ở đầu request (middleware). Returns token để reset và dict timings (None nếu không bật).
+    """
+    timings = {} if server_timing else None
+    return _trace.set(_Trace(random.random() < METRICS_SAMPLE_RATE, timings)), timings
+
+
+def end_trace(token) -> None:
+    _trace.reset(token)
+
+
+def _sampling() -> Tuple[bool, Optional[Dict[str, float]]]:
+    t = _trace.get()
+    if t is None:  # việc nền ngoài request
+        return random.random() < METRICS_SAMPLE_RATE, None
+    return t.sampled, t.timings
+
+
+def _record(name: str, seconds: float, detail: str, sampled: bool, timings: Optional[Dict[str, float]]) -> None:
+    if sampled:
+        span_seconds.observe(seconds, span=name, detail=detail)
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds * 1000
+
+
+def record_span(name: str, seconds: float, detail: str = "") -> None:
+    """
+    Ghi một span đã tự đo (khi không bọc được bằng `with span(...)`, vd. giữa một async generator).
+    """
+    _record(name, seconds, detail, *_sampling())
+
+
+@contextmanager
+def span(name: str, detail: str = ""):
+    """
+    Đo một đoạn code: `with span("csv_parse"): ...`. Dùng được trong cả code sync lẫn async.
+    Request không được sample và không bật Server-Timing -> gần như không tốn gì.
+    """
+    sampled, timings = _sampling()
+    if not sampled and timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, time.perf_counter() - start, detail, sampled, timings)
+
+
+def server_timing_header(timings: Dict[str, float], total_ms: float) -> str:
+    parts = [f"{name};dur={ms:.1f}" for name, ms in timings.items()]
+    parts.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(parts)
+
+
+def record_openai_usage(model: str, kind: str, data: Optional[dict], status: str = "ok") -> None:
+    openai_requests.inc(model=model, kind=kind, status=status)
+    usage = (data or {}).get("usage") or {}
+    for typ in ("prompt_tokens", "completion_tokens"):
+        if usage.get(typ):
+            openai_tokens.inc(usage[typ], model=model, type=typ.split("_")[0])
@@ -0,0 +1,399 @@
+# services/openai_scheduler.py
+from __future__ import annotations
+import os
+import json
+import time
+import heapq
+import random
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from .metrics import record_span, openai_retries
+
+# Giới hạn phía client cho mọi call OpenAI (mỗi process): số request đồng thời, RPM/TPM của tài khoản,
+# retry 429/5xx với backoff. Mặc định RPM/TPM theo tier 1 của gpt-4o-mini; 0 = không giới hạn.
+OPENAI_MAX_CONCURRENCY = max(1, int(os.getenv("OPENAI_MAX_CONCURRENCY", "16")))
+OPENAI_QUEUE_MAX = max(0, int(os.getenv("OPENAI_QUEUE_MAX", "256")))
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "200000"))
+OPENAI_MAX_RETRIES = max(0, int(os.getenv("OPENAI_MAX_RETRIES", "4")))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "0.5"))
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "20"))
+OPENAI_RETRY_AFTER_MAX = float(os.getenv("OPENAI_RETRY_AFTER_MAX", "60"))  # Retry-After dài hơn -> trả lỗi ngay
+# ước lượng completion khi request không đặt max_tokens; đối chiếu lại bằng usage thật sau mỗi call
+OPENAI_EST_COMPLETION_TOKENS = int(os.getenv("OPENAI_EST_COMPLETION_TOKENS", "512"))
+
+PRIORITY_INTERACTIVE = 0  # lượt chat user đang chờ (kể cả vision)
+PRIORITY_BACKGROUND = 10  # rolling summary, việc nền
+
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+_IMAGE_TOKENS = 1105  # trần token của một ảnh detail=high sau khi thu về 2048x768 (xem services/images.py)
+
+
+class OpenAIBusyError(RuntimeError):
+    """Hàng đợi OpenAI đầy hoặc vẫn bị rate limit sau khi retry; `retry_after` (giây) gợi ý cho client."""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def estimate_request_tokens(payload: dict) -> int:
+    """
+    Ước lượng token của một request (~4 ký tự/token) để trừ vào bucket TPM trước khi gửi.
+    Ảnh tính theo trần cố định thay vì độ dài base64.
+    """
+    chars = 0
+    images = 0
+    for m in payload.get("messages") or []:
+        content = m.get("content")
+        if isinstance(content, list):
+            for part in content:
+                if part.get("type") == "image_url":
+                    images += 1
+                else:
+                    chars += len(part.get("text") or "")
+        else:
+            chars += len(content or "")
+        if m.get("tool_calls"):
+            chars += len(json.dumps(m["tool_calls"]))
+    if payload.get("tools"):
+        chars += len(json.dumps(payload["tools"]))
+    completion = payload.get("max_tokens") or payload.get("max_completion_tokens") or OPENAI_EST_COMPLETION_TOKENS
+    return chars // 4 + images * _IMAGE_TOKENS + completion
+
+
+def retry_after_seconds(response: httpx.Response) -> Optional[float]:
+    """
+    `retry-after-ms` (OpenAI) hoặc `Retry-After` (giây hoặc HTTP-date).
+    """
+    ms = response.headers.get("retry-after-ms")
+    if ms:
+        try:
+            return max(0.0, float(ms) / 1000)
+        except ValueError:
+            pass
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _PriorityLimiter:
+    """
+    Semaphore cấp slot theo priority (nhỏ hơn = trước), cùng priority thì FIFO.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self._waiters: List[tuple] = []  # heap (priority, seq, future)
+        self._seq = itertools.count()
+
+    def queued(self, priority: Optional[int] = None) -> int:
+        return sum(1 for p, _, f in self._waiters if not f.done() and (priority is None or p == priority))
+
+    async def acquire(self, priority: int) -> None:
+        if self.active < self.limit and not self.queued():
+            self.active += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()  # slot đã được trao đúng lúc bị huỷ -> trả lại
+            else:
+                fut.cancel()  # _wake bỏ qua future đã huỷ
+            raise
+
+    def release(self) -> None:
+        self.active -= 1
+        while self._waiters and self.active < self.limit:
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.done():
+                continue
+            self.active += 1
+            fut.set_result(None)
+
+
+class _TokenBucket:
+    """
+    Bucket nạp đều `per_minute` đơn vị/phút, tối đa `per_minute`. Mức có thể âm khi usage thật lớn hơn ước lượng.
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self, amount: float) -> float:
+        self._refill()
+        missing = min(amount, self.capacity) - self.level
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, extra: float) -> None:
+        self._refill()
+        self.level = min(self.capacity, self.level - extra)
+
+
+class OpenAIScheduler:
+    """
+    Mọi call OpenAI đi qua đây:
+    1) chờ slot (OPENAI_MAX_CONCURRENCY, hàng đợi theo priority; quá OPENAI_QUEUE_MAX -> OpenAIBusyError),
+    2) chờ bucket RPM/TPM và cooldown sau 429,
+    3) gửi; 429/5xx/lỗi mạng -> nhả slot, ngủ (Retry-After hoặc backoff luỹ thừa có jitter) rồi thử lại.
+    Thời gian chờ ghi vào span `openai_wait` (slot | rate | backoff); độ sâu hàng đợi xem stats().
+    """
+
+    def __init__(
+        self,
+        *,
+        max_concurrency: int = OPENAI_MAX_CONCURRENCY,
+        queue_max: int = OPENAI_QUEUE_MAX,
+        rpm: int = OPENAI_RPM,
+        tpm: int = OPENAI_TPM,
+        max_retries: int = OPENAI_MAX_RETRIES,
+    ):
+        self.queue_max = queue_max
+        self.max_retries = max_retries
+        self._slots = _PriorityLimiter(max_concurrency)
+        self._rpm = _TokenBucket(rpm) if rpm > 0 else None
+        self._tpm = _TokenBucket(tpm) if tpm > 0 else None
+        self._rate_lock: Optional[asyncio.Lock] = None
+        self._rate_waiting = 0
+        self._cooldown_until = 0.0
+        self.retries = 0
+        self.rate_limited = 0
+        self.rejected = 0
+
+    # ---------- admission ----------
+    async def _acquire(self, priority: int, tokens: int) -> None:
+        if self._slots.queued() >= self.queue_max and self._slots.active >= self._slots.limit:
+            self.rejected += 1
+            raise OpenAIBusyError("Too many model requests are queued; please retry shortly.")
+        started = time.perf_counter()
+        await self._slots.acquire(priority)
+        record_span("openai_wait", time.perf_counter() - started, "slot")
+        try:
+            await self._wait_rate(tokens)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def _wait_rate(self, tokens: int) -> None:
+        if self._rpm is None and self._tpm is None and self._cooldown_until <= time.monotonic():
+            return
+        if self._rate_lock is None:
+            self._rate_lock = asyncio.Lock()
+        started = time.perf_counter()
+        self._rate_waiting += 1
+        try:
+            async with self._rate_lock:  # FIFO: request đến trước lấy quota trước
+                while True:
+                    wait = max(
+                        self._cooldown_until - time.monotonic(),
+                        self._rpm.delay(1) if self._rpm else 0.0,
+                        self._tpm.delay(tokens) if self._tpm else 0.0,
+                    )
+                    if wait <= 0:
+                        break
+                    await asyncio.sleep(wait)
+                if self._rpm:
+                    self._rpm.take(1)
+                if self._tpm:
+                    self._tpm.take(tokens)
+        finally:
+            self._rate_waiting -= 1
+        record_span("openai_wait", time.perf_counter() - started, "rate")
+
+    def reconcile(self, estimated: int, usage: Optional[dict]) -> None:
+        """
+        Đối chiếu token đã trừ trước với usage thật của response (trả lại hoặc trừ thêm phần chênh).
+        """
+        if self._tpm and usage and usage.get("total_tokens"):
+            self._tpm.adjust(usage["total_tokens"] - estimated)
+
+    # ---------- retry ----------
+    def _retry_delay(self, response: Optional[httpx.Response], attempt: int) -> Optional[float]:
+        """
+        Giây phải chờ trước lần thử tiếp theo; None = không retry (thành công, lỗi không retry được, hết lượt).
+        """
+        if response is not None and response.status_code not in RETRY_STATUS:
+            return None
+        retry_after = retry_after_seconds(response) if response is not None else None
+        if response is not None and response.status_code == 429:
+            self.rate_limited += 1
+            if attempt >= self.max_retries or (retry_after or 0) > OPENAI_RETRY_AFTER_MAX:
+                raise OpenAIBusyError(
+                    "The model API is rate limiting requests; please retry shortly.", retry_after or 1.0
+                )
+        elif attempt >= self.max_retries:
+            return None
+        backoff = random.uniform(0, min(OPENAI_BACKOFF_MAX, OPENAI_BACKOFF_BASE * 2 ** attempt))  # full jitter
+        delay = retry_after + random.uniform(0, OPENAI_BACKOFF_BASE) if retry_after is not None else backoff
+        if response is not None and response.status_code == 429:
+            # 429 là giới hạn của cả tài khoản: các request khác cũng tạm dừng
+            self._cooldown_until = max(self._cooldown_until, time.monotonic() + delay)
+        self.retries += 1
+        openai_retries.inc(reason=str(response.status_code) if response is not None else "transport")
+        return delay
+
+    async def _send(
+        self, priority: int, tokens: int, send: Callable[[], Awaitable[httpx.Response]]
+    ) -> httpx.Response:
+        """
+        Chạy `send` tới khi có response không cần retry. Trả về khi vẫn giữ slot: caller phải gọi _slots.release().
+        """
+        attempt = 0
+        while True:
+            await self._acquire(priority, tokens)
+            r = None
+            try:
+                try:
+                    r = await send()
+                except httpx.TransportError:
+                    if attempt >= self.max_retries:
+                        raise
+                delay = self._retry_delay(r, attempt)
+            except BaseException:
+                if r is not None:
+                    await r.aclose()
+                self._slots.release()
+                raise
+            if delay is None:
+                return r
+            if r is not None:
+                await r.aclose()
+            self._slots.release()
+            record_span("openai_wait", delay, "backoff")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def post(
+        self, client: httpx.AsyncClient, url: str, *, headers: dict, payload: dict, tokens: int,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> httpx.Response:
+        """
+        POST có retry. Returns response cuối cùng (thành công, hoặc lỗi không retry được / hết lượt retry).
+        """
+        r = await self._send(priority, tokens, lambda: client.post(url, headers=headers, json=payload))
+        self._slots.release()  # body đã đọc xong
+        return r
+
+    @asynccontextmanager
+    async def stream(
+        self, client: httpx.AsyncClient, url: str, *, headers: dict, payload: dict, tokens: int,
+        priority: int = PRIORITY_INTERACTIVE,
+    ):
+        """
+        Như post() nhưng response ở chế độ stream: chỉ retry trước khi đọc body (chưa phát chunk nào),
+        giữ slot cho tới khi đọc xong.
+        """
+        def send():
+            return client.send(client.build_request("POST", url, headers=headers, json=payload), stream=True)
+
+        r = await self._send(priority, tokens, send)
+        try:
+            yield r
+        finally:
+            await r.aclose()
+            self._slots.release()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self._slots.active,
+            "max_concurrency": self._slots.limit,
+            "queued": self._slots.queued(),
+            "queued_interactive": self._slots.queued(PRIORITY_INTERACTIVE),
+            "queued_background": self._slots.queued(PRIORITY_BACKGROUND),
+            "rate_waiting": self._rate_waiting,
+            "requests_available": round(self._rpm.level, 1) if self._rpm else -1,
+            "tokens_available": round(self._tpm.level) if self._tpm else -1,
+            "cooldown_seconds": round(max(0.0, self._cooldown_until - time.monotonic()), 3),
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "rejected": self.rejected,
+        }
+
+
+class SessionTurns:
+    """
+    Một lượt chat mỗi session tại một thời điểm (trong process này): lượt sau chờ lượt trước
+    lưu xong assistant message, nên đọc được đúng history và không ghi đè file plot của nhau.
+    """
+
+    def __init__(self):
+        self._locks: Dict[str, List] = {}  # session_id -> [lock, số lượt đang giữ/chờ]
+
+    async def acquire(self, session_id: str) -> Callable[[], None]:
+        """
+        Returns hàm release (gọi nhiều lần cũng được) cho trường hợp lượt kéo dài qua StreamingResponse.
+        """
+        entry = self._locks.setdefault(session_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        started = time.perf_counter()
+        try:
+            await entry[0].acquire()
+        except BaseException:
+            self._unref(session_id, entry)
+            raise
+        record_span("session_wait", time.perf_counter() - started)
+
+        done = False
+
+        def release() -> None:
+            nonlocal done
+            if done:
+                return
+            done = True
+            entry[0].release()
+            self._unref(session_id, entry)
+
+        return release
+
+    def _unref(self, session_id: str, entry: List) -> None:
+        entry[1] -= 1
+        if entry[1] == 0 and self._locks.get(session_id) is entry:
+            del self._locks[session_id]
+
+    @asynccontextmanager
+    async def turn(self, session_id: str):
+        release = await self.acquire(session_id)
+        try:
+            yield
+        finally:
+            release()
+
+    def stats(self) -> dict:
+        return {
+            "active": sum(1 for lock, _ in self._locks.values() if lock.locked()),
+            "waiting": sum(n - 1 for lock, n in self._locks.values() if lock.locked()),
+        }
+
+
+openai_scheduler = OpenAIScheduler()
+session_turns = SessionTurns()
@@ -0,0 +1,222 @@
+# services/plots.py
+from __future__ import annotations
+import os
+import json
+import hashlib
+import io
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable
+
+from .csv_tools import load_csv, dataset_hash
+from .lazy import lazy_import, register_prewarm
+from .metrics import span
+
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
+
+
+def _use_agg(_module) -> None:
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+_mpl_figure = lazy_import("matplotlib.figure", on_load=_use_agg)
+_mpl_agg = lazy_import("matplotlib.backends.backend_agg", on_load=_use_agg)
+
+HIST_STYLE = {"figsize": [6.4, 4.8], "dpi": 100, "color": "C0"}
+DEFAULT_BINS = 20
+
+# Giới hạn thư mục PNG histogram: vượt max bytes thì xoá file dùng lâu nhất trước (mtime = lần dùng cuối),
+# TTL (giây, 0 = không hết hạn) tính từ lần dùng cuối. Ảnh bị xoá sẽ được vẽ lại ở lần gọi tool sau.
+PLOT_CACHE_MAX_BYTES = int(os.getenv("PLOT_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+PLOT_CACHE_TTL = float(os.getenv("PLOT_CACHE_TTL", "0"))
+PLOT_SWEEP_SECONDS = float(os.getenv("PLOT_SWEEP_SECONDS", "60"))
+_TMP_MAX_AGE = 3600  # file .tmp.png sót lại khi process chết giữa chừng lúc render
+
+# Mỗi thread giữ một Figure Agg và vẽ lại trên đó, không tạo figure mới / không dùng pyplot
+_local = threading.local()
+_stats_lock = threading.Lock()
+render_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_last_sweep: dict[str, float] = {}
+
+
+def compute_histogram(values: np.ndarray, bins: int = DEFAULT_BINS) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Bins bằng NumPy (vectorized); bỏ NaN/inf.
+    """
+    values = np.asarray(values, dtype="float64")
+    values = values[np.isfinite(values)]
+    return np.histogram(values, bins=bins)
+
+
+def _figure(style: dict) -> Figure:
+    fig = getattr(_local, "fig", None)
+    if fig is None:
+        fig = _mpl_figure.Figure()
+        _mpl_agg.FigureCanvasAgg(fig)
+        _local.fig = fig
+    fig.clear()
+    fig.set_size_inches(*style["figsize"])
+    fig.set_dpi(style["dpi"])
+    return fig
+
+
+@register_prewarm
+def _prewarm_render() -> None:
+    # lần vẽ chữ đầu tiên nạp font + dựng text layout của matplotlib; làm trước thay cho tool đầu tiên
+    fig = _mpl_figure.Figure(figsize=(1, 1))
+    _mpl_agg.FigureCanvasAgg(fig)
+    fig.subplots().set_title("warm")
+    fig.savefig(io.BytesIO(), format="png")
+
+
+def render_histogram(counts: np.ndarray, edges: np.ndarray, column: str, out_path: Path, style: dict | None = None) -> Path:
+    style = {**HIST_STYLE, **(style or {})}
+    with span("plot_render"):
+        fig = _figure(style)
+        ax = fig.subplots()
+        ax.bar(edges[:-1], counts, width=np.diff(edges), align="edge", color=style["color"])
+        ax.set_title(f"Histogram of {column}")
+        ax.set_xlabel(column)
+        ax.set_ylabel("Frequency")
+        fig.tight_layout()
+        # ghi file tạm rồi rename để request song song không đọc phải PNG ghi dở
+        out_path = Path(out_path)
+        tmp_path = out_path.with_name(f"{out_path.stem}.{os.getpid()}.{threading.get_ident()}.tmp.png")
+        fig.savefig(tmp_path, dpi=style["dpi"])
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+def histogram_cache_path(out_dir: Path, data_hash: str, column: str, bins: int, style: dict | None = None) -> Path:
+    """
+    PNG content-addressed: cùng (dataset, cột, bins, style) -> cùng file.
+    """
+    style = {**HIST_STYLE, **(style or {})}
+    raw = json.dumps([data_hash, column, bins, style], sort_keys=True)
+    key = hashlib.sha256(raw.encode()).hexdigest()[:32]
+    return Path(out_dir) / f"hist_{key}.png"
+
+
+def touch_plot(path: Path) -> bool:
+    """
+    Đánh dấu PNG vừa được dùng lại (LRU của sweep_plot_cache). False nếu file đã bị xoá.
+    """
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def plot_cache_stats() -> dict:
+    with _stats_lock:
+        return dict(render_stats)
+
+
+def sweep_plot_cache(out_dir: Path, *, max_bytes: int | None = None, ttl: float | None = None) -> int:
+    """
+    Xoá PNG histogram hết hạn rồi xoá file dùng lâu nhất cho tới khi tổng dung lượng <= max_bytes.
+    Returns số file đã xoá.
+    """
+    max_bytes = PLOT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    ttl = PLOT_CACHE_TTL if ttl is None else ttl
+    now = time.time()
+    files: list[tuple[float, int, Path]] = []
+    removed = 0
+    for f in Path(out_dir).glob("hist_*.png"):
+        try:
+            st = f.stat()
+        except FileNotFoundError:
+            continue
+        if f.name.endswith(".tmp.png"):
+            if now - st.st_mtime > _TMP_MAX_AGE:
+                f.unlink(missing_ok=True)
+            continue
+        if ttl and now - st.st_mtime > ttl:
+            f.unlink(missing_ok=True)
+            removed += 1
+            continue
+        files.append((st.st_mtime, st.st_size, f))
+    total = sum(size for _, size, _ in files)
+    for _, size, f in sorted(files):
+        if total <= max_bytes:
+            break
+        f.unlink(missing_ok=True)
+        total -= size
+        removed += 1
+    with _stats_lock:
+        render_stats["evictions"] += removed
+    return removed
+
+
+def _maybe_sweep(out_dir: Path) -> None:
+    # quét thư mục tối đa mỗi PLOT_SWEEP_SECONDS một lần (mỗi process), không phải sau mọi lần render
+    key = str(out_dir)
+    now = time.monotonic()
+    with _stats_lock:
+        if now - _last_sweep.get(key, float("-inf")) < PLOT_SWEEP_SECONDS:
+            return
+        _last_sweep[key] = now
+    sweep_plot_cache(out_dir)
+
+
+def plot_histograms(
+    csv_path: Path,
+    columns: list[str],
+    out_dir: Path,
+    *,
+    bins: int = DEFAULT_BINS,
+    style: dict | None = None,
+    progress: Callable[[float, dict], None] | None = None,
+) -> list[dict]:
+    """
+    Vẽ histogram cho nhiều cột: cột đã có PNG trong cache thì lấy từ đĩa, các cột còn lại
+    đọc chung một lần (chỉ các cột đó) rồi render.
+    `progress(fraction, result)` (tuỳ chọn) được gọi mỗi khi xong một cột.
+    Returns [{"column", "path", "cached"} | {"column", "error"}] theo đúng thứ tự `columns`.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    data_hash = dataset_hash(csv_path)
+    unique = list(dict.fromkeys(columns))
+
+    results: dict[str, dict] = {}
+
+    def done(col: str, result: dict) -> None:
+        results[col] = result
+        if progress:
+            progress(len(results) / len(unique), result)
+
+    missing: list[str] = []
+    for col in unique:
+        target = histogram_cache_path(out_dir, data_hash, col, bins, style)
+        if touch_plot(target):
+            done(col, {"column": col, "path": target, "cached": True})
+        else:
+            missing.append(col)
+    with _stats_lock:
+        render_stats["hits"] += len(results)
+        render_stats["misses"] += len(missing)
+
+    if missing:
+        df = load_csv(Path(csv_path), columns=missing)
+        for col in missing:
+            if col not in df.columns:
+                done(col, {"column": col, "error": f"Column '{col}' not found."})
+                continue
+            values = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+            if not np.isfinite(values).any():
+                done(col, {"column": col, "error": f"Column '{col}' is not numeric or has no data."})
+                continue
+            counts, edges = compute_histogram(values, bins)
+            target = histogram_cache_path(out_dir, data_hash, col, bins, style)
+            render_histogram(counts, edges, col, target, style)
+            done(col, {"column": col, "path": target, "cached": False})
+        _maybe_sweep(out_dir)
+
+    return [results[c] for c in unique]
@@ -0,0 +1,59 @@
+# services/singleflight.py
+from __future__ import annotations
+import asyncio
+from typing import Awaitable, Callable, Dict, List, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Gộp các lời gọi đồng thời cùng key thành một lần chạy: lời gọi đầu tạo task, các lời gọi sau
+    chờ chính task đó và nhận cùng kết quả / cùng exception. Key được xoá khi task xong, nên không
+    giữ kết quả lại (cache là việc của tool_cache / vision_payloads).
+    Huỷ: caller bị huỷ chỉ rời nhóm; task chỉ bị huỷ khi không còn ai chờ.
+    Kết quả dùng chung giữa các caller -> không được sửa tại chỗ.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, List] = {}  # key -> [task, số caller đang chờ]
+        self.executions = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        flight = self._flights.get(key)
+        if flight is None:
+            task = asyncio.ensure_future(fn())
+            flight = self._flights[key] = [task, 0]
+            task.add_done_callback(lambda t, key=key, flight=flight: self._finished(key, flight, t))
+            self.executions += 1
+        else:
+            self.coalesced += 1
+
+        task = flight[0]
+        flight[1] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            flight[1] -= 1
+            if flight[1] == 0 and not task.done():
+                # caller cuối cùng đã bỏ đi: huỷ việc đang chạy, lời gọi mới sẽ chạy lại từ đầu
+                self._forget(key, flight)
+                task.cancel()
+
+    def _forget(self, key: str, flight: List) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def _finished(self, key: str, flight: List, task: asyncio.Future) -> None:
+        self._forget(key, flight)
+        if not task.cancelled():
+            task.exception()  # đã chuyển cho các caller; tránh cảnh báo "exception was never retrieved"
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._flights),
+            "waiters": sum(n for _, n in self._flights.values()),
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+        }
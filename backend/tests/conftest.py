@@ -0,0 +1,14 @@
+# tests/conftest.py
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND_DIR))
+
+# services.llm đọc env lúc import: key giả, cache ra thư mục tạm (không đụng backend/cache)
+_tmp = tempfile.mkdtemp(prefix="chat-tests-")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("LLM_CACHE_PATH", os.path.join(_tmp, "llm_cache.sqlite3"))
+os.environ.setdefault("TOOL_CACHE_PATH", os.path.join(_tmp, "tool_cache.sqlite3"))
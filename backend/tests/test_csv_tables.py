@@ -0,0 +1,62 @@
+# tests/test_csv_tables.py
+import io
+import json
+
+import numpy as np
+import pandas as pd
+
+from services.csv_tools import df_to_csv_payload, df_to_json_payload, df_to_markdown_table, stats_frame
+
+
+def _mixed_frame() -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "revenue": rng.uniform(1.5e6, 2.5e6, 200),
+        "rate": rng.uniform(0.001, 0.009, 200),
+        "units": rng.integers(0, 50, 200),
+    })
+
+
+def _assert_close(rendered: dict, expected: pd.Series) -> None:
+    for stat, value in expected.items():
+        got = float(rendered[stat])
+        assert got != 0 or value == 0, (stat, rendered[stat])
+        assert abs(got - value) <= 1e-3 * abs(value), (stat, rendered[stat], value)
+
+
+def test_stats_precision_is_chosen_per_variable():
+    df = _mixed_frame()
+    desc = df.describe()
+    stats = stats_frame(desc)
+
+    rows = {r["column"]: r for r in stats.to_dict("records")}
+    for col in df.columns:
+        _assert_close({k: v for k, v in rows[col].items() if k not in ("column", "count")}, desc[col].drop("count"))
+
+    # cùng giá trị trong bảng markdown và payload CSV gửi model
+    payload = pd.read_csv(io.StringIO(df_to_csv_payload(stats, max_rows=len(stats))), dtype=str)
+    rate = payload.set_index("column").loc["rate"].drop("count")
+    _assert_close(rate.to_dict(), desc["rate"].drop("count"))
+    markdown_rate = next(line for line in df_to_markdown_table(stats, max_rows=len(stats)).splitlines()
+                         if line.startswith("| rate |"))
+    cells = [c.strip() for c in markdown_rate.strip("|").split("|")]
+    assert cells[2:] == list(rate.values)
+
+
+def test_stats_from_streaming_dict():
+    numeric = {"revenue": {"count": 3.0, "mean": 2.1e6, "std": 1.2e5, "min": 2e6, "25%": 2.05e6,
+                           "50%": 2.1e6, "75%": 2.15e6, "max": 2.2e6},
+               "rate": {"count": 3.0, "mean": 0.005, "std": 0.002, "min": 0.003, "25%": 0.004,
+                        "50%": 0.005, "75%": 0.006, "max": 0.007}}
+    rate = json.loads(json.dumps(df_to_json_payload(stats_frame(numeric), max_rows=2)))
+    row = dict(zip(rate["columns"], rate["rows"][1]))
+    assert row["column"] == "rate" and row["count"] == "3"
+    _assert_close({k: v for k, v in row.items() if k not in ("column", "count")},
+                  pd.Series(numeric["rate"]).drop("count"))
+
+
+def test_preview_column_with_mixed_magnitudes_keeps_small_values():
+    df = pd.DataFrame({"x": [2_000_000.5, 0.0031, 12.25]})
+    lines = df_to_markdown_table(df).splitlines()[2:]
+    values = [float(line.strip("| ")) for line in lines]
+    assert values[1] != 0 and abs(values[1] - 0.0031) < 1e-6
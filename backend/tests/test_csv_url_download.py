@@ -0,0 +1,64 @@
+# tests/test_csv_url_download.py
+import asyncio
+import gzip
+import tracemalloc
+
+import httpx
+import pytest
+
+from services import csv_tools
+from services.csv_tools import CsvTooLargeError, download_csv_from_url
+
+
+def _serve(monkeypatch, body: bytes, headers: dict | None = None):
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=body, headers=headers)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(csv_tools, "get_http_client", lambda: client)
+    return client
+
+
+def _download(tmp_path, max_bytes):
+    return asyncio.run(download_csv_from_url("http://csv.test/data.csv.gz", tmp_path, "s1", max_bytes=max_bytes))
+
+
+def test_gzip_bomb_hits_cap_without_inflating_chunk(monkeypatch, tmp_path):
+    # ~64 KB nén -> 64 MB sau giải nén, nằm trọn trong một chunk tải về
+    body = gzip.compress(b"a,b\n" + b"0" * (64 * 1024 * 1024), compresslevel=9)
+    assert len(body) < csv_tools.CSV_URL_CHUNK_BYTES
+    # lần tải nhỏ trước: import lười (pandas cho sniff) không bị tính vào peak bên dưới
+    _serve(monkeypatch, gzip.compress(b"a,b\n1,2\n"))
+    _download(tmp_path / "warm", max_bytes=1024)
+    _serve(monkeypatch, body)
+
+    tracemalloc.start()
+    try:
+        with pytest.raises(CsvTooLargeError):
+            _download(tmp_path / "bomb", max_bytes=4 * 1024 * 1024)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert peak < 16 * 1024 * 1024
+    assert list((tmp_path / "bomb").iterdir()) == []  # file tạm .part đã bị xoá
+
+
+def test_gzip_within_cap_is_decompressed(monkeypatch, tmp_path):
+    raw = b"a,b\n" + b"1,2\n" * 500_000
+    _serve(monkeypatch, gzip.compress(raw))
+
+    out_path, profile = _download(tmp_path, max_bytes=len(raw))
+
+    assert out_path.read_bytes() == raw
+    assert profile["bytes"] == len(raw)
+
+
+def test_declared_content_length_over_cap_is_rejected(monkeypatch, tmp_path):
+    body = b"a,b\n" + b"1,2\n" * 1000
+    _serve(monkeypatch, body)  # httpx đặt Content-Length theo body
+
+    with pytest.raises(CsvTooLargeError):
+        _download(tmp_path, max_bytes=len(body) - 1)
+
+    assert list(tmp_path.iterdir()) == []
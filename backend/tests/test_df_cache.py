@@ -0,0 +1,83 @@
+# tests/test_df_cache.py
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from services.csv_tools import DataFrameCache
+
+
+def _csv(tmp_path, name, text="a\n1\n"):
+    path = tmp_path / name
+    path.write_text(text)
+    return path
+
+
+def _frame(n_chars):
+    # object column: memory_usage() nông chỉ thấy con trỏ, deep=True mới tính chuỗi
+    return pd.DataFrame({"s": ["x" * n_chars] * 10})
+
+
+def test_same_key_is_loaded_once_while_other_keys_load_in_parallel(tmp_path):
+    cache = DataFrameCache(max_bytes=1 << 30)
+    same, a, b = _csv(tmp_path, "same.csv"), _csv(tmp_path, "a.csv"), _csv(tmp_path, "b.csv")
+    calls = []
+    both_loading = threading.Barrier(2, timeout=5)
+
+    def slow_loader(path, columns):
+        calls.append(path.name)
+        time.sleep(0.2)
+        return pd.DataFrame({"a": [1]})
+
+    def meeting_loader(path, columns):
+        both_loading.wait()  # chỉ qua được khi hai key khác nhau đang load cùng lúc
+        return pd.DataFrame({"a": [1]})
+
+    with ThreadPoolExecutor(8) as pool:
+        frames = list(pool.map(lambda _: cache.get_or_load(same, slow_loader), range(8)))
+        list(pool.map(lambda p: cache.get_or_load(p, meeting_loader), [a, b]))
+
+    assert calls == ["same.csv"]
+    assert all(df is frames[0] for df in frames)
+    assert cache.stats()["misses"] == 3 and cache.stats()["hits"] == 7
+
+
+def test_lru_eviction_counts_deep_memory(tmp_path):
+    one = int(_frame(1000).memory_usage(deep=True).sum())
+    cache = DataFrameCache(max_bytes=int(one * 2.5))
+    paths = [_csv(tmp_path, f"{i}.csv") for i in range(3)]
+    load = lambda path, columns: _frame(1000)
+
+    first = cache.get_or_load(paths[0], load)
+    cache.get_or_load(paths[1], load)
+    assert cache.get_or_load(paths[0], load) is first  # 0 vừa dùng -> 1 là LRU
+    cache.get_or_load(paths[2], load)
+
+    stats = cache.stats()
+    assert stats["entries"] == 2 and stats["evictions"] == 1 and stats["bytes"] == 2 * one
+    assert cache.get_or_load(paths[0], load) is first
+    assert cache.get_or_load(paths[1], load) is not None and cache.stats()["misses"] == 4
+
+
+def test_frame_larger_than_budget_by_deep_size_is_not_kept(tmp_path):
+    df = _frame(10_000)
+    shallow, deep = int(df.memory_usage().sum()), int(df.memory_usage(deep=True).sum())
+    cache = DataFrameCache(max_bytes=(shallow + deep) // 2)
+    path = _csv(tmp_path, "big.csv")
+
+    cache.get_or_load(path, lambda p, c: df)
+
+    assert cache.stats()["entries"] == 0 and cache.stats()["bytes"] == 0
+
+
+def test_rewritten_file_misses_and_replaces_old_version(tmp_path):
+    cache = DataFrameCache(max_bytes=1 << 30)
+    path = _csv(tmp_path, "d.csv", "a\n1\n")
+    read = lambda p, columns: pd.read_csv(p)
+
+    assert cache.get_or_load(path, read)["a"].tolist() == [1]
+    path.write_text("a\n1\n2\n")
+
+    assert cache.get_or_load(path, read)["a"].tolist() == [1, 2]
+    assert cache.stats()["entries"] == 1
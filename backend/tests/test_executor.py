@@ -0,0 +1,52 @@
+# tests/test_executor.py
+import asyncio
+import threading
+import time
+
+import pytest
+
+from services import executor
+from services.executor import ToolBusyError, ToolTimeoutError, run_tool
+
+
+@pytest.fixture
+def small_pool(monkeypatch):
+    # 1 worker + 1 chỗ trong hàng đợi; pool mới cho mỗi test
+    monkeypatch.setattr(executor, "TOOL_WORKERS", 1)
+    monkeypatch.setattr(executor, "TOOL_QUEUE_MAX", 1)
+    executor.shutdown_tool_executor()
+    yield
+    executor.shutdown_tool_executor()
+
+
+def test_full_queue_rejects_with_tool_busy(small_pool):
+    release = threading.Event()
+
+    async def main():
+        running = [asyncio.create_task(run_tool("slow", release.wait, 5)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        assert executor.pending_tools() == 2
+        with pytest.raises(ToolBusyError):
+            await run_tool("slow", release.wait, 5)
+        release.set()
+        return await asyncio.gather(*running)
+
+    assert asyncio.run(main()) == [True, True]
+    assert executor.pending_tools() == 0
+
+
+def test_slow_tool_times_out_and_frees_its_slot(small_pool):
+    async def main():
+        with pytest.raises(ToolTimeoutError):
+            await run_tool("slow", time.sleep, 0.5, timeout=0.05)
+        # việc đang chạy dở chạy nốt rồi nhả slot; việc sau vẫn được nhận
+        return await run_tool("fast", sum, [1, 2, 3], timeout=5)
+
+    assert asyncio.run(main()) == 6
+    assert executor.pending_tools() == 0
+
+
+def test_per_tool_timeout_from_env(monkeypatch):
+    monkeypatch.setenv("TOOL_TIMEOUT_ANALYZE_CSV", "300")
+    assert executor.tool_timeout("analyze_csv") == 300
+    assert executor.tool_timeout("plot_histograms") == executor.TOOL_TIMEOUT
@@ -0,0 +1,47 @@
+# tests/test_job_progress.py
+import asyncio
+
+import numpy as np
+import pandas as pd
+
+from services import csv_tools, llm, plots
+from services.jobs import JobProgress
+
+
+def _write_csv(path, rows=20_000):
+    rng = np.random.default_rng(1)
+    pd.DataFrame({"x": rng.normal(size=rows), "y": rng.integers(0, 100, rows), "s": ["a"] * rows}).to_csv(path, index=False)
+    return path
+
+
+def test_streaming_analysis_reports_byte_progress_and_partial_markdown(monkeypatch, tmp_path):
+    path = _write_csv(tmp_path / "d.csv")
+    monkeypatch.setattr(csv_tools, "CSV_STREAM_CHUNK_ROWS", 2_000)
+    monkeypatch.setattr(llm, "CSV_STREAM_THRESHOLD_BYTES", 0)
+    calls = []
+
+    result = llm._analyze_csv_sync(str(path), False, lambda fraction, markdown=None: calls.append((fraction, markdown)))
+
+    fractions = [f for f, md in calls if md is None]
+    assert len(fractions) == 10  # một lần mỗi chunk, theo bytes đã đọc
+    assert fractions == sorted(fractions) and 0 < fractions[0] < fractions[-1] <= 0.95
+    parts = [md for _, md in calls if md]
+    assert [p.split("\n", 1)[0] for p in parts] == ["**Preview (first 5 rows)**", "### CSV Overview", "**Columns & Types**"]
+    assert all(p in result["markdown"] for p in parts)
+
+
+def test_histogram_job_reads_csv_once_and_reports_each_column(monkeypatch, tmp_path):
+    path = _write_csv(tmp_path / "d.csv", rows=500)
+    monkeypatch.setattr(llm, "UPLOADS", tmp_path / "uploads")
+    monkeypatch.setattr(llm, "TOOL_CACHE_ENABLED", False)
+    loads = []
+    real_load = plots.load_csv
+    monkeypatch.setattr(plots, "load_csv", lambda p, columns=None: loads.append(columns) or real_load(p, columns=columns))
+    progress = JobProgress()
+
+    result = asyncio.run(llm._plot_histograms_job({"csv_path": str(path), "columns": ["x", "y"], "bins": 10}, progress))
+
+    assert loads == [["x", "y"]]
+    assert progress.fraction == 1.0
+    assert len(progress.parts) == 2 and "`x`" in progress.parts[0] and "`y`" in progress.parts[1]
+    assert len(result["new_attachments"]) == 2
@@ -0,0 +1,33 @@
+# tests/test_lazy_sidecar.py
+import pytest
+
+from services import csv_tools
+from services.csv_tools import UploadProfiler, load_csv, sidecar_path_for
+
+
+def test_first_load_builds_sidecar_and_later_loads_skip_csv_parse(monkeypatch, tmp_path):
+    pytest.importorskip("pyarrow")
+    path = tmp_path / "d.csv"
+    path.write_text("a,b\n1,x\n2,y\n3,z\n")
+    assert not sidecar_path_for(path).exists()  # upload không còn parse file
+
+    df = load_csv(path)
+    assert df["a"].tolist() == [1, 2, 3]
+    assert sidecar_path_for(path).is_file()
+
+    def no_csv_parse(*args, **kwargs):
+        raise AssertionError("CSV parsed again")
+
+    monkeypatch.setattr(csv_tools.pd, "read_csv", no_csv_parse)
+    assert load_csv(path, columns=["b"])["b"].tolist() == ["x", "y", "z"]
+
+
+def test_upload_profile_marks_row_count_estimated_when_quoted():
+    plain = UploadProfiler(csv=True)
+    plain.feed(b"a,b\n1,x\n2,y\n")
+    assert plain.finish()["rows"] == 2 and "rows_estimated" not in plain.finish()
+
+    quoted = UploadProfiler(csv=True)
+    quoted.feed(b'a,b\n1,"line\nbreak"\n2,y\n')
+    profile = quoted.finish()
+    assert profile["rows"] == 3 and profile["rows_estimated"] is True
@@ -0,0 +1,59 @@
+# tests/test_migrations.py
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine, inspect, text
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+
+# mỗi process giả làm một worker uvicorn vừa khởi động: cùng upgrade() một DB cũ tại cùng thời điểm
+_WORKER = """
+import sys, time
+from sqlalchemy import create_engine
+from migrations import upgrade
+url, start = sys.argv[1], float(sys.argv[2])
+engine = create_engine(url)
+time.sleep(max(0.0, start - time.time()))
+print(upgrade(engine))
+"""
+
+
+def _old_db(path: Path) -> None:
+    # schema của bản đầu: sessions / messages chưa có các cột aggregate, chưa có bảng migration
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE sessions (id VARCHAR PRIMARY KEY, title VARCHAR(200), created_at DATETIME, updated_at DATETIME);
+        CREATE TABLE messages (id INTEGER PRIMARY KEY, session_id VARCHAR, role VARCHAR(20), content TEXT, created_at DATETIME);
+        INSERT INTO sessions VALUES ('s1', 't', '2024-01-01 00:00:00', '2024-01-01 00:00:00');
+        INSERT INTO messages VALUES (1, 's1', 'user', 'hi', '2024-01-01 00:00:00');
+    """)
+    conn.close()
+
+
+def test_concurrent_worker_boots_upgrade_once(tmp_path):
+    db = tmp_path / "db.sqlite3"
+    _old_db(db)
+    url = f"sqlite:///{db}"
+    start = time.time() + 2
+    procs = [
+        subprocess.Popen(
+            [sys.executable, "-c", _WORKER, url, str(start)], cwd=BACKEND_DIR, env=dict(os.environ),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+        )
+        for _ in range(6)
+    ]
+    results = [(p.wait(timeout=120), *p.communicate()) for p in procs]
+
+    assert all(code == 0 for code, _, _ in results), [err[-500:] for code, _, err in results if code]
+    applied = sorted(out.strip() for _, out, _ in results)
+    assert applied.count("[1, 2, 3]") == 1 and applied.count("[]") == 5  # đúng một worker chạy migration
+
+    engine = create_engine(url)
+    assert "message_count" in {c["name"] for c in inspect(engine).get_columns("sessions")}
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT message_count FROM sessions")).scalar() == 1
+        assert conn.execute(text("SELECT count(*) FROM schema_migrations")).scalar() == 3
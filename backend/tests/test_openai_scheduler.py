@@ -0,0 +1,116 @@
+# tests/test_openai_scheduler.py
+import asyncio
+import json
+import time
+from email.utils import formatdate
+
+import httpx
+import pytest
+
+from services import openai_scheduler as sched
+from services.openai_scheduler import (
+    OpenAIBusyError, OpenAIScheduler, PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, retry_after_seconds,
+)
+
+URL = "https://api.test/v1/chat/completions"
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(sched, "OPENAI_BACKOFF_BASE", 0.01)
+
+
+def _scripted(responses):
+    # trả lần lượt từng response; ghi lại số lần được gọi
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return responses[min(len(calls), len(responses)) - 1]
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler)), calls
+
+
+def _post(scheduler, client, priority=PRIORITY_INTERACTIVE, payload=None):
+    return scheduler.post(client, URL, headers={}, payload=payload or {}, tokens=10, priority=priority)
+
+
+def test_retries_5xx_and_429_honoring_retry_after():
+    client, calls = _scripted([
+        httpx.Response(503),
+        httpx.Response(429, headers={"retry-after-ms": "150"}),
+        httpx.Response(200, json={"ok": True}),
+    ])
+    scheduler = OpenAIScheduler(rpm=0, tpm=0, max_retries=3)
+
+    started = time.monotonic()
+    r = asyncio.run(_post(scheduler, client))
+
+    assert r.status_code == 200 and len(calls) == 3
+    assert time.monotonic() - started >= 0.15
+    assert scheduler.retries == 2 and scheduler.rate_limited == 1
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_non_retryable_status_is_returned_once():
+    client, calls = _scripted([httpx.Response(400, json={"error": "bad"})])
+    r = asyncio.run(_post(OpenAIScheduler(rpm=0, tpm=0, max_retries=3), client))
+    assert r.status_code == 400 and len(calls) == 1
+
+
+def test_persistent_429_raises_busy_with_retry_after():
+    client, calls = _scripted([httpx.Response(429, headers={"retry-after": "0.01"})])
+    scheduler = OpenAIScheduler(rpm=0, tpm=0, max_retries=2)
+
+    with pytest.raises(OpenAIBusyError) as e:
+        asyncio.run(_post(scheduler, client))
+
+    assert len(calls) == 3 and e.value.retry_after == pytest.approx(0.01)
+
+
+def test_retry_after_beyond_limit_fails_fast(monkeypatch):
+    monkeypatch.setattr(sched, "OPENAI_RETRY_AFTER_MAX", 5)
+    client, calls = _scripted([httpx.Response(429, headers={"retry-after": "30"})])
+
+    with pytest.raises(OpenAIBusyError) as e:
+        asyncio.run(_post(OpenAIScheduler(rpm=0, tpm=0, max_retries=4), client))
+
+    assert len(calls) == 1 and e.value.retry_after == 30
+
+
+def test_interactive_requests_overtake_queued_background_ones():
+    order = []
+
+    async def main():
+        release = asyncio.Event()
+
+        async def handler(request):
+            tag = json.loads(request.read())["tag"]
+            order.append(tag)
+            if tag == "first":
+                await release.wait()
+            return httpx.Response(200)
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        scheduler = OpenAIScheduler(max_concurrency=1, rpm=0, tpm=0)
+        first = asyncio.create_task(_post(scheduler, client, payload={"tag": "first"}))
+        await asyncio.sleep(0.01)
+        queued = [
+            asyncio.create_task(_post(scheduler, client, PRIORITY_BACKGROUND, {"tag": "summary"})),
+            asyncio.create_task(_post(scheduler, client, PRIORITY_INTERACTIVE, {"tag": "chat"})),
+        ]
+        await asyncio.sleep(0.01)
+        assert scheduler.stats()["queued_background"] == 1 and scheduler.stats()["queued_interactive"] == 1
+        release.set()
+        await asyncio.gather(first, *queued)
+
+    asyncio.run(main())
+    assert order == ["first", "chat", "summary"]
+
+
+def test_retry_after_header_formats():
+    assert retry_after_seconds(httpx.Response(429, headers={"retry-after-ms": "250"})) == 0.25
+    assert retry_after_seconds(httpx.Response(429, headers={"retry-after": "3"})) == 3
+    date = retry_after_seconds(httpx.Response(429, headers={"retry-after": formatdate(time.time() + 10, usegmt=True)}))
+    assert 8 < date <= 10
+    assert retry_after_seconds(httpx.Response(429)) is None
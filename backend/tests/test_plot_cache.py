@@ -0,0 +1,54 @@
+# tests/test_plot_cache.py
+import os
+import time
+
+import pandas as pd
+
+from services import plots
+
+
+def _png(out_dir, name, size, age):
+    f = out_dir / name
+    f.write_bytes(b"x" * size)
+    t = time.time() - age
+    os.utime(f, (t, t))
+    return f
+
+
+def test_sweep_drops_least_recently_used_until_under_cap(tmp_path):
+    old = _png(tmp_path, "hist_old.png", 100, age=300)
+    mid = _png(tmp_path, "hist_mid.png", 100, age=200)
+    new = _png(tmp_path, "hist_new.png", 100, age=100)
+    other = _png(tmp_path, "upload.png", 100, age=900)  # không phải cache histogram
+
+    assert plots.touch_plot(old)  # vừa được dùng lại -> thành mới nhất
+    removed = plots.sweep_plot_cache(tmp_path, max_bytes=200, ttl=0)
+
+    assert removed == 1
+    assert not mid.exists()
+    assert old.exists() and new.exists() and other.exists()
+
+
+def test_sweep_applies_ttl_and_clears_stale_temp_files(tmp_path):
+    expired = _png(tmp_path, "hist_a.png", 10, age=120)
+    fresh = _png(tmp_path, "hist_b.png", 10, age=10)
+    stale_tmp = _png(tmp_path, "hist_c.1.2.tmp.png", 10, age=2 * 3600)
+    live_tmp = _png(tmp_path, "hist_d.1.2.tmp.png", 10, age=1)
+
+    plots.sweep_plot_cache(tmp_path, max_bytes=1 << 20, ttl=60)
+
+    assert not expired.exists() and not stale_tmp.exists()
+    assert fresh.exists() and live_tmp.exists()
+
+
+def test_evicted_histogram_is_rendered_again(tmp_path):
+    csv = tmp_path / "d.csv"
+    pd.DataFrame({"x": range(100)}).to_csv(csv, index=False)
+    out_dir = tmp_path / "plots"
+
+    first = plots.plot_histograms(csv, ["x"], out_dir, bins=5)[0]
+    plots.sweep_plot_cache(out_dir, max_bytes=0)
+    assert not first["path"].exists()
+
+    again = plots.plot_histograms(csv, ["x"], out_dir, bins=5)[0]
+    assert again["cached"] is False and again["path"] == first["path"] and again["path"].is_file()
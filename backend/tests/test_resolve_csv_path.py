@@ -0,0 +1,63 @@
+# tests/test_resolve_csv_path.py
+import asyncio
+import tempfile
+from pathlib import Path
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from models import Base, SessionChat, Message, Attachment
+from services import llm
+
+
+def _resolve(tmp_path, files, latest, ask):
+    """
+    Session có các CSV `files` (tạo thật trên đĩa), con trỏ latest -> files[latest].
+    Returns (đường dẫn resolve được, các câu SQL có LIKE đã chạy)
+    """
+    tmp_path = Path(tempfile.mkdtemp(dir=tmp_path))  # mỗi lần gọi một DB + thư mục riêng
+    async def main():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'db.sqlite3'}")
+        likes = []
+        event.listen(engine.sync_engine, "before_cursor_execute",
+                     lambda conn, cur, stmt, *a: likes.append(stmt) if " LIKE " in stmt else None)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        Session = async_sessionmaker(engine, expire_on_commit=False)
+        async with Session() as db:
+            db.add(SessionChat(id="s1"))
+            msg = Message(session_id="s1", role="user", content="hi")
+            db.add(msg)
+            await db.flush()
+            ids = []
+            for name in files:
+                path = tmp_path / name
+                path.write_text("a\n1\n")
+                att = Attachment(message_id=msg.id, kind="csv", path=str(path))
+                db.add(att)
+                await db.flush()
+                ids.append(att.id)
+            (await db.get(SessionChat, "s1")).latest_csv_attachment_id = ids[latest]
+            await db.commit()
+            likes.clear()
+            result = await llm._resolve_csv_path(db, "s1", ask)
+        await engine.dispose()
+        return result, likes
+
+    return asyncio.run(main())
+
+
+def test_latest_pointer_hit_skips_like_scan(tmp_path):
+    path, likes = _resolve(tmp_path, ["s1_old.csv", "s1_sales_2024.csv"], 1, "sales_2024.csv")
+    assert path.name == "s1_sales_2024.csv"
+    assert likes == []
+
+
+def test_underscore_and_percent_are_not_wildcards(tmp_path):
+    path, likes = _resolve(tmp_path, ["s1_a_b.csv", "s1_aXb.csv", "s1_50%.csv"], 1, "a_b.csv")
+    assert path.name == "s1_a_b.csv" and len(likes) == 1
+    # 'aXb.csv' khớp '%a_b.csv' nếu '_' là wildcard; phải rơi về fallback (CSV mới nhất) chứ không phải match sai
+    path, _ = _resolve(tmp_path, ["s1_aXb.csv", "s1_other.csv"], 1, "a_b.csv")
+    assert path.name == "s1_other.csv"
+    path, _ = _resolve(tmp_path, ["s1_50%.csv", "s1_other.csv"], 1, "50%.csv")
+    assert path.name == "s1_50%.csv"
@@ -0,0 +1,90 @@
+# tests/test_singleflight.py
+import asyncio
+
+import pytest
+
+from services.singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_execution():
+    flight = SingleFlight()
+    runs = []
+
+    async def work():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return {"value": 42}
+
+    async def main():
+        return await asyncio.gather(*(flight.do("k", work) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert len(runs) == 1 and all(r is results[0] for r in results)
+    assert flight.stats() == {"in_flight": 0, "waiters": 0, "executions": 1, "coalesced": 4}
+
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    flight = SingleFlight()
+
+    async def main():
+        done = asyncio.Event()
+
+        async def work():
+            await done.wait()
+            return "result"
+
+        first = asyncio.create_task(flight.do("k", work))
+        second = asyncio.create_task(flight.do("k", work))
+        await asyncio.sleep(0.01)
+        first.cancel()  # caller đầu (người tạo task) bỏ đi
+        await asyncio.sleep(0.01)
+        assert flight.stats()["waiters"] == 1
+        done.set()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == "result"
+
+
+def test_last_caller_leaving_cancels_the_work_and_next_call_reruns():
+    flight = SingleFlight()
+    cancelled = []
+
+    async def main():
+        async def hang():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        callers = [asyncio.create_task(flight.do("k", hang)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for c in callers:
+            c.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0.01)
+        assert cancelled == [True] and flight.stats()["in_flight"] == 0
+
+        async def quick():
+            return "fresh"
+
+        return await flight.do("k", quick)
+
+    assert asyncio.run(main()) == "fresh"
+    assert flight.executions == 2
+
+
+def test_exception_is_shared_with_every_caller():
+    flight = SingleFlight()
+
+    async def boom():
+        await asyncio.sleep(0.01)
+        raise ValueError("bad csv")
+
+    async def main():
+        return await asyncio.gather(*(flight.do("k", boom) for _ in range(3)), return_exceptions=True)
+
+    errors = asyncio.run(main())
+    assert all(isinstance(e, ValueError) for e in errors) and flight.executions == 1
@@ -0,0 +1,65 @@
+# tests/test_stream_stats.py
+import numpy as np
+import pandas as pd
+import pytest
+
+from services.csv_tools import stream_csv_stats
+
+STATS = ["count", "mean", "std", "min", "max"]
+QUANTILES = ["25%", "50%", "75%"]
+
+
+def _dataset(tmp_path, rows):
+    rng = np.random.default_rng(7)
+    df = pd.DataFrame({
+        "x": rng.normal(10, 3, rows),
+        "n": rng.integers(-50, 50, rows).astype("float64"),
+        "label": rng.choice(["a", "b"], rows),
+    })
+    df.loc[rng.choice(rows, rows // 10, replace=False), "n"] = np.nan
+    path = tmp_path / "d.csv"
+    df.to_csv(path, index=False)
+    return path, pd.read_csv(path)
+
+
+def test_exact_stats_match_describe(tmp_path):
+    path, df = _dataset(tmp_path, 1_500)  # <= k của sketch -> phân vị cũng chính xác
+    st = stream_csv_stats(path, chunksize=200)
+    desc = df.describe()
+
+    assert st["rows"] == len(df) and st["columns"] == df.columns.tolist()
+    assert st["missing_values"] == {"n": int(df["n"].isna().sum())}
+    assert set(st["numeric"]) == {"x", "n"} and not st["quantiles_approximate"]
+    for col in ("x", "n"):
+        for stat in STATS + QUANTILES:
+            assert st["numeric"][col][stat] == pytest.approx(desc.loc[stat, col], rel=1e-9), (col, stat)
+
+
+def test_large_file_moments_exact_quantiles_within_rank_error(tmp_path):
+    path, df = _dataset(tmp_path, 50_000)
+    st = stream_csv_stats(path, chunksize=5_000)
+    desc = df.describe()
+
+    assert st["quantiles_approximate"]
+    for col in ("x", "n"):
+        values = np.sort(df[col].dropna().to_numpy())
+        for stat in STATS:
+            assert st["numeric"][col][stat] == pytest.approx(desc.loc[stat, col], rel=1e-9), (col, stat)
+        for stat, q in zip(QUANTILES, (0.25, 0.5, 0.75)):
+            # sai số theo hạng (rank) của sketch, không theo giá trị
+            rank = np.searchsorted(values, st["numeric"][col][stat]) / len(values)
+            assert abs(rank - q) < 0.02, (col, stat, rank)
+
+
+def test_approximate_stats_use_uniform_sample(tmp_path):
+    path, df = _dataset(tmp_path, 50_000)
+    st = stream_csv_stats(path, approximate=True, sample_size=5_000, chunksize=5_000)
+
+    assert st["approximate"] and st["sample_rows"] == 5_000
+    assert st["rows"] == len(df)  # rows / nulls vẫn đếm trên toàn file
+    assert st["missing_values"] == {"n": int(df["n"].isna().sum())}
+    x = st["numeric"]["x"]
+    assert x["count"] == 5_000
+    assert x["mean"] == pytest.approx(df["x"].mean(), abs=4 * df["x"].std() / np.sqrt(5_000))
+    assert x["50%"] == pytest.approx(df["x"].median(), abs=0.3)
+    assert df["x"].min() <= x["min"] and x["max"] <= df["x"].max()
@@ -0,0 +1,23 @@
+# tests/test_summary_lock.py
+import asyncio
+
+from services import llm
+
+
+def test_summary_lock_serializes_and_is_evicted():
+    order = []
+
+    async def worker(name: str):
+        async with llm._summary_lock("s1"):
+            order.append(f"{name}:start")
+            await asyncio.sleep(0.01)
+            order.append(f"{name}:end")
+
+    async def main():
+        await asyncio.gather(worker("a"), worker("b"), *(worker(f"x{i}") for i in range(3)))
+        async with llm._summary_lock("s2"):
+            assert set(llm._summary_locks) == {"s2"}
+
+    asyncio.run(main())
+    assert all(order[i].endswith(":start") and order[i + 1].endswith(":end") for i in range(0, len(order), 2))
+    assert llm._summary_locks == {}
@@ -0,0 +1,25 @@
+# tests/test_tool_cache_key.py
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+
+
+def _key(**env) -> str:
+    # process riêng: cấu hình render được đọc từ env lúc import
+    code = "from services import llm; print(llm._tool_cache_key('analyze_csv', 'd' * 64, {'approximate': False}))"
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=BACKEND_DIR, env={**os.environ, **env},
+        capture_output=True, text=True, check=True,
+    )
+    return out.stdout.strip()
+
+
+def test_tool_cache_key_changes_with_render_settings():
+    base = _key()
+    assert base == _key()
+    assert _key(TOOL_PAYLOAD_FORMAT="json") != base
+    assert _key(TABLE_MAX_CHARS="1234") != base
+    assert _key(TABLE_MAX_CELL_CHARS="8") != base
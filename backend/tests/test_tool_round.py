@@ -0,0 +1,70 @@
+# tests/test_tool_round.py
+import asyncio
+import json
+
+from services import llm
+
+DELAYS = {"t1": 0.06, "t2": 0.04, "t3": 0.02, "t4": 0.01}  # xong theo thứ tự ngược với tool_call
+
+
+def _tool_call(call_id: str) -> dict:
+    return {"id": call_id, "type": "function",
+            "function": {"name": "analyze_csv", "arguments": json.dumps({"csv_path": f"{call_id}.csv"})}}
+
+
+def _run_orchestrator(monkeypatch, concurrency: int):
+    """
+    OpenAI giả: lượt 1 trả 4 tool_calls, lượt 2 trả text. Tool giả ngủ DELAYS[id] và đếm số đang chạy.
+    Returns (messages model nhận ở lượt 2, số tool chạy đồng thời tối đa, thứ tự hoàn thành)
+    """
+    sent = []
+    running = {"now": 0, "max": 0}
+    finished = []
+
+    async def fake_call_openai(messages, tools=None, cache=True):
+        sent.append(list(messages))
+        if len(sent) == 1:
+            return {"choices": [{"message": {"role": "assistant", "content": None,
+                                             "tool_calls": [_tool_call(i) for i in DELAYS]}}]}
+        return {"choices": [{"message": {"role": "assistant", "content": "done"}}]}
+
+    async def fake_dispatch(db, session_id, name, tc, state):
+        running["now"] += 1
+        running["max"] = max(running["max"], running["now"])
+        try:
+            await asyncio.sleep(DELAYS[tc["id"]])
+        finally:
+            running["now"] -= 1
+        finished.append(tc["id"])
+        return {"markdown": f"result of {tc['id']}"}
+
+    monkeypatch.setattr(llm, "call_openai", fake_call_openai)
+    monkeypatch.setattr(llm, "_dispatch_tool", fake_dispatch)
+    monkeypatch.setattr(llm, "TOOL_CONCURRENCY", concurrency)
+
+    answer, _, _, _ = asyncio.run(llm.chat_orchestrator(
+        db=None, session_id="s1", message="analyze", history=[], image_path=None, csv_path=None,
+    ))
+    assert answer == "done"
+    return sent[1], running["max"], finished
+
+
+def test_tool_calls_run_concurrently(monkeypatch):
+    _, max_running, finished = _run_orchestrator(monkeypatch, concurrency=4)
+    assert max_running == 4
+    assert finished == ["t4", "t3", "t2", "t1"]
+
+
+def test_tool_concurrency_caps_parallel_calls(monkeypatch):
+    _, max_running, _ = _run_orchestrator(monkeypatch, concurrency=2)
+    assert max_running == 2
+
+
+def test_tool_messages_follow_tool_call_order(monkeypatch):
+    messages, _, _ = _run_orchestrator(monkeypatch, concurrency=4)
+    tool_msgs = [m for m in messages if m["role"] == "tool"]
+    assert [m["tool_call_id"] for m in tool_msgs] == list(DELAYS)
+    assert [json.loads(m["content"])["markdown"] for m in tool_msgs] == [f"result of {i}" for i in DELAYS]
+    # tool messages nằm ngay sau assistant message chứa tool_calls
+    idx = next(i for i, m in enumerate(messages) if m.get("tool_calls"))
+    assert messages[idx + 1: idx + 1 + len(DELAYS)] == tool_msgs
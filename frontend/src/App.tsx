@@ -1,5 +1,5 @@
 import { useEffect, useMemo, useRef, useState } from 'react';
-import { postChat, type ChatMessage, type ToolOutputs, fetchSessions, fetchSessionMessages, type SessionSummary } from './api';
+import { postChat, type ChatMessage, type ToolOutputs, fetchSessions, fetchSessionMessages, fetchJob, type SessionSummary, type MessageField } from './api';
 import { MessageBubble } from './components/MessageBubble';
 import './styles/app.scss';
 import { ErrorBanner } from './components/ErrorBanner';
@@ -12,6 +12,8 @@ function randomSession() {
 
 const MAX_FILE_MB = 20; 
 const ALLOWED_EXT = ['.png', '.jpg', '.jpeg', '.csv'];
+const HISTORY_FIELDS: MessageField[] = ['role', 'content', 'created_at', 'attachments']; // bỏ tool_outputs
+const JOB_POLL_MS = 2000;
 
 
 
@@ -30,6 +32,7 @@ export default function App() {
   const [sessionsLoading, setSessionsLoading] = useState<boolean>(false);
 
   const [messages, setMessages] = useState<ChatMessage[]>([]);
+  const [olderCursor, setOlderCursor] = useState<number | null>(null);
   const [toolForLastAssistant, setToolForLastAssistant] = useState<ToolOutputs | undefined>();
 
   const [input, setInput] = useState('');
@@ -74,22 +77,48 @@ export default function App() {
   }, [previewUrl]);
 
   // load messages when selecting sessionId (if it already exists in DB)
-  async function loadSessionMessages(id: string) {
+  // chỉ trang mới nhất; trang cũ hơn tải khi bấm "Load earlier messages"
+  async function loadSessionMessages(id: string, before: number | null = null) {
     try {
-      const res = await fetchSessionMessages(id);
+      const res = await fetchSessionMessages(id, { before, fields: HISTORY_FIELDS });
       const msgs: ChatMessage[] = res.messages.map(m => ({
         id: m.id, role: m.role, content: m.content, created_at: m.created_at, attachments: m.attachments
       }));
-      setMessages(msgs);
-      setToolForLastAssistant(undefined);
+      setMessages(prev => (before == null ? msgs : [...msgs, ...prev]));
+      setOlderCursor(res.next_before);
+      if (before == null) setToolForLastAssistant(undefined);
     } catch {
-      setMessages([]); // local new session (no messages yet)
+      if (before == null) {
+        setMessages([]); // local new session (no messages yet)
+        setOlderCursor(null);
+      }
     }
   }
 
   useEffect(() => { refreshSessions(); }, []);
   useEffect(() => { loadSessionMessages(sessionId); }, [sessionId]);
 
+  const sessionIdRef = useRef(sessionId);
+  useEffect(() => { sessionIdRef.current = sessionId; }, [sessionId]);
+
+  // job nền (file lớn): poll tới khi xong, rồi tải lại session để hiện message kết quả
+  async function watchJobs(id: string, jobIds: string[]) {
+    const pending = new Set(jobIds);
+    while (pending.size) {
+      await new Promise(resolve => setTimeout(resolve, JOB_POLL_MS));
+      for (const jobId of [...pending]) {
+        try {
+          const job = await fetchJob(jobId);
+          if (job.status !== 'queued' && job.status !== 'running') pending.delete(jobId);
+        } catch {
+          pending.delete(jobId);
+        }
+      }
+    }
+    if (sessionIdRef.current === id) loadSessionMessages(id);
+    refreshSessions();
+  }
+
   async function handleSend() {
     if (!canSend || loading) return;
     if (csvUrl && !isValidCsvUrl(csvUrl)) {
@@ -131,6 +160,7 @@ export default function App() {
 
       setToolForLastAssistant(res.tool_outputs);
       refreshSessions();
+      if (res.tool_outputs?.jobs?.length) watchJobs(sessionId, res.tool_outputs.jobs.map(j => j.id));
     } catch (e: any) {
       showError(e?.message || 'Unexpected error.');
       setMessages((m) => [...m, { role: 'assistant', content: `❌ ${e.message}`, ts: Date.now() }]);
@@ -246,6 +276,13 @@ export default function App() {
                 Ask me anything. Attach an <b>image</b> or a <b>CSV</b>, or paste a <b>CSV URL</b>.
               </div>
             )}
+            {olderCursor != null && (
+              <div style={{textAlign:'center', margin:'0 0 1rem'}}>
+                <button className="load-older" onClick={() => loadSessionMessages(sessionId, olderCursor)}>
+                  Load earlier messages
+                </button>
+              </div>
+            )}
             {messages.map((m, idx) => (
               <div key={m.id ?? idx}>
                 <MessageBubble m={m} tool={idx === messages.length - 1 ? toolForLastAssistant : undefined} />
@@ -5,6 +5,28 @@ export type ToolOutputs = {
   basic_stats?: Record<string, unknown>;
   missing_values?: Record<string, number>;
   histogram_image?: string;
+  histogram_images?: string[];
+  jobs?: JobRef[];
+};
+
+export type JobStatus = 'queued' | 'running' | 'done' | 'error' | 'cancelled';
+
+// job nền cho file lớn: kết quả đến sau thành một assistant message mới
+export type JobRef = { id: string; kind: string; status: JobStatus; status_url: string };
+
+export type JobInfo = {
+  id: string;
+  session_id: string;
+  kind: string;
+  status: JobStatus;
+  progress: number; // 0..1
+  markdown: string | null;
+  error: string | null;
+  message_id: number | null;
+  attempts: number;
+  created_at: string | null;
+  started_at: string | null;
+  finished_at: string | null;
 };
 
 export type AttachmentKind = 'image' | 'csv' | 'plot';
@@ -62,10 +84,10 @@ export type SessionSummary = {
   message_count: number;
 };
 
-export type SessionListResponse = { sessions: SessionSummary[]; offset: number; limit: number };
+export type SessionListResponse = { sessions: SessionSummary[]; limit: number; next_cursor: string | null };
 
 export type SessionMessagesResponse = {
-  session: { id: string; title: string | null; created_at: string; updated_at: string };
+  session: { id: string; title: string | null; created_at: string; updated_at: string; message_count: number };
   messages: Array<{
     id: number;
     role: 'user' | 'assistant';
@@ -74,6 +96,18 @@ export type SessionMessagesResponse = {
     created_at: string;
     attachments: Attachment[];
   }>;
+  limit: number;
+  next_before: number | null; // id để tải trang cũ hơn
+  next_after: number | null;
+};
+
+export type MessageField = 'role' | 'content' | 'tool_outputs' | 'created_at' | 'attachments';
+
+export type FetchMessagesOptions = {
+  before?: number | null;
+  after?: number | null;
+  limit?: number;
+  fields?: MessageField[];
 };
 
 const API_BASE = import.meta.env.VITE_API_BASE as string;
@@ -103,14 +137,89 @@ export async function postChat(
 }
 
 
-export async function fetchSessions(limit = 50, offset = 0): Promise<SessionListResponse> {
-  const res = await fetch(`${API_BASE}/sessions?limit=${limit}&offset=${offset}`);
+export type ChatStreamEvent =
+  | { type: 'user_message'; session_id: string; id: number; attachments: AttachmentInfo[] }
+  | { type: 'delta'; content: string }
+  | { type: 'tool_start'; id: string; name: string }
+  | { type: 'tool_end'; id: string; name: string; error?: string | null; attachments: AttachmentInfo[] }
+  | ({ type: 'done' } & Omit<ChatResponse, 'user_message'>)
+  | { type: 'error'; detail: string };
+
+export async function postChatStream(
+  payload: { session_id: string; message: string; file?: File | null; csv_url?: string | null },
+  onEvent: (ev: ChatStreamEvent) => void,
+  signal?: AbortSignal
+): Promise<void> {
+  const fd = new FormData();
+  fd.append('session_id', payload.session_id);
+  fd.append('message', payload.message);
+  if (payload.file) fd.append('file', payload.file);
+  if (payload.csv_url) fd.append('csv_url', payload.csv_url);
+
+  const res = await fetch(`${API_BASE}/chat/stream`, { method: 'POST', body: fd, signal });
+
+  if (!res.ok || !res.body) {
+    let msg = `Request failed (${res.status})`;
+    try {
+      const data = await res.json();
+      msg = (data?.detail as string) ?? JSON.stringify(data);
+    } catch {
+      msg = await res.text();
+    }
+    throw new Error(msg || `Request failed (${res.status})`);
+  }
+
+  const reader = res.body.pipeThrough(new TextDecoderStream()).getReader();
+  let buf = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buf += value;
+
+    // SSE frames are separated by a blank line
+    let sep: number;
+    while ((sep = buf.indexOf('\n\n')) !== -1) {
+      const frame = buf.slice(0, sep);
+      buf = buf.slice(sep + 2);
+
+      let event = 'message';
+      const dataLines: string[] = [];
+      for (const line of frame.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+      }
+      if (!dataLines.length) continue;
+      const data = JSON.parse(dataLines.join('\n'));
+      onEvent({ ...data, type: event } as ChatStreamEvent);
+    }
+  }
+}
+
+
+export async function fetchSessions(limit = 50, cursor?: string | null): Promise<SessionListResponse> {
+  const qs = new URLSearchParams({ limit: String(limit) });
+  if (cursor) qs.set('cursor', cursor);
+  const res = await fetch(`${API_BASE}/sessions?${qs}`);
   if (!res.ok) throw new Error(`Fetch sessions failed (${res.status})`);
   return res.json();
 }
 
-export async function fetchSessionMessages(session_id: string): Promise<SessionMessagesResponse> {
-  const res = await fetch(`${API_BASE}/sessions/${session_id}/messages`);
+export async function fetchSessionMessages(
+  session_id: string,
+  opts: FetchMessagesOptions = {}
+): Promise<SessionMessagesResponse> {
+  const qs = new URLSearchParams();
+  if (opts.before != null) qs.set('before', String(opts.before));
+  if (opts.after != null) qs.set('after', String(opts.after));
+  if (opts.limit) qs.set('limit', String(opts.limit));
+  if (opts.fields?.length) qs.set('fields', opts.fields.join(','));
+  const res = await fetch(`${API_BASE}/sessions/${session_id}/messages?${qs}`);
   if (!res.ok) throw new Error(`Fetch messages failed (${res.status})`);
   return res.json();
-}
\ No newline at end of file
+}
+
+export async function fetchJob(id: string): Promise<JobInfo> {
+  const res = await fetch(`${API_BASE}/jobs/${id}`);
+  if (!res.ok) throw new Error(`Fetch job failed (${res.status})`);
+  return res.json();
+}